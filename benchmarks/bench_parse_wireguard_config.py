@@ -0,0 +1,90 @@
+"""Scaling benchmark for the parse_wireguard_config filter.
+
+Parses synthetic hub configs with 1k, 10k and 100k peers and reports the cost
+per peer. The parser is a single pass over the text, so the per-peer cost must
+stay flat as the config grows; the script exits non-zero if the largest config
+costs more than MAX_SLOPE times the smallest one per peer. The parse cache is
+cleared before every call so the scan itself is what gets timed.
+
+It also reports the peak memory of parsing the largest config into a dict
+versus streaming it through iter_wireguard_peers, which only holds one peer.
+
+Run with: uv run python benchmarks/bench_parse_wireguard_config.py
+"""
+
+import io
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'filter_plugins'))
+
+import wireguard_filters  # noqa: E402
+from wireguard_filters import iter_wireguard_peers, parse_wireguard_config  # noqa: E402
+
+SIZES = (1_000, 10_000, 100_000)
+MAX_SLOPE = 2.0
+
+
+def synthetic_hub_config(peer_count):
+    """Return a wg0.conf like the control-plane template renders, with peer_count peers."""
+    parts = [
+        "[Interface]\n"
+        "Address = 10.130.5.1/24\n"
+        "ListenPort = 51820\n"
+        "PrivateKey = aDUMMYprivateKEY1234567890abcdefGHIJKLMNOP=\n"
+        "# PublicKey = bDUMMYpublicKEY1234567890abcdefGHIJKLMNOPQ=\n"
+        "\n"
+        "# Worker nodes\n"
+    ]
+    for i in range(peer_count):
+        parts.append(
+            "[Peer]\n"
+            f"# peer-{i}\n"
+            f"PublicKey = {i:043d}=\n"
+            f"AllowedIPs = 10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}/32\n"
+            "\n"
+        )
+    return ''.join(parts)
+
+
+def parse_uncached(text):
+    wireguard_filters._parse_cache.clear()
+    return parse_wireguard_config(text)
+
+
+def peak_memory(func):
+    """Peak traced allocation in bytes while running func."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    per_peer = {}
+    print(f"{'peers':>8} {'total ms':>10} {'us/peer':>9}")
+    for size in SIZES:
+        text = synthetic_hub_config(size)
+        assert len(parse_wireguard_config(text)['peers']) == size
+        repeat = max(1, 100_000 // size)
+        best = min(timeit.repeat(lambda: parse_uncached(text), number=repeat, repeat=5)) / repeat
+        per_peer[size] = best / size
+        print(f"{size:>8} {best * 1e3:>10.2f} {per_peer[size] * 1e6:>9.3f}")
+
+    slope = per_peer[SIZES[-1]] / per_peer[SIZES[0]]
+    print(f"per-peer cost ratio {SIZES[-1]}/{SIZES[0]}: {slope:.2f} (limit {MAX_SLOPE})")
+
+    data = synthetic_hub_config(SIZES[-1]).encode()
+    dict_peak = peak_memory(lambda: parse_uncached(data.decode()))
+    stream_peak = peak_memory(lambda: sum(1 for _ in iter_wireguard_peers(io.BytesIO(data))))
+    print(f"peak memory at {SIZES[-1]} peers: dict {dict_peak / 2**20:.1f} MiB, "
+          f"streamed {stream_peak / 2**20:.2f} MiB")
+    return 0 if slope <= MAX_SLOPE else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
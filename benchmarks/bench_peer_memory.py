@@ -0,0 +1,56 @@
+"""Memory benchmark for the filter plugin's internal peer representation.
+
+Parses a synthetic hub config with 10k peers and measures how much memory the
+parsed peers take as one dict per peer (what the filters return to Ansible,
+and what the parse cache used to hold) versus the slotted _PeerRecord tuples
+the plugin now keeps internally. Strings are shared between both forms, so
+the difference is the per-peer container overhead. The last row builds the
+records from dicts, so it also counts the parsed fields (AllowedIPs networks,
+endpoint port) each record carries.
+
+Run with: uv run python benchmarks/bench_peer_memory.py
+"""
+
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'filter_plugins'))
+
+from bench_parse_wireguard_config import synthetic_hub_config  # noqa: E402
+from wireguard_filters import _PeerRecord, _parse_config_text  # noqa: E402
+
+PEERS = 10_000
+
+
+def retained_bytes(build):
+    """Bytes still allocated after build() returns (its result is kept alive)."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return after - before
+
+
+def main():
+    records = _parse_config_text(synthetic_hub_config(PEERS))['peers']
+    assert len(records) == PEERS
+
+    as_dicts = retained_bytes(lambda: {peer.name: peer.as_dict() for peer in records})
+    as_records = retained_bytes(lambda: tuple(_PeerRecord(*peer) for peer in records))
+    dicts = [(peer.name, peer.as_dict()) for peer in records]
+    parsed = retained_bytes(lambda: tuple(_PeerRecord.from_dict(name, peer) for name, peer in dicts))
+
+    print(f"{'representation':>16} {'total KiB':>10} {'bytes/peer':>11}")
+    for label, size in (('dict per peer', as_dicts), ('_PeerRecord', as_records), ('with parsed', parsed)):
+        print(f"{label:>16} {size / 1024:>10.1f} {size / PEERS:>11.1f}")
+    print(f"records use {as_records / as_dicts:.0%} of the dict footprint at {PEERS} peers")
+    return 0 if as_records < as_dicts else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""Jinja vs native rendering benchmark for wg0.conf.
+
+Builds synthetic inventories of 50, 500 and 5000 hosts with
+tests/synthetic_inventory.py (one control plane, home workers in direct-peer
+groups of about GROUP_SIZE) and renders a sample of hosts
+both through roles/wireguard/templates/wg0.conf.j2, with the Jinja environment
+tests/test_wireguard_template.py builds, and through the
+wireguard_topology + render_wireguard_config filters fed the direct-peer index
+that site.yml builds once per play. Each Jinja render scans the whole inventory
+(so a full play is O(hosts^2)); the native render only reads the host's group.
+Totals are projected as per-host cost * hosts (+ one index build).
+
+Hostvars here are plain dicts; under Ansible each lookup is a lazy templated
+access, which widens the gap further.
+
+Run with: uv run python benchmarks/bench_render_wireguard_config.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT / 'filter_plugins'))
+sys.path.insert(0, str(ROOT / 'tests'))
+
+from wireguard_filters import (  # noqa: E402
+    render_wireguard_config,
+    wireguard_direct_peer_index,
+    wireguard_topology,
+)
+from synthetic_inventory import generate_inventory, hostvars_and_groups  # noqa: E402
+from test_wireguard_template import wireguard_jinja_env  # noqa: E402
+
+SIZES = (50, 500, 5000)
+GROUP_SIZE = 10
+SAMPLE = 10
+
+
+def main():
+    template = wireguard_jinja_env().get_template('wg0.conf.j2')
+    print(f"{'hosts':>6} {'jinja ms/host':>14} {'native ms/host':>15} {'speedup':>8} "
+          f"{'jinja total s':>14} {'native total s':>15}")
+    for size in SIZES:
+        hostvars, groups = hostvars_and_groups(generate_inventory(size, direct_peer_groups=size // GROUP_SIZE))
+        step = max(1, (size - 1) // SAMPLE)
+        sample = groups['workers'][::step][:SAMPLE]
+        contexts = [dict(hostvars[host], groups=groups, hostvars=hostvars) for host in sample]
+
+        index = wireguard_direct_peer_index(hostvars, groups['all'])
+        for context in contexts:
+            native = render_wireguard_config(wireguard_topology(context, hostvars, groups, index))
+            assert native == template.render(context), context['inventory_hostname']
+
+        def render_jinja():
+            for context in contexts:
+                template.render(context)
+
+        def render_native():
+            for context in contexts:
+                render_wireguard_config(wireguard_topology(context, hostvars, groups, index))
+
+        jinja = min(timeit.repeat(render_jinja, number=1, repeat=3)) / len(contexts)
+        native = min(timeit.repeat(render_native, number=1, repeat=3)) / len(contexts)
+        index_build = min(timeit.repeat(lambda: wireguard_direct_peer_index(hostvars, groups['all']),
+                                        number=1, repeat=3))
+        print(f"{size:>6} {jinja * 1e3:>14.3f} {native * 1e3:>15.3f} {jinja / native:>7.1f}x "
+              f"{jinja * size:>14.2f} {native * size + index_build:>15.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""pytest-benchmark suite for the WireGuard filters and the wg0.conf.j2 template.
+
+Times parse_wireguard_config, merge_wireguard_peers, filter_peers_by_inventory,
+aggregate_wireguard_peers and template rendering at 10, 100, 1k and 10k peers
+(or AllowedIPs prefixes). The template is rendered
+through the Jinja environment tests/test_wireguard_template.py builds, and the
+native render_wireguard_config path site.yml uses is timed next to it.
+
+Baselines live in benchmarks/baselines (one directory per platform and Python
+version). `just bench` compares against the latest one and fails if any
+benchmark's median time is more than 50% slower; `just bench-save` records a
+new baseline after an intended change or on new hardware, from a clean commit.
+GC is disabled while timing, and every benchmark warms up and then runs at
+least 25 rounds. The best time of a sub-millisecond benchmark swings by more
+than 25% from run to run, so the gate compares medians with a wide margin and
+catches algorithmic regressions rather than noise.
+
+Run with: just bench
+"""
+
+import sys
+from functools import cache
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT / 'filter_plugins'))
+sys.path.insert(0, str(ROOT / 'tests'))
+
+import wireguard_filters  # noqa: E402
+from bench_parse_wireguard_config import synthetic_hub_config  # noqa: E402
+from synthetic_inventory import generate_inventory, hostvars_and_groups  # noqa: E402
+from test_wireguard_template import wireguard_jinja_env  # noqa: E402
+from wireguard_filters import (  # noqa: E402
+    aggregate_wireguard_peers,
+    collapse_allowed_ips,
+    filter_peers_by_inventory,
+    merge_wireguard_peers,
+    parse_wireguard_config,
+    parse_wireguard_peers,
+    render_wireguard_config,
+    wireguard_direct_peer_index,
+    wireguard_topology,
+)
+
+SIZES = (10, 100, 1_000, 10_000)
+STATIC_PEERS = 5
+GROUP_SIZE = 10
+
+
+@cache
+def hub_config(size):
+    return synthetic_hub_config(size)
+
+
+@cache
+def peer_layers(size):
+    """(existing, new, static) peer dicts as merge_peer_config.yml passes them.
+
+    The new layer re-addresses every other existing peer, so half the merge is
+    updates; the static layer adds a few peers outside the worker range.
+    """
+    existing = parse_wireguard_peers(hub_config(size))
+    new = {
+        name: dict(peer, allowed_ips=f"10.200.{(index >> 8) & 255}.{index & 255}/32")
+        for index, (name, peer) in enumerate(existing.items())
+        if index % 2 == 0
+    }
+    static = {
+        f'static-{index}': {'public_key': f'static-key-{index}=', 'allowed_ips': f'10.250.0.{index}/32'}
+        for index in range(STATIC_PEERS)
+    }
+    return existing, new, static
+
+
+@cache
+def inventory(size):
+    """(hostvars, groups, direct-peer index) of a generated inventory with a control plane plus size workers."""
+    inventory = generate_inventory(size + 1, static_peers=STATIC_PEERS, direct_peer_groups=max(1, size // GROUP_SIZE))
+    hostvars, groups = hostvars_and_groups(inventory)
+    return hostvars, groups, wireguard_direct_peer_index(hostvars, groups['all'])
+
+
+def render_context(size, role):
+    """Template context of the hub ('control_plane') or of the last worker (a home worker in a direct-peer group)."""
+    hostvars, groups, _ = inventory(size)
+    if role == 'control_plane':
+        merged = {name: {'public_key': hostvars[name]['wireguard_public_key'],
+                         'allowed_ips': f"{hostvars[name]['wireguard_ip']}/32"}
+                  for name in groups['workers']}
+        hub = groups['control_plane'][0]
+        return dict(hostvars[hub], groups=groups, hostvars=hostvars, wireguard_merged_peers=merged)
+    return dict(hostvars[groups['workers'][-1]], groups=groups, hostvars=hostvars)
+
+
+def parse_uncached(text):
+    wireguard_filters._parse_cache.clear()
+    return parse_wireguard_config(text)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_parse_wireguard_config(benchmark, size):
+    """Parsing a hub config (cache cleared, so the scan itself is timed)."""
+    result = benchmark(parse_uncached, hub_config(size))
+    assert len(result['peers']) == size
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_merge_wireguard_peers(benchmark, size):
+    """Three-layer merge with conflict detection, as merge_peer_config.yml runs it."""
+    existing, new, static = peer_layers(size)
+    result = benchmark(merge_wireguard_peers, existing, new, static)
+    assert len(result) == size + STATIC_PEERS
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_filter_peers_by_inventory(benchmark, size):
+    """Pruning peers against the inventory and static peers, with a report."""
+    existing, _, static = peer_layers(size)
+    peers = dict(existing, **static)
+    # every tenth peer has left the inventory
+    hosts = [name for index, name in enumerate(existing) if index % 10]
+    result = benchmark(filter_peers_by_inventory, peers, hosts, static, report=True)
+    assert len(result['pruned']) == len(existing) - len(hosts)
+
+
+@cache
+def block_peers(size):
+    """size /32 prefixes over size // 4 peers, each owning an aligned /30 listed host by host."""
+    return {
+        f'device-{index}': {
+            'public_key': f'device-key-{index}=',
+            'allowed_ips': ', '.join(f"10.130.{address >> 8}.{address & 255}/32"
+                                     for address in range(index * 4, index * 4 + 4)),
+        }
+        for index in range(max(size // 4, 1))
+    }
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_aggregate_wireguard_peers(benchmark, size):
+    """Collapsing every peer's AllowedIPs and sweeping all prefixes for overlaps."""
+    result = benchmark(aggregate_wireguard_peers, block_peers(size))
+    assert all(peer['allowed_ips'].endswith('/30') for peer in result.values())
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_collapse_allowed_ips(benchmark, size):
+    """One peer owning size adjacent /32s, listed in reverse order."""
+    allowed_ips = ', '.join(f"10.130.{address >> 8}.{address & 255}/32" for address in reversed(range(size)))
+    result = benchmark(collapse_allowed_ips, allowed_ips)
+    assert len(result.split(', ')) <= 8
+
+
+@pytest.mark.parametrize("role", ['control_plane', 'worker'])
+@pytest.mark.parametrize("size", SIZES)
+def test_render_template(benchmark, size, role):
+    """Rendering wg0.conf.j2; a worker render scans the whole inventory."""
+    template = wireguard_jinja_env().get_template('wg0.conf.j2')
+    context = render_context(size, role)
+    result = benchmark(template.render, context)
+    assert result.startswith('[Interface]')
+
+
+@pytest.mark.parametrize("role", ['control_plane', 'worker'])
+@pytest.mark.parametrize("size", SIZES)
+def test_render_native(benchmark, size, role):
+    """The wireguard_topology + render_wireguard_config path site.yml uses."""
+    hostvars, groups, index = inventory(size)
+    context = render_context(size, role)
+    template = wireguard_jinja_env().get_template('wg0.conf.j2')
+
+    def render():
+        return render_wireguard_config(wireguard_topology(context, hostvars, groups, index))
+
+    assert render() == template.render(context)
+    benchmark(render)
@@ -1,17 +1,121 @@
 """Custom Ansible filters for WireGuard configuration parsing and manipulation."""
 
-from configparser import ConfigParser
+import binascii
+import difflib
+import hashlib
+import importlib.util
+import io
+import ipaddress
+import json
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
 from io import StringIO
+from pathlib import Path
 
+try:
+    from ansible.errors import AnsibleFilterError
+except ImportError:  # allows the unit tests to import this module without Ansible
+    AnsibleFilterError = ValueError
 
-def parse_wireguard_config(config_text):
+try:
+    from ansible.module_utils.wireguard_parse import parse_wg_dump, scan_config_lines
+except ImportError:
+    # The playbook-adjacent module_utils is only a package inside modules;
+    # on the controller (and in the unit tests) load the file itself
+    _spec = importlib.util.spec_from_file_location(
+        '_wireguard_parse', Path(__file__).resolve().parent.parent / 'module_utils' / 'wireguard_parse.py')
+    _wireguard_parse = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(_wireguard_parse)
+    parse_wg_dump, scan_config_lines = _wireguard_parse.parse_wg_dump, _wireguard_parse.scan_config_lines
+
+# Parsed configs, keyed by a digest of their text, most recently used last.
+# Ansible templates each task in a forked worker, so hits come from repeated
+# parses within one task (ensure_keys.yml parses the same slurp in both
+# `when:` and `content:`) or from tooling that calls the filters in-process.
+_PARSE_CACHE_SIZE = 32
+_parse_cache = OrderedDict()
+_parse_cache_stats = {'hits': 0, 'misses': 0}
+
+# Layout version of the controller-side peer cache records; records of any other
+# version are ignored, so bumping it invalidates every cached file
+_PEER_CACHE_VERSION = 1
+
+# Round trip above which a same-site pair is taken to relay through the hub: a
+# direct LAN path is sub-millisecond, the relayed one ~16ms
+_RELAY_RTT_MS = 5.0
+
+# Sentinel for "variable not defined", which differs from defined-but-empty
+_MISSING = object()
+
+
+class _PeerRecord(namedtuple('_PeerRecord', 'name public_key allowed_ips endpoint persistent_keepalive '
+                                            'networks endpoint_host endpoint_port keepalive')):
+    """
+    Immutable, slotted form of one peer, used inside this module.
+
+    Holds what a peer dict holds (endpoint and persistent_keepalive are None
+    when the key is absent) plus the parsed views of those strings, filled in
+    once by build(): the AllowedIPs networks (entries that are not networks
+    are skipped), the endpoint host and int port, and PersistentKeepalive in
+    seconds (None when unset or off). The container is about half the size
+    of a dict (see benchmarks/bench_peer_memory.py). Filters convert to plain
+    dicts with as_dict() before returning anything to Ansible.
+    """
+
+    __slots__ = ()
+
+    # The fields a peer dict holds, in the order diffs report them
+    text_fields = ('name', 'public_key', 'allowed_ips', 'endpoint', 'persistent_keepalive')
+
+    @classmethod
+    def build(cls, name, public_key, allowed_ips, endpoint, persistent_keepalive):
+        networks = []
+        for entry in _split_allowed_ips(allowed_ips):
+            try:
+                networks.append(ipaddress.ip_network(entry, strict=False))
+            except ValueError:
+                continue
+        host, port = _split_endpoint(endpoint) if endpoint else (None, '')
+        keepalive = persistent_keepalive
+        keepalive = int(keepalive) or None if keepalive and keepalive.isdigit() else None
+        return cls(name, public_key, allowed_ips, endpoint, persistent_keepalive,
+                   tuple(networks), host, int(port) if port.isdigit() else None, keepalive)
+
+    @classmethod
+    def from_dict(cls, name, peer):
+        return cls.build(name, peer.get('public_key'), peer.get('allowed_ips') or '',
+                         peer.get('endpoint'), peer.get('persistent_keepalive'))
+
+    def as_dict(self):
+        peer = {'public_key': self.public_key, 'allowed_ips': self.allowed_ips}
+        if self.endpoint is not None:
+            peer['endpoint'] = self.endpoint
+        if self.persistent_keepalive is not None:
+            peer['persistent_keepalive'] = self.persistent_keepalive
+        return peer
+
+    def live_fields(self):
+        """The settings the kernel holds for this peer, in comparable form."""
+        return frozenset(self.networks), self.endpoint or None, self.keepalive
+
+
+def parse_wireguard_config(config_text, encoding=None):
     """
     Parse WireGuard configuration and extract both interface and peer information.
 
     WireGuard configs are INI-like format with [Interface] and [Peer] sections.
+    Results are memoized by a digest of the text (bounded LRU), so parsing the
+    same content again costs a hash plus a copy.
+
+    A slurp result can be passed as is (``slurp_result | parse_wireguard_config``):
+    its base64 content is decoded to bytes and scanned line by line through a
+    memoryview, without first building the whole decoded string. A slurp of a
+    missing file (registered with failed_when: false) parses as an empty config.
 
     Args:
-        config_text: String content of WireGuard configuration file
+        config_text: String content of WireGuard configuration file, UTF-8
+            bytes, a slurp result, or base64 text with encoding='base64'
+        encoding: 'base64' when config_text is base64 text
 
     Returns:
         Dictionary with 'interface' and 'peers' keys:
@@ -32,92 +136,167 @@ def parse_wireguard_config(config_text):
             }
         }
     """
-    if not config_text or not config_text.strip():
-        return {'interface': {}, 'peers': {}}
+    parsed = _parse_cached(_config_source(config_text, encoding))
+    # Hand out copies so a caller mutating its result can't corrupt the cache
+    return {
+        'interface': dict(parsed['interface']),
+        'peers': {peer.name: peer.as_dict() for peer in parsed['peers']},
+    }
+
+
+def _config_source(config, encoding=None):
+    """Config text (str) or UTF-8 bytes from any input the parse filters accept."""
+    if isinstance(config, Mapping):
+        # slurp result; a failed slurp has no content
+        encoding = config.get('encoding', 'base64')
+        config = config.get('content') or ''
+    if encoding == 'base64':
+        try:
+            return binascii.a2b_base64(config)
+        except (binascii.Error, ValueError) as e:
+            raise AnsibleFilterError(f"WireGuard config is not valid base64: {e}") from e
+    if encoding not in (None, 'utf-8'):
+        raise AnsibleFilterError(f"Unsupported WireGuard config encoding '{encoding}'")
+    if isinstance(config, (bytearray, memoryview)):
+        return bytes(config)
+    return config
+
+
+def _parse_cached(config_text):
+    """
+    Memoized parse of str or bytes: {'interface': dict, 'peers': tuple of _PeerRecord}.
+
+    Callers must not mutate the result. The digest is taken over the UTF-8
+    bytes, so text and bytes of the same config share one cache entry.
+    """
+    # (bytes are not stripped: that would copy them, and blank bytes parse empty anyway)
+    if not config_text or (isinstance(config_text, str) and not config_text.strip()):
+        return {'interface': {}, 'peers': ()}
 
+    if isinstance(config_text, bytes):
+        digest = hashlib.blake2b(config_text, digest_size=16).digest()
+    else:
+        digest = hashlib.blake2b(config_text.encode('utf-8', 'surrogateescape'), digest_size=16).digest()
+    parsed = _parse_cache.get(digest)
+    if parsed is None:
+        _parse_cache_stats['misses'] += 1
+        parsed = _parse_config_text(config_text)
+        _parse_cache[digest] = parsed
+        if len(_parse_cache) > _PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+    else:
+        _parse_cache_stats['hits'] += 1
+        _parse_cache.move_to_end(digest)
+    return parsed
+
+
+def _parse_config_text(config_text):
+    """Scan str or bytes config_text into {'interface': dict, 'peers': tuple of _PeerRecord}."""
     interface = {}
-    peers = {}
-    current_section = None
-    current_comment = None
-    current_data = None
+    # A later peer with the same name replaces an earlier one but keeps its
+    # position, as dict assignment would.
+    lines = _config_lines(config_text)
+    peers = {name: _peer_record(name, data) for name, data in scan_config_lines(lines, interface)}
+    return {'interface': interface, 'peers': tuple(peers.values())}
 
-    lines = config_text.split('\n')
 
-    for line in lines:
-        stripped = line.strip()
-
-        # Check for comments
-        if stripped.startswith('#'):
-            comment_text = stripped[1:].strip()
-            # Check if this is a PublicKey comment in interface section
-            if current_section == 'interface' and 'publickey' in comment_text.lower():
-                # Extract public key from comment like "# PublicKey = base64key..."
-                if '=' in comment_text:
-                    key_part = comment_text.split('=', 1)[0].strip().lower()
-                    value_part = comment_text.split('=', 1)[1].strip()
-                    if key_part == 'publickey':
-                        interface['public_key'] = value_part
-            else:
-                # Regular comment (peer name, etc.)
-                current_comment = comment_text
-            continue
+def _peer_record(name, data):
+    """Record for the keys of a [Peer] section, as scan_config_lines yields them."""
+    return _PeerRecord.build(
+        name,
+        data['publickey'],
+        data.get('allowedips', ''),
+        data.get('endpoint'),
+        data.get('persistentkeepalive'),
+    )
 
-        # Check for section headers
-        if stripped.startswith('['):
-            # Save previous peer if exists
-            if current_section == 'peer' and current_data and current_data.get('publickey'):
-                peer_name = current_comment or current_data['publickey'][:12]
-                peers[peer_name] = {
-                    'public_key': current_data['publickey'],
-                    'allowed_ips': current_data.get('allowedips', ''),
-                }
-                if 'endpoint' in current_data:
-                    peers[peer_name]['endpoint'] = current_data['endpoint']
-                if 'persistentkeepalive' in current_data:
-                    peers[peer_name]['persistent_keepalive'] = current_data['persistentkeepalive']
 
-            # Start new section
-            if '[Peer]' in stripped:
-                current_section = 'peer'
-                current_data = {}
-                current_comment = None
-            elif '[Interface]' in stripped:
-                current_section = 'interface'
-                current_data = interface
-                current_comment = None
-            continue
+def iter_wireguard_peers(source):
+    """
+    Yield the peers of a WireGuard config one at a time.
 
-        # Parse key-value pairs
-        if '=' in stripped and current_data is not None:
-            key, value = stripped.split('=', 1)
-            key = key.strip().lower()
-            value = value.strip()
-            current_data[key] = value
-
-    # Don't forget the last peer
-    if current_section == 'peer' and current_data and current_data.get('publickey'):
-        peer_name = current_comment or current_data['publickey'][:12]
-        peers[peer_name] = {
-            'public_key': current_data['publickey'],
-            'allowed_ips': current_data.get('allowedips', ''),
-        }
-        if 'endpoint' in current_data:
-            peers[peer_name]['endpoint'] = current_data['endpoint']
-        if 'persistentkeepalive' in current_data:
-            peers[peer_name]['persistent_keepalive'] = current_data['persistentkeepalive']
+    Reads the source line by line and holds only the current [Peer] section,
+    so scanning many large files (e.g. the backup copies kept next to wg0.conf)
+    needs memory for one peer rather than one whole config.
+    dict(iter_wireguard_peers(text)) equals parse_wireguard_peers(text).
 
-    return {'interface': interface, 'peers': peers}
+    Args:
+        source: Config as str, bytes (UTF-8), or a text or binary file object
+
+    Yields:
+        (peer_name, peer) tuples, peer shaped as in parse_wireguard_peers
+    """
+    peers = scan_config_lines(_config_lines(source), {})
+    return ((name, _peer_record(name, data).as_dict()) for name, data in peers)
 
 
-def parse_wireguard_peers(config_text):
+def _config_lines(source):
+    """Iterate the lines of a str, bytes or file-like config, splitting on '\\n' only."""
+    if source is None:
+        return iter(())
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return _byte_lines(source)
+    if isinstance(source, str):
+        # StringIO splits like str.split without materialising a list of lines
+        return StringIO(source)
+    if isinstance(source, io.TextIOBase):
+        return source
+    # Binary file object: decoded here rather than through io.TextIOWrapper,
+    # which would close the caller's file when it is garbage-collected
+    return _binary_file_lines(source)
+
+
+def _binary_file_lines(source):
+    """Decode the lines of a binary file object (split on b'\\n'), leaving the file open."""
+    for line in source:
+        yield str(line, 'utf-8', 'surrogateescape')
+
+
+def _byte_lines(data):
+    """Decode UTF-8 bytes one line at a time through a memoryview, never the whole buffer at once."""
+    if not isinstance(data, (bytes, bytearray)):
+        data = bytes(data)
+    view = memoryview(data)
+    size = len(data)
+    start = 0
+    while start < size:
+        end = data.find(b'\n', start)
+        end = size if end < 0 else end + 1
+        yield str(view[start:end], 'utf-8', 'surrogateescape')
+        start = end
+
+
+def wireguard_parse_cache_info(_value=None):
+    """
+    Report parse cache statistics for debugging (e.g. in a -vvv debug task).
+
+    The input is ignored; it only exists because Jinja filters need one.
+    Counters are per process, so read them in the same task that parsed.
+
+    Returns:
+        Dictionary with 'hits', 'misses', 'size' and 'maxsize' counts
+    """
+    return {
+        'hits': _parse_cache_stats['hits'],
+        'misses': _parse_cache_stats['misses'],
+        'size': len(_parse_cache),
+        'maxsize': _PARSE_CACHE_SIZE,
+    }
+
+
+def parse_wireguard_peers(config_text, encoding=None):
     """
     Parse WireGuard configuration and extract peer information.
 
     This is a convenience wrapper around parse_wireguard_config that returns
-    only the peers dictionary for backward compatibility.
+    only the peers dictionary for backward compatibility. File objects are
+    streamed through iter_wireguard_peers instead.
 
     Args:
-        config_text: String content of WireGuard configuration file
+        config_text: String content of WireGuard configuration file, UTF-8
+            bytes, a slurp result, base64 text with encoding='base64', or a
+            text or binary file object
+        encoding: 'base64' when config_text is base64 text
 
     Returns:
         Dictionary mapping peer names to their configuration:
@@ -130,64 +309,1280 @@ def parse_wireguard_peers(config_text):
             }
         }
     """
-    result = parse_wireguard_config(config_text)
-    return result.get('peers', {})
+    if hasattr(config_text, 'read'):
+        # a file object: stream it rather than reading it whole
+        return dict(iter_wireguard_peers(config_text))
+    return {peer.name: peer.as_dict() for peer in _parse_cached(_config_source(config_text, encoding))['peers']}
+
+
+def load_wireguard_peer_cache(path, config_stat=None, public_key=None):
+    """
+    Read a host's cached peer state from its controller-side JSON file, if still valid.
+
+    site.yml collects the deployed config's state with the wireguard_state
+    module (one remote call) and passes its 'config' here. A record whose
+    digest equals that checksum holds exactly the peers parsing the file would
+    give, so the module can leave them out of its result.
+
+    Args:
+        path: Cache file on the controller (written by wireguard_peer_cache_record)
+        config_stat: The wireguard_state module's 'config', or a registered stat
+            result of the config (or its 'stat' dictionary) taken with
+            checksum_algorithm: sha256
+        public_key: The host's current public key; a record saved under another
+            key (the keys were rotated since) is not used
+
+    Returns:
+        The cached record ({'version', 'digest', 'mtime', 'public_key', 'peers'}),
+        or {} when there is nothing usable: no or unreadable cache file, another
+        record version, a changed or missing config, or a rotated key
+    """
+    stat = (config_stat or {}).get('stat', config_stat or {})
+    if not stat.get('exists') or not stat.get('checksum'):
+        return {}
+    record = _read_peer_cache(path, public_key)
+    if record.get('digest') != stat['checksum']:
+        return {}
+    return record
+
+
+def wireguard_peer_cache_digest(path, public_key=None):
+    """
+    Digest of the config a host's cache record was saved from, or '' without a usable record.
+
+    Passed to the wireguard_state module as config_checksum before anything is
+    known about the host, so that an unchanged config is not parsed and
+    returned again.
+
+    Example:
+        config_checksum: "{{ wireguard_peer_cache_file | wireguard_peer_cache_digest(wireguard_public_key) }}"
+    """
+    return _read_peer_cache(path, public_key).get('digest') or ''
+
+
+def _read_peer_cache(path, public_key=None):
+    """The record in a cache file, or {} when it is missing, corrupt, outdated or for another key."""
+    try:
+        with open(path, encoding='utf-8') as cache_file:
+            record = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(record, dict) or record.get('version') != _PEER_CACHE_VERSION:
+        return {}
+    if not isinstance(record.get('peers'), dict):
+        return {}
+    if public_key and record.get('public_key') != public_key:
+        return {}
+    return record
+
+
+def wireguard_peer_cache_record(config, config_stat=None, public_key=None):
+    """
+    Build the cache record of a deployed config, for load_wireguard_peer_cache.
+
+    Example:
+        {{ wireguard_state.config | wireguard_peer_cache_record(wireguard_state.config, wireguard_public_key) | to_json }}
+
+    Args:
+        config: The wireguard_state module's 'config' (already parsed on the
+            host), or the config as parse_wireguard_peers accepts it (e.g. a
+            slurp result)
+        config_stat: The module's 'config' or a registered stat result, for the mtime
+        public_key: The host's public key
+
+    Returns:
+        Dictionary with 'version', 'digest' (SHA-256 of the config bytes, as the
+        stat module's checksum), 'mtime', 'public_key' and 'peers'
+    """
+    stat = (config_stat or {}).get('stat', config_stat or {})
+    if isinstance(config, dict) and 'checksum' in config and 'peers' in config:
+        digest, peers = config['checksum'], config['peers']
+    else:
+        source = _config_source(config)
+        data = source if isinstance(source, bytes) else source.encode('utf-8', 'surrogateescape')
+        digest, peers = hashlib.sha256(data).hexdigest(), parse_wireguard_peers(source)
+    return {
+        'version': _PEER_CACHE_VERSION,
+        'digest': digest,
+        'mtime': stat.get('mtime'),
+        'public_key': public_key or '',
+        'peers': peers,
+    }
+
+
+def parse_wireguard_ast(config_text):
+    """
+    Parse a WireGuard config into a lossless syntax tree.
+
+    Unlike parse_wireguard_config nothing is dropped: every line is kept in
+    order with its original text and line ending, including comments, blank
+    lines, repeated keys and keys this module does not otherwise know about
+    (PresharedKey, DNS, MTU, PostUp, ...). serialize_wireguard_ast turns the
+    tree back into the identical text.
+
+    Lines before the first section header form a 'preamble' section; lines
+    between two headers belong to the section above them.
+
+    Args:
+        config_text: String content of WireGuard configuration file
+
+    Returns:
+        {
+            'sections': [
+                {
+                    'type': 'preamble' | 'interface' | 'peer' | 'unknown',
+                    'start': 1, 'end': 5,  # 1-based, inclusive source line range
+                    'lines': [
+                        {'kind': 'header' | 'entry' | 'comment' | 'blank' | 'invalid',
+                         'lineno': 1, 'raw': '[Peer]\\n',
+                         'key': 'PublicKey', 'value': '...'},  # key/value for entries only
+                        ...
+                    ],
+                    # peer sections only, resolved like parse_wireguard_config:
+                    'public_key': 'base64_key' or None,
+                    'name': 'peer_name' or None,
+                },
+                ...
+            ]
+        }
+    """
+    sections = []
+    section = None
+    lineno = 0
+    for raw in StringIO(config_text or ''):
+        lineno += 1
+        stripped = raw.strip()
+        line = {'lineno': lineno, 'raw': raw}
+        if stripped.startswith('['):
+            if '[Peer]' in stripped:
+                section_type = 'peer'
+            elif '[Interface]' in stripped:
+                section_type = 'interface'
+            else:
+                section_type = 'unknown'
+            section = {'type': section_type, 'start': lineno, 'end': lineno, 'lines': []}
+            sections.append(section)
+            line['kind'] = 'header'
+        else:
+            if section is None:
+                section = {'type': 'preamble', 'start': lineno, 'end': lineno, 'lines': []}
+                sections.append(section)
+            if not stripped:
+                line['kind'] = 'blank'
+            elif stripped[0] == '#':
+                line['kind'] = 'comment'
+            else:
+                key, sep, value = stripped.partition('=')
+                if sep:
+                    line.update(kind='entry', key=key.strip(), value=value.strip())
+                else:
+                    line['kind'] = 'invalid'
+        section['lines'].append(line)
+        section['end'] = lineno
+
+    for section in sections:
+        if section['type'] == 'peer':
+            _resolve_peer_section(section)
+    return {'sections': sections}
+
+
+def _resolve_peer_section(section):
+    """Set a peer section's public_key and name the way parse_wireguard_config names peers."""
+    public_key = None
+    comment = None
+    for line in section['lines']:
+        if line['kind'] == 'entry' and line['key'].lower() == 'publickey':
+            public_key = line['value']
+        elif line['kind'] == 'comment':
+            comment = line['raw'].strip()[1:].strip()
+    section['public_key'] = public_key
+    section['name'] = (comment or public_key[:12]) if public_key else None
+
+
+def serialize_wireguard_ast(ast):
+    """
+    Turn a parse_wireguard_ast tree back into config text.
+
+    An unmodified tree reproduces the parsed text byte for byte.
+
+    Args:
+        ast: Result of parse_wireguard_ast
+
+    Returns:
+        Config text
+    """
+    return ''.join(line['raw'] for section in ast['sections'] for line in section['lines'])
+
+
+# Peer fields patch_wireguard_peers manages, in the order new lines are written
+_PATCHED_PEER_FIELDS = (
+    ('Endpoint', 'endpoint'),
+    ('AllowedIPs', 'allowed_ips'),
+    ('PersistentKeepalive', 'persistent_keepalive'),
+)
+
+
+def patch_wireguard_peers(config_text, upsert=None, remove=None):
+    """
+    Apply peer changes to config text, touching only the affected [Peer] blocks.
+
+    Existing peers (matched by public key, or by name when the key is not
+    configured, so a rotated key replaces its old block) keep their position,
+    comments and any other keys such as PresharedKey; only their PublicKey,
+    Endpoint, AllowedIPs and PersistentKeepalive lines are rewritten, and only
+    when the value changes. New peers are appended in the layout
+    render_wireguard_config uses. Every other line of the file is left exactly
+    as it was.
+
+    Args:
+        config_text: Current config text
+        upsert: Dictionary of peer configurations (as from parse_wireguard_peers
+            or merge_wireguard_peers) to add or update
+        remove: Public keys or peer names of peers to drop
+
+    Returns:
+        Patched config text
+
+    Raises:
+        AnsibleFilterError: If an upserted peer has no public_key
+    """
+    ast = parse_wireguard_ast(config_text)
+    sections = ast['sections']
+    newline = '\r\n' if sections and sections[0]['lines'][0]['raw'].endswith('\r\n') else '\n'
+
+    removed = set(remove or ())
+    sections[:] = [
+        section for section in sections
+        if section['type'] != 'peer' or not (section['public_key'] in removed or section['name'] in removed)
+    ]
+
+    upsert = upsert or {}
+    for name, peer in upsert.items():
+        if not peer.get('public_key'):
+            raise AnsibleFilterError(f"patch_wireguard_peers: peer '{name}' has no public_key")
+
+    peer_sections = [section for section in sections if section['type'] == 'peer']
+    by_public_key = {section['public_key']: section for section in peer_sections}
+    # Name fallback, for blocks whose key no upserted peer claims
+    upserted_keys = {peer['public_key'] for peer in upsert.values()}
+    by_name = {section['name']: section for section in peer_sections if section['public_key'] not in upserted_keys}
+    appended = []
+    for name, peer in upsert.items():
+        section = by_public_key.get(peer['public_key']) or by_name.pop(name, None)
+        if section is not None:
+            _patch_peer_section(section, peer, newline)
+        else:
+            appended.append(_new_peer_lines(name, peer, newline))
+
+    text = serialize_wireguard_ast(ast)
+    if appended:
+        if text and not text.endswith(newline * 2):
+            text += newline if text.endswith(newline) else newline * 2
+        text += newline.join(appended) + newline
+    return text
+
+
+def _patch_peer_section(section, peer, newline):
+    """Rewrite the managed fields of one peer section in place."""
+    lines = section['lines']
+    for key, field in (('PublicKey', 'public_key'),) + _PATCHED_PEER_FIELDS:
+        value = peer.get(field) or ''
+        matches = [line for line in lines if line['kind'] == 'entry' and line['key'].lower() == key.lower()]
+        current = ', '.join(line['value'] for line in matches)
+        if field == 'allowed_ips':
+            unchanged = _split_allowed_ips(current) == _split_allowed_ips(value)
+        else:
+            unchanged = current == value
+        if unchanged:
+            continue
+        if matches and value:
+            first = matches[0]
+            body = first['raw'].rstrip('\r\n')
+            head, _, rest = body.partition('=')
+            spacing = rest[:len(rest) - len(rest.lstrip())]
+            first.update(raw=head + '=' + spacing + value + first['raw'][len(body):], value=value)
+            matches = matches[1:]
+        elif value:
+            position = max(index for index, line in enumerate(lines) if line['kind'] in ('header', 'entry'))
+            previous = lines[position]
+            ending = newline
+            if not previous['raw'].endswith('\n'):
+                # Last line of a file without a final newline: keep it that way
+                previous['raw'] += newline
+                ending = ''
+            lines.insert(position + 1, {'kind': 'entry', 'raw': f"{key} = {value}{ending}", 'key': key, 'value': value})
+        for line in matches:
+            lines.remove(line)
+
+
+def _new_peer_lines(name, peer, newline):
+    """Text of a new [Peer] block."""
+    lines = ['[Peer]', f"# {name}", f"PublicKey = {peer['public_key']}"]
+    for key, field in _PATCHED_PEER_FIELDS:
+        if peer.get(field):
+            lines.append(f"{key} = {peer[field]}")
+    return newline.join(lines) + newline
+
+
+def build_worker_peers(hostvars, play_hosts, workers):
+    """
+    Build the peer dictionary for every worker in the current play at once.
+
+    Replaces a per-host set_fact/combine loop (one task result and one dict
+    copy per worker) with a single pass.
+
+    Args:
+        hostvars: Ansible hostvars for every host
+        play_hosts: Hosts in the current play (ansible_play_hosts_all)
+        workers: Hostnames of the workers group
+
+    Returns:
+        Dictionary mapping each play host that is a worker and has a
+        wireguard_public_key fact to its peer configuration:
+        {
+            'worker_name': {
+                'public_key': 'base64_key',
+                'allowed_ips': '10.130.5.65/32'
+            }
+        }
+    """
+    if not play_hosts or not workers:
+        return {}
+
+    workers = frozenset(workers)
+    peers = {}
+    for host in play_hosts:
+        if host not in workers:
+            continue
+        host_vars = hostvars[host]
+        if 'wireguard_public_key' not in host_vars:
+            continue
+        peers[host] = {
+            'public_key': host_vars['wireguard_public_key'],
+            'allowed_ips': f"{host_vars['wireguard_ip']}/32",
+        }
+    return peers
 
 
-def merge_wireguard_peers(existing_peers, new_peers):
+def merge_wireguard_peers(existing_peers, *new_peers, on_conflict='newest', report=False):
     """
     Merge existing WireGuard peers with new peer data.
 
     New peers override existing ones with the same name.
     This allows updating peer configurations while preserving others.
 
+    Any number of layers can be merged in one call, later layers winning.
+    Peers under different names can still clash: a renamed host keeps its
+    public key, and a reused address overlaps another peer's AllowedIPs.
+    WireGuard rejects the first and silently reroutes the second, so both
+    are detected with a public-key index and a prefix index (each network is
+    checked against its supernets and the networks beneath it, never against
+    every other peer).
+
     Args:
         existing_peers: Dictionary of existing peer configurations
-        new_peers: Dictionary of new/updated peer configurations
+        *new_peers: Dictionaries of new/updated peer configurations, oldest first
+        on_conflict: What to do when two peers share a public key or have
+            overlapping AllowedIPs:
+            'newest' - keep the peer from the later layer (or the later entry
+                within one layer) and drop the other
+            'error' - raise an AnsibleFilterError listing the conflicts
+            'ignore' - keep both (plain name-keyed merge)
+        report: When true, return {'merged': {...}, 'dropped': {...},
+            'conflicts': [...]} instead of only the merged peers, so callers
+            can tell the operator which peers 'newest' removed and why
 
     Returns:
         Merged dictionary of peer configurations
     """
-    if not existing_peers:
-        existing_peers = {}
-    if not new_peers:
-        new_peers = {}
+    if on_conflict not in ('newest', 'error', 'ignore'):
+        raise AnsibleFilterError(f"merge_wireguard_peers: unknown on_conflict policy '{on_conflict}'")
 
     # Create a copy to avoid modifying input
-    merged = dict(existing_peers)
+    merged = dict(existing_peers or {})
+
+    # Update with new peers (overrides existing), remembering which layer
+    # each surviving entry came from so "newest" can be decided later
+    layer_of = dict.fromkeys(merged, 0)
+    for layer, peers in enumerate(new_peers, start=1):
+        for peer_name, peer_data in (peers or {}).items():
+            merged[peer_name] = peer_data
+            layer_of[peer_name] = layer
+
+    if on_conflict == 'ignore' or len(merged) < 2:
+        return {'merged': merged, 'dropped': {}, 'conflicts': []} if report else merged
+
+    records = {name: _PeerRecord.from_dict(name, peer) for name, peer in merged.items()}
+    networks_of = {name: record.networks for name, record in records.items()}
+    conflicts = []
+    dropped = {}
+    by_public_key = {}
+    prefixes = _PrefixIndex(network for networks in networks_of.values() for network in networks)
+    # Visit oldest first; a stable sort keeps dict order within a layer
+    for name in sorted(merged, key=layer_of.__getitem__):
+        public_key = records[name].public_key
+        rivals = set()
+        if public_key and public_key in by_public_key:
+            rivals.add(by_public_key[public_key])
+            conflicts.append(f"{by_public_key[public_key]} and {name} share public key {public_key[:16]}...")
+        for network in networks_of[name]:
+            for rival in prefixes.overlapping(network):
+                rivals.add(rival)
+                conflicts.append(f"{rival} and {name} have overlapping AllowedIPs ({network})")
+
+        if on_conflict == 'newest':
+            for rival in rivals:
+                prefixes.remove(rival)
+                by_public_key.pop(records[rival].public_key, None)
+                dropped[rival] = merged.pop(rival)
+        if public_key:
+            by_public_key[public_key] = name
+        prefixes.add(name, networks_of[name])
 
-    # Update with new peers (overrides existing)
-    for peer_name, peer_data in new_peers.items():
-        merged[peer_name] = peer_data
+    if conflicts and on_conflict == 'error':
+        raise AnsibleFilterError('merge_wireguard_peers: conflicting peers: ' + '; '.join(conflicts))
+    return {'merged': merged, 'dropped': dropped, 'conflicts': conflicts} if report else merged
 
-    return merged
 
+class _PrefixIndex:
+    """
+    Owners of IP networks, answering "which owners overlap this network?".
 
-def filter_peers_by_inventory(peers, inventory_hosts):
+    Two networks overlap exactly when one contains the other. Every network
+    that will be indexed is known up front, so only the prefix lengths that
+    actually occur need checking: a query looks up the network truncated to
+    each shorter occurring length (owners containing it) plus the owners
+    stored beneath it. With the usual mix of /32 hosts and a few /24 sites
+    that is a handful of dict lookups, however many networks are indexed.
+    """
+
+    def __init__(self, networks):
+        lengths = {}
+        for network in networks:
+            lengths.setdefault((network.version, network.max_prefixlen), set()).add(network.prefixlen)
+        self._lengths = {family: sorted(found) for family, found in lengths.items()}
+        self._exact = {}   # network key -> owners of exactly that network
+        self._within = {}  # network key -> owners of networks inside it
+        self._keys = {}    # owner -> keys registered for it
+
+    def _truncated(self, network):
+        """Keys of the network cut down to each occurring prefix length up to its own."""
+        family = (network.version, network.max_prefixlen)
+        address = int(network.network_address)
+        max_prefixlen = network.max_prefixlen
+        keys = []
+        for prefixlen in self._lengths.get(family, ()):
+            if prefixlen > network.prefixlen:
+                break
+            shift = max_prefixlen - prefixlen
+            keys.append((network.version, address >> shift, prefixlen))
+        return keys
+
+    def add(self, owner, networks):
+        registered = self._keys.setdefault(owner, [])
+        for network in networks:
+            keys = self._truncated(network)
+            self._exact.setdefault(keys[-1], set()).add(owner)
+            for key in keys:
+                self._within.setdefault(key, set()).add(owner)
+            registered.append(keys)
+
+    def remove(self, owner):
+        for keys in self._keys.pop(owner, []):
+            self._exact[keys[-1]].discard(owner)
+            for key in keys:
+                self._within[key].discard(owner)
+
+    def overlapping(self, network):
+        keys = self._truncated(network)
+        owners = set(self._within.get(keys[-1], ()))
+        for key in keys:
+            owners.update(self._exact.get(key, ()))
+        return sorted(owners)
+
+
+def collapse_allowed_ips(allowed_ips):
+    """
+    Reduce one peer's AllowedIPs to the fewest prefixes covering the same addresses.
+
+    Duplicate and nested entries are dropped and adjacent ones merged, so four
+    consecutive /32s become one /30 and a /32 inside the peer's /28 disappears.
+    Works on integer ranges: the entries are sorted once, touching ranges are
+    joined and each range is cut back into aligned prefixes.
+
+    Args:
+        allowed_ips: Comma-separated AllowedIPs value, or a list of entries
+
+    Returns:
+        Minimal comma-separated AllowedIPs value, IPv4 before IPv6 and each
+        family in address order. Entries that are not networks are kept
+        verbatim at the end, as index_wireguard_peers keeps them.
+    """
+    ranges, invalid = _address_ranges(_allowed_ips_entries(allowed_ips))
+    return ', '.join(_collapsed(ranges) + invalid)
+
+
+def aggregate_wireguard_peers(peers, validate=True):
+    """
+    Collapse every peer's AllowedIPs and check no two peers claim the same addresses.
+
+    The hub's wg0.conf and the kernel's allowed-IPs trie hold one entry per
+    prefix, so a device given a block (or several adjacent addresses) should
+    cost one prefix, not one /32 per address. Prefixes are only merged within
+    a peer; traffic for different peers has to stay apart. Overlaps between
+    peers are found with one sweep over all collapsed ranges in address order.
+
+    Args:
+        peers: Dictionary of peer configurations (or a parse_wireguard_config result)
+        validate: When true, raise an AnsibleFilterError naming every peer whose
+            AllowedIPs overlap another's (WireGuard would silently route the
+            shared addresses to only one of them)
+
+    Returns:
+        Dictionary of peer configurations. A peer whose AllowedIPs can be
+        reduced gets a copy with the collapse_allowed_ips form; every other
+        peer is passed through as is.
+    """
+    if not peers:
+        return {}
+    if isinstance(peers.get('peers'), dict) and 'interface' in peers:
+        peers = peers['peers']
+
+    aggregated = {}
+    owned = []  # (version, start, end, name) for every collapsed range
+    for name, peer in peers.items():
+        entries = _allowed_ips_entries(peer.get('allowed_ips'))
+        ranges, invalid = _address_ranges(entries)
+        joined = _joined_ranges(ranges)
+        owned.extend((version, start, end, name) for version, start, end in joined)
+        collapsed = [prefix for span in joined for prefix in _range_prefixes(*span)] + invalid
+        aggregated[name] = peer if collapsed == entries else dict(peer, allowed_ips=', '.join(collapsed))
+
+    if validate:
+        conflicts = []
+        reach = None  # (version, end, name) of the range reaching furthest so far
+        for version, start, end, name in sorted(owned):
+            if reach and reach[0] == version and start <= reach[1]:
+                shared = ', '.join(_range_prefixes(version, start, min(end, reach[1])))
+                conflicts.append(f"{reach[2]} and {name} have overlapping AllowedIPs ({shared})")
+            if not reach or reach[0] != version or end > reach[1]:
+                reach = (version, end, name)
+        if conflicts:
+            raise AnsibleFilterError('aggregate_wireguard_peers: overlapping peers: ' + '; '.join(conflicts))
+    return aggregated
+
+
+def _allowed_ips_entries(allowed_ips):
+    """AllowedIPs entries from a comma-separated value or a list."""
+    if isinstance(allowed_ips, str) or not allowed_ips:
+        return _split_allowed_ips(allowed_ips)
+    return [str(entry).strip() for entry in allowed_ips if str(entry).strip()]
+
+
+def _address_ranges(entries):
+    """([(version, first, last)], [entries that are not networks]) for AllowedIPs entries."""
+    ranges = []
+    invalid = []
+    for entry in entries:
+        # 'address/length' (or a bare address) is read without building a network
+        # object; anything else, such as a netmask, goes through ip_network
+        address, slash, length = entry.partition('/')
+        try:
+            if slash and not length.isdigit():
+                raise ValueError(entry)
+            address = ipaddress.ip_address(address)
+            bits = address.max_prefixlen
+            prefixlen = int(length) if slash else bits
+            if prefixlen > bits:
+                raise ValueError(entry)
+        except ValueError:
+            try:
+                network = ipaddress.ip_network(entry, strict=False)
+            except ValueError:
+                invalid.append(entry)
+                continue
+            address, bits, prefixlen = network.network_address, network.max_prefixlen, network.prefixlen
+        size = 1 << (bits - prefixlen)
+        first = int(address) & -size
+        ranges.append((address.version, first, first + size - 1))
+    return ranges, invalid
+
+
+def _joined_ranges(ranges):
+    """Ranges in address order with overlapping and adjacent ones merged."""
+    joined = []
+    for version, first, last in sorted(ranges):
+        if joined and joined[-1][0] == version and first <= joined[-1][2] + 1:
+            joined[-1][2] = max(joined[-1][2], last)
+        else:
+            joined.append([version, first, last])
+    return joined
+
+
+def _collapsed(ranges):
+    """The fewest prefixes covering ranges, as strings in address order."""
+    return [prefix for span in _joined_ranges(ranges) for prefix in _range_prefixes(*span)]
+
+
+def _range_prefixes(version, first, last):
+    """The aligned prefixes exactly covering first..last, as strings."""
+    bits, address = (32, ipaddress.IPv4Address) if version == 4 else (128, ipaddress.IPv6Address)
+    prefixes = []
+    while first <= last:
+        # the largest block aligned at first that does not run past last
+        size = min(first & -first or 1 << bits, 1 << ((last - first + 1).bit_length() - 1))
+        prefixes.append(f"{address(first)}/{bits + 1 - size.bit_length()}")
+        first += size
+    return prefixes
+
+
+def filter_peers_by_inventory(peers, inventory_hosts, *allowed_names, report=False):
     """
     Filter peers to only include those present in current inventory.
 
     This is useful for pruning peers that are no longer in the inventory.
+    All allow-lists are folded into one frozenset up front, so each peer costs
+    a single hash lookup however long the lists are.
 
     Args:
         peers: Dictionary of peer configurations
         inventory_hosts: List of hostnames from inventory
+        *allowed_names: Further allow-lists (lists of names, or dicts such as
+            wireguard_static_peers whose keys are the names)
+        report: When true, return {'kept': {...}, 'pruned': {...}} instead of
+            only the kept peers, so callers can act on what was dropped
 
     Returns:
-        Filtered dictionary containing only peers in inventory
+        Filtered dictionary containing only peers in inventory. If every
+        allow-list is empty all peers are kept (nothing to prune against).
     """
     if not peers:
-        return {}
-    if not inventory_hosts:
-        return peers
+        return {'kept': {}, 'pruned': {}} if report else {}
+
+    allowed = frozenset().union(*(
+        [names] if isinstance(names, str) else names
+        for names in (inventory_hosts, *allowed_names)
+        if names
+    ))
+    if not allowed:
+        return {'kept': dict(peers), 'pruned': {}} if report else peers
+
+    kept = {}
+    pruned = {}
+    for name, data in peers.items():
+        if name in allowed:
+            kept[name] = data
+        else:
+            pruned[name] = data
+
+    return {'kept': kept, 'pruned': pruned} if report else kept
+
+
+def index_wireguard_peers(peers):
+    """
+    Build secondary indexes over a peer map in a single pass.
+
+    Lets tasks replace list membership tests and scans with dictionary
+    lookups, e.g. ``key in (peers | index_wireguard_peers).by_public_key``.
+
+    Args:
+        peers: Dictionary of peer configurations (or a parse_wireguard_config
+            result), or a list of public keys such as `wg show <if> peers`
+            output; listed keys are named by their first 12 characters,
+            like unnamed peers in parse_wireguard_config
+
+    Returns:
+        Dictionary of indexes:
+        {
+            'by_public_key': {'base64_key': 'peer_name'},
+            'by_network': {'10.130.5.3/32': 'peer_name'},  # one entry per AllowedIPs network
+            'by_endpoint_host': {'host': ['peer_name', ...]}
+        }
+        AllowedIPs are normalized (``10.130.5.3`` -> ``10.130.5.3/32``); a value
+        that is not a valid network is indexed verbatim. When two peers share a
+        key or network the later one wins.
+    """
+    by_public_key = {}
+    by_network = {}
+    by_endpoint_host = {}
+    if not peers:
+        return {'by_public_key': by_public_key, 'by_network': by_network, 'by_endpoint_host': by_endpoint_host}
+
+    if isinstance(peers, dict):
+        if isinstance(peers.get('peers'), dict) and 'interface' in peers:
+            peers = peers['peers']
+        items = peers.items()
+    else:
+        items = ((key[:12], {'public_key': key}) for key in peers)
+
+    for name, peer in items:
+        public_key = peer.get('public_key')
+        if public_key:
+            by_public_key[public_key] = name
+        for network in _split_allowed_ips(peer.get('allowed_ips')):
+            by_network[_normalize_network(network)] = name
+        endpoint = peer.get('endpoint')
+        if endpoint:
+            by_endpoint_host.setdefault(_split_endpoint(endpoint)[0], []).append(name)
+
+    return {'by_public_key': by_public_key, 'by_network': by_network, 'by_endpoint_host': by_endpoint_host}
+
+
+def _split_allowed_ips(allowed_ips):
+    """Split a comma-separated AllowedIPs value into its non-empty entries."""
+    if not allowed_ips:
+        return []
+    return [entry.strip() for entry in allowed_ips.split(',') if entry.strip()]
+
+
+def _normalize_network(network):
+    """Canonical string form of an AllowedIPs entry, or the entry itself if invalid."""
+    try:
+        return str(ipaddress.ip_network(network, strict=False))
+    except ValueError:
+        return network
+
+
+def _split_endpoint(endpoint):
+    """Split 'host:port' or '[v6addr]:port' into (host, port); port is '' if absent."""
+    if endpoint.startswith('['):
+        host, _, rest = endpoint[1:].partition(']')
+        return host, rest[1:] if rest.startswith(':') else ''
+    host, sep, port = endpoint.rpartition(':')
+    if not sep:
+        return endpoint, ''
+    return host, port
+
+
+def wireguard_peer_delta(current, desired, interface='wg0'):
+    """
+    Compute the live changes that turn the current config into the desired one.
+
+    Peers are matched by public key, so renaming a peer's comment is not a
+    change. Peer additions, removals and updates can be applied to the running
+    interface with one `wg set` call, which leaves the sessions of every other
+    peer untouched. A restart of wg-quick is only needed when something
+    wg-quick itself applies at start-up changes: any [Interface] field, or the
+    AllowedIPs that fall outside the interface Address (wg-quick adds routes for
+    those, `wg set` does not).
+
+    Args:
+        current: Config text, bytes, slurp result or parse_wireguard_config
+            result of the deployed file
+        desired: Config text or parse_wireguard_config result to be deployed
+        interface: WireGuard interface name used in the command
+
+    Returns:
+        {
+            'restart': False,
+            'reasons': ['interface field listenport changed', ...],
+            'added': ['peer_name', ...],    # names from desired
+            'removed': ['peer_name', ...],  # names from current
+            'updated': ['peer_name', ...],  # names from desired
+            'command': ['wg', 'set', 'wg0', 'peer', 'KEY', ...]  # [] if nothing to apply
+        }
+    """
+    current = _as_parsed_config(current)
+    desired = _as_parsed_config(desired)
+    current_peers = _peers_by_public_key(current['peers'])
+    desired_peers = _peers_by_public_key(desired['peers'])
+
+    reasons = []
+    for field in sorted(set(current['interface']) | set(desired['interface'])):
+        if current['interface'].get(field) != desired['interface'].get(field):
+            reasons.append(f"interface field {field} changed")
+    if _routed_networks(current) != _routed_networks(desired):
+        reasons.append('AllowedIPs outside the interface Address changed')
+
+    added, removed, updated = [], [], []
+    args = []
+    for public_key, peer in current_peers.items():
+        if public_key not in desired_peers:
+            removed.append(peer.name)
+            args += ['peer', public_key, 'remove']
+    for public_key, peer in desired_peers.items():
+        old = current_peers.get(public_key)
+        if old is None:
+            added.append(peer.name)
+            args += _wg_set_peer_args(peer, None)
+        elif old.live_fields() != peer.live_fields():
+            updated.append(peer.name)
+            if old.endpoint and not peer.endpoint:
+                # wg cannot clear an endpoint in place; re-create just this peer
+                args += ['peer', public_key, 'remove']
+                old = None
+            args += _wg_set_peer_args(peer, old)
 
     return {
-        name: data
-        for name, data in peers.items()
-        if name in inventory_hosts
+        'restart': bool(reasons),
+        'reasons': reasons,
+        'added': added,
+        'removed': removed,
+        'updated': updated,
+        'command': ['wg', 'set', interface] + args if args else [],
     }
 
 
+def diff_wireguard_configs(current, desired, current_label='Current Config', desired_label='Preview Config'):
+    """
+    Compare two WireGuard configs semantically and as text.
+
+    Peers are matched by public key, so a peer whose comment changed is
+    reported as changed (field 'name') rather than removed and re-added.
+    Private keys never appear in the output: changed values are shown as
+    '(hidden)' in both the summary and the text diff.
+
+    Args:
+        current: Deployed config text, bytes, slurp result (or
+            parse_wireguard_config result); '' or a failed slurp if absent
+        desired: Config text (or parse_wireguard_config result) to be deployed
+        current_label: Label of the current side in the unified diff
+        desired_label: Label of the desired side in the unified diff
+
+    Returns:
+        {
+            'changed': True,
+            'interface': {'listenport': {'current': '51820', 'desired': '51821'}},
+            'peers': {
+                'added': ['peer_name', ...],
+                'removed': ['peer_name', ...],
+                'changed': {'peer_name': {'allowed_ips': {'current': ..., 'desired': ...}}}
+            },
+            'counts': {'current': 3, 'desired': 4},
+            'unified': ['--- Current Config', '+++ Preview Config', '@@ ...', ...]
+        }
+        'unified' is only produced when neither config is given pre-parsed.
+    """
+    current_config = _as_parsed_config(current)
+    desired_config = _as_parsed_config(desired)
+
+    interface = {}
+    for field in sorted(set(current_config['interface']) | set(desired_config['interface'])):
+        old = current_config['interface'].get(field)
+        new = desired_config['interface'].get(field)
+        if old != new:
+            if field == 'privatekey':
+                old, new = old and '(hidden)', new and '(hidden)'
+            interface[field] = {'current': old, 'desired': new}
+
+    current_peers = _peers_by_public_key(current_config['peers'])
+    desired_peers = _peers_by_public_key(desired_config['peers'])
+    added = [peer.name for key, peer in desired_peers.items() if key not in current_peers]
+    removed = [peer.name for key, peer in current_peers.items() if key not in desired_peers]
+    changed = {}
+    for public_key, peer in desired_peers.items():
+        old = current_peers.get(public_key)
+        if old is None:
+            continue
+        fields = {}
+        for field in _PeerRecord.text_fields:
+            if getattr(old, field) != getattr(peer, field):
+                fields[field] = {'current': getattr(old, field), 'desired': getattr(peer, field)}
+        if fields:
+            changed[peer.name] = fields
+
+    unified = []
+    current_text, desired_text = _diff_text(current), _diff_text(desired)
+    if current_text is not None and desired_text is not None:
+        unified = list(difflib.unified_diff(
+            _hide_private_key(current_text.splitlines()),
+            _hide_private_key(desired_text.splitlines()),
+            current_label, desired_label, lineterm='',
+        ))
+
+    return {
+        'changed': bool(interface or added or removed or changed or unified),
+        'interface': interface,
+        'peers': {'added': added, 'removed': removed, 'changed': changed},
+        'counts': {'current': len(current_config['peers']), 'desired': len(desired_config['peers'])},
+        'unified': unified,
+    }
+
+
+def _hide_private_key(lines):
+    """Replace the value of PrivateKey lines so diffs can be logged."""
+    hidden = []
+    for line in lines:
+        key, sep, _value = line.partition('=')
+        if sep and key.strip().lower() == 'privatekey':
+            line = key + '= (hidden)'
+        hidden.append(line)
+    return hidden
+
+
+def _as_parsed_config(config):
+    """Config text/bytes/slurp result or a parsed config as {'interface': dict, 'peers': tuple of _PeerRecord}."""
+    if isinstance(config, Mapping) and ('interface' in config or 'peers' in config):
+        peers = tuple(_PeerRecord.from_dict(name, peer) for name, peer in (config.get('peers') or {}).items())
+        return {'interface': config.get('interface') or {}, 'peers': peers}
+    return _parse_cached(_config_source(config))
+
+
+def _diff_text(config):
+    """Config text for the unified diff, or None for a pre-parsed config."""
+    if isinstance(config, Mapping) and ('interface' in config or 'peers' in config):
+        return None
+    source = _config_source(config)
+    if isinstance(source, bytes):
+        return str(source, 'utf-8', 'surrogateescape')
+    return source or ''
+
+
+def _peers_by_public_key(peers):
+    """Map public key -> _PeerRecord; the later peer wins on duplicate keys."""
+    return {peer.public_key: peer for peer in peers if peer.public_key}
+
+
+def _wg_set_peer_args(peer, old):
+    """`wg set` arguments for one peer; old is its current record, or None when absent."""
+    args = ['peer', peer.public_key]
+    if peer.endpoint:
+        args += ['endpoint', peer.endpoint]
+    if peer.persistent_keepalive:
+        args += ['persistent-keepalive', peer.persistent_keepalive]
+    elif old is not None and old.persistent_keepalive:
+        args += ['persistent-keepalive', 'off']
+    args += ['allowed-ips', ','.join(_split_allowed_ips(peer.allowed_ips))]
+    return args
+
+
+def _routed_networks(config):
+    """AllowedIPs networks not covered by any interface Address network (wg-quick routes these)."""
+    addresses = []
+    for address in _split_allowed_ips(config['interface'].get('address')):
+        try:
+            addresses.append(ipaddress.ip_interface(address).network)
+        except ValueError:
+            continue
+    routed = set()
+    for peer in config['peers']:
+        for network in peer.networks:
+            if not any(network.version == address.version and network.subnet_of(address) for address in addresses):
+                routed.add(network)
+    return routed
+
+
+def wireguard_direct_peer_index(hostvars, hosts):
+    """
+    Group hosts by wireguard_direct_peer_group in one pass over the inventory.
+
+    Meant to be set once per play (``run_once: true``) so each host's config
+    render and the maintenance ping loop look their group up in a dictionary
+    instead of re-filtering every host's variables.
+
+    Args:
+        hostvars: Ansible hostvars for every host
+        hosts: Hostnames to index, normally groups['all']
+
+    Returns:
+        Dictionary mapping each non-empty group to its members, sorted by name
+        (case-insensitively, like Jinja's sort filter):
+        {
+            'home': [
+                {
+                    'name': 'cm4',
+                    'ip': '10.130.5.65',
+                    'public_key': 'base64_key',  # None until keys are loaded
+                    'lan_endpoint': '192.168.40.34',  # '' when unknown
+                    'port': 51820  # None when the host has no wireguard_port
+                }
+            ]
+        }
+        Hosts without a wireguard_ip are left out.
+    """
+    index = {}
+    for host in hosts:
+        host_vars = hostvars[host]
+        peer_group = host_vars.get('wireguard_direct_peer_group')
+        if not peer_group or 'wireguard_ip' not in host_vars:
+            continue
+        index.setdefault(peer_group, []).append({
+            'name': host,
+            'ip': host_vars['wireguard_ip'],
+            'public_key': host_vars.get('wireguard_public_key'),
+            'lan_endpoint': _lan_address(host_vars),
+            'port': host_vars.get('wireguard_port'),
+        })
+    for members in index.values():
+        members.sort(key=lambda member: member['name'].lower())
+    return index
+
+
+def wireguard_topology(host_vars, hostvars, groups, direct_peer_index=None):
+    """
+    Resolve everything wg0.conf needs for one host into a plain dictionary.
+
+    Does the hostvars lookups that roles/wireguard/templates/wg0.conf.j2 does
+    inline, but with a dictionary lookup in a precomputed direct-peer index
+    instead of five chained extract/selectattr scans of every host. Feed the
+    result to render_wireguard_config.
+
+    Args:
+        host_vars: Variables of the host being configured
+            (``hostvars[inventory_hostname]``)
+        hostvars: Ansible hostvars for every host
+        groups: Ansible groups (needs 'control_plane'; 'workers' and 'all'
+            are read when the host's role needs them)
+        direct_peer_index: Result of wireguard_direct_peer_index, computed
+            once per play; built on the fly from groups['all'] when omitted
+
+    Returns:
+        Dictionary describing the host's interface and peers:
+        {
+            'hostname': 'cm4',
+            'address': '10.130.5.65',
+            'listen_port': 51820,  # None when the host does not listen
+            'private_key': 'base64_key',
+            'public_key': 'base64_key',
+            # control plane only:
+            'peers': [{'name': ..., 'public_key': ..., 'allowed_ips': ...}],
+            'fallback': False,  # peers came from groups['workers'], not merged peers
+            # everything else:
+            'hub': {'public_key': ..., 'endpoint': 'root.host:port', 'allowed_ips': '10.130.5.0/24'},
+            'direct_peers': [{'name': ..., 'public_key': ..., 'allowed_ips': ..., 'endpoint': ...}]
+        }
+    """
+    hostname = host_vars['inventory_hostname']
+    peer_group = host_vars.get('wireguard_direct_peer_group', '')
+    is_hub = hostname in groups['control_plane']
+
+    topology = {
+        'hostname': hostname,
+        'address': host_vars['wireguard_ip'],
+        'listen_port': host_vars['wireguard_port'] if is_hub or peer_group != '' else None,
+        'private_key': host_vars['wireguard_private_key'],
+        'public_key': host_vars['wireguard_public_key'],
+    }
+
+    if is_hub:
+        merged_peers = host_vars.get('wireguard_merged_peers')
+        if merged_peers:
+            topology['peers'] = [
+                {'name': name, 'public_key': peer['public_key'], 'allowed_ips': peer['allowed_ips']}
+                for name, peer in sorted(merged_peers.items(), key=_sort_key)
+            ]
+            topology['fallback'] = False
+        else:
+            topology['peers'] = [
+                {
+                    'name': host,
+                    'public_key': hostvars[host]['wireguard_public_key'],
+                    'allowed_ips': f"{hostvars[host]['wireguard_ip']}/32",
+                }
+                for host in groups['workers']
+            ]
+            topology['fallback'] = True
+        return topology
+
+    hub_vars = hostvars[groups['control_plane'][0]]
+    topology['hub'] = {
+        'public_key': hub_vars['wireguard_public_key'],
+        'endpoint': f"root.{hub_vars['ansible_host']}:{hub_vars['wireguard_port']}",
+        'allowed_ips': host_vars['wireguard_network'],
+    }
+
+    direct_peers = []
+    if peer_group != '':
+        if direct_peer_index is None:
+            direct_peer_index = wireguard_direct_peer_index(hostvars, groups.get('all', []))
+        for member in direct_peer_index.get(peer_group, []):
+            if member['name'] == hostname or member['public_key'] is None:
+                continue
+            endpoint = ''
+            if member['lan_endpoint']:
+                port = member['port'] if member['port'] is not None else host_vars.get('wireguard_port')
+                endpoint = f"{member['lan_endpoint']}:{port}"
+            direct_peers.append({
+                'name': member['name'],
+                'public_key': member['public_key'],
+                'allowed_ips': f"{member['ip']}/32",
+                'endpoint': endpoint,
+            })
+    topology['direct_peers'] = direct_peers
+    return topology
+
+
+def render_wireguard_config(topology):
+    """
+    Render wg0.conf text from a wireguard_topology result.
+
+    Produces exactly what roles/wireguard/templates/wg0.conf.j2 renders for the
+    same host (tests/test_wireguard_template.py checks both against the same
+    expected output), without going through Jinja or hostvars.
+
+    Args:
+        topology: Dictionary returned by wireguard_topology
+
+    Returns:
+        WireGuard configuration file content
+    """
+    lines = ['[Interface]', f"Address = {topology['address']}/24"]
+    if topology['listen_port'] is not None:
+        lines.append(f"ListenPort = {topology['listen_port']}")
+    lines += [
+        f"PrivateKey = {topology['private_key']}",
+        f"# PublicKey = {topology['public_key']}",
+        '',
+    ]
+
+    if 'peers' in topology:
+        lines.append('# Worker nodes')
+        if topology['fallback']:
+            lines.append('# Fallback to traditional method if wireguard_merged_peers not available')
+        for peer in topology['peers']:
+            lines += [
+                '[Peer]',
+                f"# {peer['name']}",
+                f"PublicKey = {peer['public_key']}",
+                f"AllowedIPs = {peer['allowed_ips']}",
+                '',
+            ]
+        return '\n'.join(lines) + '\n\n'
+
+    hub = topology['hub']
+    lines += [
+        '# Control plane (hub): catch-all /24 route. Anything without a more specific',
+        '# direct-peer route below is relayed through the control plane.',
+        '[Peer]',
+        f"PublicKey = {hub['public_key']}",
+        f"Endpoint = {hub['endpoint']}",
+        f"AllowedIPs = {hub['allowed_ips']}",
+        'PersistentKeepalive = 25',
+    ]
+    if topology['direct_peers']:
+        lines += [
+            '',
+            "# Direct same-site peers. Each advertises a /32 AllowedIPs that is more specific",
+            "# than the hub's /24, so WireGuard's longest-prefix crypto-routing sends traffic",
+            '# for these nodes straight over the LAN instead of relaying via the control plane.',
+            '# NOTE: because /32 wins over /24, the direct path does NOT fail over to the hub',
+            '# if it breaks -- acceptable here since the peers share a LAN.',
+        ]
+        for peer in topology['direct_peers']:
+            if not peer['endpoint']:
+                continue
+            lines += [
+                '[Peer]',
+                f"# {peer['name']} (direct LAN peer)",
+                f"PublicKey = {peer['public_key']}",
+                f"AllowedIPs = {peer['allowed_ips']}",
+                f"Endpoint = {peer['endpoint']}",
+                'PersistentKeepalive = 25',
+                '',
+            ]
+    return '\n'.join(lines) + '\n\n'
+
+
+def wireguard_latency_matrix(hostvars, hosts, hub=None, result='wireguard_probe', relay_ms=_RELAY_RTT_MS):
+    """
+    Assemble the per-host ping results of a probe into an N x N latency matrix.
+
+    Each host pings its same-site direct peers and the hub in parallel (the
+    wireguard_state module's ping option) and registers the result; this
+    filter then runs once on the controller. A pair in the same
+    wireguard_direct_peer_group should answer over the LAN in well under a
+    millisecond, so one that takes relay_ms or more is flagged as relaying
+    through the hub (its direct peer entry is missing or its endpoint is wrong).
+
+    Example:
+        {{ hostvars | wireguard_latency_matrix(ansible_play_hosts, groups['control_plane'][0], 'wg_probe') }}
+
+    Args:
+        hostvars: Ansible hostvars for every host
+        hosts: Hosts that ran the probe
+        hub: Control-plane hostname, shown first
+        result: Name of the variable each host registered the module result in
+        relay_ms: Round trip (ms) from which a same-site pair counts as relayed
+
+    Returns:
+        Dictionary with:
+        - 'hosts': row and column order (hub first, then by name)
+        - 'matrix': {source: {target: {'rtt_ms', 'loss_pct', 'relayed'}}}, only
+          for probed pairs; 'rtt_ms' is None without a reply
+        - 'relayed': [{'from', 'to', 'rtt_ms'}] same-site pairs going via the hub
+        - 'unreachable': [{'from', 'to'}] pairs without a single reply
+        - 'table': the matrix as text, one row per source
+    """
+    names = sorted(set(hosts) - {hub}, key=str.lower)
+    if hub is not None:
+        names.insert(0, hub)
+    by_ip = {}
+    for name in names:
+        address = (hostvars.get(name) or {}).get('wireguard_ip')
+        if address:
+            by_ip[address] = name
+
+    matrix = {}
+    relayed = []
+    unreachable = []
+    unknown = []
+    for source in names:
+        source_vars = hostvars.get(source) or {}
+        site = source_vars.get('wireguard_direct_peer_group') or ''
+        for address, ping in ((source_vars.get(result) or {}).get('ping') or {}).items():
+            target = by_ip.get(address)
+            if target is None:
+                target = by_ip[address] = address
+                unknown.append(address)
+            transmitted = ping.get('transmitted') or 0
+            received = ping.get('received') or 0
+            rtt = ping.get('rtt_avg_ms') if received else None
+            same_site = site != '' and target != hub and (hostvars.get(target) or {}).get(
+                'wireguard_direct_peer_group') == site
+            cell = {
+                'rtt_ms': rtt,
+                'loss_pct': round(100.0 * (transmitted - received) / transmitted, 1) if transmitted else 100.0,
+                'relayed': same_site and rtt is not None and rtt >= relay_ms,
+            }
+            matrix.setdefault(source, {})[target] = cell
+            if cell['relayed']:
+                relayed.append({'from': source, 'to': target, 'rtt_ms': rtt})
+            if rtt is None:
+                unreachable.append({'from': source, 'to': target})
+    # Targets outside the play only get a column, after the probed hosts
+    names.extend(unknown)
+
+    return {
+        'hosts': names,
+        'matrix': matrix,
+        'relayed': relayed,
+        'unreachable': unreachable,
+        'table': _latency_table(names, matrix),
+    }
+
+
+def _latency_table(names, matrix):
+    """Text grid of a latency matrix: RTT in ms, '*' relayed, 'x' no reply, '-' not probed."""
+    def cell_text(cell):
+        if cell is None:
+            return '-'
+        if cell['rtt_ms'] is None:
+            return 'x'
+        return f"{cell['rtt_ms']:.1f}" + ('*' if cell['relayed'] else '')
+
+    rows = [[''] + names]
+    rows += [[source] + [cell_text(matrix.get(source, {}).get(target)) for target in names] for source in names]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(names) + 1)]
+    lines = ['  '.join(text.rjust(width) if column else text.ljust(width)
+                       for column, (text, width) in enumerate(zip(row, widths))).rstrip()
+             for row in rows]
+    lines.append("RTT in ms from row to column; * relayed through the hub, x no reply, - not probed")
+    return '\n'.join(lines)
+
+
+def _sort_key(item):
+    """Order (name, value) pairs like Jinja's case-insensitive sort filter."""
+    return item[0].lower()
+
+
+def _lan_address(host_vars):
+    """LAN address a direct peer is reached on, or '' if unknown."""
+    address = host_vars.get('wireguard_lan_endpoint', _MISSING)
+    if address is _MISSING:
+        address = (host_vars.get('ansible_default_ipv4') or {}).get('address', '')
+    return address
+
+
 class FilterModule:
     """Ansible filter plugin for WireGuard operations."""
 
@@ -196,6 +1591,25 @@ class FilterModule:
         return {
             'parse_wireguard_config': parse_wireguard_config,
             'parse_wireguard_peers': parse_wireguard_peers,
+            'iter_wireguard_peers': iter_wireguard_peers,
+            'parse_wg_dump': parse_wg_dump,
+            'parse_wireguard_ast': parse_wireguard_ast,
+            'serialize_wireguard_ast': serialize_wireguard_ast,
+            'patch_wireguard_peers': patch_wireguard_peers,
             'merge_wireguard_peers': merge_wireguard_peers,
+            'build_worker_peers': build_worker_peers,
             'filter_peers_by_inventory': filter_peers_by_inventory,
+            'index_wireguard_peers': index_wireguard_peers,
+            'collapse_allowed_ips': collapse_allowed_ips,
+            'aggregate_wireguard_peers': aggregate_wireguard_peers,
+            'wireguard_peer_delta': wireguard_peer_delta,
+            'diff_wireguard_configs': diff_wireguard_configs,
+            'wireguard_direct_peer_index': wireguard_direct_peer_index,
+            'wireguard_topology': wireguard_topology,
+            'render_wireguard_config': render_wireguard_config,
+            'wireguard_latency_matrix': wireguard_latency_matrix,
+            'wireguard_parse_cache_info': wireguard_parse_cache_info,
+            'load_wireguard_peer_cache': load_wireguard_peer_cache,
+            'wireguard_peer_cache_digest': wireguard_peer_cache_digest,
+            'wireguard_peer_cache_record': wireguard_peer_cache_record,
         }
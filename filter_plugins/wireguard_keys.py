@@ -0,0 +1,100 @@
+"""Custom Ansible filters for WireGuard keys, computed on the controller."""
+
+import base64
+import binascii
+from functools import lru_cache
+
+try:
+    from ansible.errors import AnsibleFilterError
+except ImportError:  # allows the unit tests to import this module without Ansible
+    AnsibleFilterError = ValueError
+
+# Curve25519 field prime and the (A - 2) / 4 constant of the Montgomery ladder (RFC 7748)
+_P = 2 ** 255 - 19
+_A24 = 121665
+_BASE_POINT_U = 9
+
+
+def _x25519(scalar, u):
+    """X25519(scalar, u) over integers: the Montgomery ladder of RFC 7748, section 5."""
+    x_2, z_2, x_3, z_3 = 1, 0, u, 1
+    swap = 0
+    for bit in range(254, -1, -1):
+        k_t = (scalar >> bit) & 1
+        swap ^= k_t
+        if swap:
+            x_2, x_3, z_2, z_3 = x_3, x_2, z_3, z_2
+        swap = k_t
+
+        a = x_2 + z_2
+        aa = a * a % _P
+        b = x_2 - z_2
+        bb = b * b % _P
+        e = aa - bb
+        c = x_3 + z_3
+        d = x_3 - z_3
+        da = d * a % _P
+        cb = c * b % _P
+        x_3 = (da + cb) ** 2 % _P
+        z_3 = u * (da - cb) ** 2 % _P
+        x_2 = aa * bb % _P
+        z_2 = e * (aa + _A24 * e) % _P
+    if swap:
+        x_2, z_2 = x_3, z_3
+    return x_2 * pow(z_2, _P - 2, _P) % _P
+
+
+def _decode_key(key):
+    """The 32 raw bytes of a base64 WireGuard key, or an AnsibleFilterError."""
+    if not isinstance(key, str):
+        raise AnsibleFilterError(f"wireguard_pubkey: expected a base64 key string, got {type(key).__name__}")
+    try:
+        raw = base64.b64decode(key.strip(), validate=True)
+    except (binascii.Error, ValueError) as exc:
+        raise AnsibleFilterError(f"wireguard_pubkey: key is not valid base64: {exc}") from exc
+    if len(raw) != 32:
+        raise AnsibleFilterError(f"wireguard_pubkey: key must be 32 bytes, got {len(raw)}")
+    return raw
+
+
+@lru_cache(maxsize=256)
+def _public_key(private_key):
+    scalar = int.from_bytes(_decode_key(private_key), 'little')
+    # clamp, as wg genkey and the kernel do
+    scalar &= ~7
+    scalar &= ~(128 << 8 * 31)
+    scalar |= 64 << 8 * 31
+    public = _x25519(scalar, _BASE_POINT_U)
+    return base64.b64encode(public.to_bytes(32, 'little')).decode('ascii')
+
+
+def wireguard_pubkey(private_key):
+    """
+    Derive a WireGuard public key from its private key, like `wg pubkey`.
+
+    Pure Python X25519 (RFC 7748), so the controller can check a host's
+    persisted .pub against its .key without running wg on the host. Results
+    are cached per private key.
+
+    Example:
+        {{ wireguard_private_key | wireguard_pubkey == wireguard_public_key }}
+
+    Args:
+        private_key: Base64 private key (surrounding whitespace is ignored)
+
+    Returns:
+        Base64 public key
+    """
+    if not isinstance(private_key, str):
+        _decode_key(private_key)  # raises with the type in the message
+    return _public_key(private_key.strip())
+
+
+class FilterModule:
+    """Ansible filter plugin for WireGuard keys."""
+
+    def filters(self):
+        """Return filter mappings."""
+        return {
+            'wireguard_pubkey': wireguard_pubkey,
+        }
@@ -0,0 +1,436 @@
+"""Custom Ansible filters for the WireGuard addressing plan (wireguard_zones).
+
+Also a command-line tool over inventory.yml, for onboarding without Ansible:
+    python filter_plugins/wireguard_zones.py allocate home-static --count 3
+    python filter_plugins/wireguard_zones.py new-zone 28
+    python filter_plugins/wireguard_zones.py free
+"""
+
+import argparse
+import ipaddress
+import sys
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+
+try:
+    from ansible.errors import AnsibleFilterError
+except ImportError:  # allows the unit tests to import this module without Ansible
+    AnsibleFilterError = ValueError
+
+# Resolvers, keyed by the zone plan they were built from, most recently used
+# last. A play passes the same wireguard_zones for every host, so each worker
+# process builds its resolver once.
+_RESOLVER_CACHE_SIZE = 8
+_resolver_cache = OrderedDict()
+
+# Host bits of the largest network an AddressPool takes: its bitmap holds one
+# bit per address, so a /16 is 8 KiB, while an IPv6 /64 could never be built
+_MAX_POOL_HOST_BITS = 16
+
+
+class ZoneResolver:
+    """
+    Maps addresses to wireguard_zones names in O(log z).
+
+    The zones' CIDRs are cut into disjoint segments at every zone boundary,
+    each labelled with the zones covering it; a lookup is one bisect over the
+    segment starts. Overlapping zones are found while building the segments
+    (a zone starting while another is still open overlaps it), and rejected
+    unless strict=False, in which case addresses they share resolve to None.
+
+    IPv4 and IPv6 zones are kept in separate segment tables.
+    """
+
+    __slots__ = ('zones', 'overlaps', '_tables')
+
+    def __init__(self, zones, strict=True):
+        """
+        Args:
+            zones: {zone_name: cidr} as in wireguard_zones
+            strict: Raise AnsibleFilterError if any two zones overlap
+
+        Raises:
+            AnsibleFilterError: On an invalid CIDR, or on overlapping zones
+                when strict
+        """
+        self.zones = {}
+        for name, cidr in (zones or {}).items():
+            try:
+                self.zones[name] = ipaddress.ip_network(cidr)
+            except (TypeError, ValueError) as e:
+                raise AnsibleFilterError(f"wireguard_zones: zone '{name}' has an invalid CIDR '{cidr}': {e}") from e
+
+        self.overlaps = []
+        self._tables = {}
+        for version in (4, 6):
+            # by start, then widest first, so a containing zone is named before
+            # the zones nested in it
+            ranges = sorted(
+                ((int(net.network_address), int(net.broadcast_address) + 1, name)
+                 for name, net in self.zones.items()
+                 if net.version == version),
+                key=lambda r: (r[0], -r[1], r[2]),
+            )
+            if ranges:
+                self._tables[version] = self._segments(ranges)
+
+        if strict and self.overlaps:
+            pairs = ', '.join(f"{a} ({self.zones[a]}) and {b} ({self.zones[b]})" for a, b in self.overlaps)
+            raise AnsibleFilterError(f"wireguard_zones overlap: {pairs}")
+
+    def _segments(self, ranges):
+        """(starts, ends, labels) of the disjoint segments covered by ranges.
+
+        ranges are (start, end, name) with end exclusive, sorted by start. A
+        label is the zone name, or None where several zones cover the segment.
+        """
+        starts, ends, labels = [], [], []
+        bounds = sorted({point for start, end, _ in ranges for point in (start, end)})
+        active = []
+        next_range = 0
+        for start, end in zip(bounds, bounds[1:]):
+            active = [r for r in active if r[1] > start]
+            while next_range < len(ranges) and ranges[next_range][0] == start:
+                opened = ranges[next_range]
+                self.overlaps.extend((r[2], opened[2]) for r in active)
+                active.append(opened)
+                next_range += 1
+            if active:
+                starts.append(start)
+                ends.append(end)
+                labels.append(active[0][2] if len(active) == 1 else None)
+        return starts, ends, labels
+
+    def zone_of(self, address):
+        """
+        The zone containing address, or None.
+
+        Args:
+            address: An IP address, or a network / 'ip/prefix' (e.g. an
+                allowed_ips entry), which must lie within a single zone
+
+        Returns:
+            The zone name; None if no zone, or more than one, contains it, or
+            if address is missing or malformed
+        """
+        if not address:
+            return None
+        try:
+            network = ipaddress.ip_network(address, strict=False)
+        except (TypeError, ValueError):
+            return None
+        table = self._tables.get(network.version)
+        if table is None:
+            return None
+        starts, ends, labels = table
+        index = bisect_right(starts, int(network.network_address)) - 1
+        if index < 0 or int(network.broadcast_address) >= ends[index]:
+            return None
+        return labels[index]
+
+
+def zone_resolver(zones, strict=True):
+    """The ZoneResolver for a wireguard_zones mapping, built once per process."""
+    key = (tuple((name, str(cidr)) for name, cidr in (zones or {}).items()), strict)
+    resolver = _resolver_cache.get(key)
+    if resolver is None:
+        resolver = ZoneResolver(zones, strict)
+        _resolver_cache[key] = resolver
+        if len(_resolver_cache) > _RESOLVER_CACHE_SIZE:
+            _resolver_cache.popitem(last=False)
+    else:
+        _resolver_cache.move_to_end(key)
+    return resolver
+
+
+def wireguard_zone_of(address, zones):
+    """
+    Derive the zone of an address from wireguard_zones.
+
+    Example: {{ wireguard_ip | wireguard_zone_of(wireguard_zones) }}
+
+    Args:
+        address: IP address, or 'ip/prefix' such as a static peer's allowed_ips
+        zones: {zone_name: cidr} (wireguard_zones)
+
+    Returns:
+        The name of the single zone containing address, or None
+
+    Raises:
+        AnsibleFilterError: If the zones overlap or a CIDR is invalid
+    """
+    return zone_resolver(zones).zone_of(address)
+
+
+class AddressPool:
+    """
+    Bitmap of a network's addresses: bit i is set when address network+i is taken.
+
+    The bitmap is one Python int, so finding the lowest free address is a
+    couple of big-int operations (isolate the lowest zero bit) rather than a
+    walk over the taken addresses, and finding a free aligned block of 2^k
+    addresses takes k shift-and steps plus one mask.
+    """
+
+    __slots__ = ('network', 'size', 'bits')
+
+    def __init__(self, network, reserve_edges=False):
+        """
+        Args:
+            network: The network (or CIDR string) to allocate from
+            reserve_edges: Mark the network and broadcast addresses as taken,
+                as the zones do (blocks of 4 or more addresses only)
+
+        Raises:
+            AnsibleFilterError: If the network is not IPv4 or is larger than a /16
+        """
+        self.network = ipaddress.ip_network(network)
+        if self.network.version != 4:
+            raise AnsibleFilterError(f"wireguard address pool: {self.network} is not an IPv4 network")
+        if self.network.max_prefixlen - self.network.prefixlen > _MAX_POOL_HOST_BITS:
+            raise AnsibleFilterError(
+                f"wireguard address pool: {self.network} is larger than a /{32 - _MAX_POOL_HOST_BITS}")
+        self.size = self.network.num_addresses
+        self.bits = 0
+        if reserve_edges and self.size >= 4:
+            self.bits = 1 | (1 << (self.size - 1))
+
+    def _span(self, address):
+        """(first, last) offsets of an address or network within this pool, or None."""
+        try:
+            if isinstance(address, str) and '/' not in address:
+                # a plain address; ip_address parses several times faster than ip_network
+                taken = ipaddress.ip_address(address)
+                start = end = int(taken)
+            else:
+                taken = ipaddress.ip_network(address, strict=False)
+                start, end = int(taken.network_address), int(taken.broadcast_address)
+        except (TypeError, ValueError) as e:
+            raise AnsibleFilterError(f"wireguard address pool: '{address}' is not an IP address or network") from e
+        if taken.version != self.network.version:
+            return None
+        base = int(self.network.network_address)
+        first = max(start - base, 0)
+        last = min(end - base, self.size - 1)
+        return (first, last) if first <= last else None
+
+    def take(self, *addresses):
+        """Mark addresses or networks as taken (the parts inside this pool).
+
+        Single addresses are set in a byte buffer and folded into the bitmap
+        once, so taking n of them costs O(n + size) rather than n big-int ORs.
+        """
+        singles = bytearray((self.size + 7) // 8)
+        for address in addresses:
+            span = self._span(address)
+            if span is None:
+                continue
+            first, last = span
+            if first == last:
+                singles[first >> 3] |= 1 << (first & 7)
+            else:
+                self.bits |= ((1 << (last - first + 1)) - 1) << first
+        self.bits |= int.from_bytes(singles, 'little')
+
+    def _address(self, offset):
+        return str(self.network.network_address + offset)
+
+    def allocate(self, count=1):
+        """Take and return the count lowest free addresses, or None if fewer are free."""
+        free = ~self.bits & ((1 << self.size) - 1)
+        found = []
+        while len(found) < count and free:
+            lowest = free & -free
+            found.append(lowest.bit_length() - 1)
+            free ^= lowest
+        if len(found) < count:
+            return None
+        for offset in found:
+            self.bits |= 1 << offset
+        return [self._address(offset) for offset in found]
+
+    def allocate_block(self, prefixlen):
+        """Take and return the lowest free aligned network of prefixlen, or None."""
+        block = 1 << (self.network.max_prefixlen - prefixlen)
+        if prefixlen < self.network.prefixlen or block > self.size:
+            return None
+        # bit i of runs is set when addresses i .. i+block-1 are all free
+        runs = ~self.bits & ((1 << self.size) - 1)
+        width = 1
+        while width < block:
+            runs &= runs >> width
+            width <<= 1
+        # keep the aligned starts: one bit every block positions
+        runs &= ((1 << self.size) - 1) // ((1 << block) - 1)
+        if not runs:
+            return None
+        offset = (runs & -runs).bit_length() - 1
+        self.bits |= ((1 << block) - 1) << offset
+        return ipaddress.ip_network((self.network.network_address + offset, prefixlen))
+
+    def free_blocks(self):
+        """The free addresses as the fewest CIDR blocks, in address order."""
+        blocks = []
+        free = ~self.bits & ((1 << self.size) - 1)
+        while free:
+            start = (free & -free).bit_length() - 1
+            run = (~(free >> start)) & -(~(free >> start))
+            end = start + run.bit_length() - 1
+            blocks.extend(ipaddress.summarize_address_range(
+                self.network.network_address + start, self.network.network_address + end - 1))
+            free &= ~(((1 << (end - start)) - 1) << start)
+        return [str(net) for net in blocks]
+
+
+def _zone_network(zone, zones):
+    """The network of a zone name (looked up in zones) or of a CIDR."""
+    if zones and zone in zones:
+        return zone_resolver(zones).zones[zone]
+    try:
+        return ipaddress.ip_network(zone)
+    except (TypeError, ValueError) as e:
+        raise AnsibleFilterError(f"unknown WireGuard zone '{zone}' (known: {sorted(zones or {})})") from e
+
+
+def wireguard_allocate_ip(zone, used, zones=None, count=None):
+    """
+    Pick the next free addresses of a zone.
+
+    Example: {{ 'home-static' | wireguard_allocate_ip(assigned, wireguard_zones) }}
+
+    Args:
+        zone: Zone name (looked up in zones) or the zone's CIDR
+        used: Addresses or networks already assigned, e.g. from
+            wireguard_assigned_ips; anything outside the zone is ignored
+        zones: {zone_name: cidr} (wireguard_zones), needed for a zone name
+        count: Number of addresses to allocate; None for a single one
+
+    Returns:
+        The lowest free address of the zone (its network and broadcast
+        addresses excluded), or a list of count addresses
+
+    Raises:
+        AnsibleFilterError: If the zone is unknown, is not an IPv4 network of at
+            most a /16, or has too few free addresses
+    """
+    pool = AddressPool(_zone_network(zone, zones), reserve_edges=True)
+    pool.take(*(used or ()))
+    addresses = pool.allocate(count or 1)
+    if addresses is None:
+        raise AnsibleFilterError(f"WireGuard zone '{zone}' ({pool.network}) has fewer than {count or 1} free address(es)")
+    return addresses if count is not None else addresses[0]
+
+
+def wireguard_allocate_zone(network, zones, prefixlen, used=None):
+    """
+    Find a free block of the overlay for a new zone.
+
+    Example: {{ wireguard_network | wireguard_allocate_zone(wireguard_zones, 28) }}
+
+    Args:
+        network: The overlay network (wireguard_network)
+        zones: {zone_name: cidr} of the existing zones
+        prefixlen: Size of the new zone's block, e.g. 28 for 16 addresses
+        used: Further addresses or networks to keep clear
+
+    Returns:
+        The lowest free, aligned CIDR of that size
+
+    Raises:
+        AnsibleFilterError: If no such block is free, or the network is not
+            IPv4 or is larger than a /16
+    """
+    pool = AddressPool(network)
+    pool.take(*zone_resolver(zones).zones.values(), *(used or ()))
+    block = pool.allocate_block(int(prefixlen))
+    if block is None:
+        raise AnsibleFilterError(f"no free /{prefixlen} left in {pool.network}")
+    return str(block)
+
+
+def wireguard_free_blocks(network, zones, used=None):
+    """
+    List the overlay's unassigned space (no zone, no address) as CIDR blocks.
+
+    Example: {{ wireguard_network | wireguard_free_blocks(wireguard_zones) }}
+    """
+    pool = AddressPool(network)
+    pool.take(*zone_resolver(zones).zones.values(), *(used or ()))
+    return pool.free_blocks()
+
+
+def wireguard_assigned_ips(hostvars, hosts, static_peers=None):
+    """
+    Collect the overlay addresses in use: hosts' wireguard_ip and static peers' allowed_ips.
+
+    Example: {{ hostvars | wireguard_assigned_ips(groups['all'], wireguard_static_peers) }}
+
+    Returns:
+        List of addresses and networks (a static peer may own a block)
+    """
+    assigned = [hostvars[host]['wireguard_ip'] for host in hosts or () if hostvars[host].get('wireguard_ip')]
+    for peer in (static_peers or {}).values():
+        assigned.extend(ip.strip() for ip in str(peer.get('allowed_ips') or '').split(',') if ip.strip())
+    return assigned
+
+
+def _inventory_hosts(group):
+    """Yield (name, vars) for every host of an inventory group and its children."""
+    for host, host_vars in (group.get('hosts') or {}).items():
+        yield host, host_vars or {}
+    for child in (group.get('children') or {}).values():
+        yield from _inventory_hosts(child or {})
+
+
+def main(argv=None):
+    """Allocate addresses or zones from inventory.yml's addressing plan."""
+    import yaml
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('-i', '--inventory', default=Path(__file__).parent.parent / 'inventory.yml',
+                        help='inventory file (default: inventory.yml)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    allocate = commands.add_parser('allocate', help='print the next free address(es) of a zone')
+    allocate.add_argument('zone')
+    allocate.add_argument('--count', type=int, default=1)
+    new_zone = commands.add_parser('new-zone', help='print a free block for a new zone')
+    new_zone.add_argument('prefixlen', type=int)
+    commands.add_parser('free', help='print the unassigned blocks of the overlay')
+    args = parser.parse_args(argv)
+
+    inventory = yaml.safe_load(Path(args.inventory).read_text())
+    inventory_vars = inventory['all'].get('vars') or {}
+    hostvars = dict(_inventory_hosts(inventory['all']))
+    zones = inventory_vars.get('wireguard_zones') or {}
+    used = wireguard_assigned_ips(hostvars, hostvars, inventory_vars.get('wireguard_static_peers'))
+
+    try:
+        if args.command == 'allocate':
+            print('\n'.join(wireguard_allocate_ip(args.zone, used, zones, args.count)))
+        elif args.command == 'new-zone':
+            print(wireguard_allocate_zone(inventory_vars['wireguard_network'], zones, args.prefixlen, used))
+        else:
+            print('\n'.join(wireguard_free_blocks(inventory_vars['wireguard_network'], zones, used)))
+    except AnsibleFilterError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+class FilterModule:
+    """Ansible filter plugin for the WireGuard addressing plan."""
+
+    def filters(self):
+        """Return filter mappings."""
+        return {
+            'wireguard_zone_of': wireguard_zone_of,
+            'wireguard_allocate_ip': wireguard_allocate_ip,
+            'wireguard_allocate_zone': wireguard_allocate_zone,
+            'wireguard_free_blocks': wireguard_free_blocks,
+            'wireguard_assigned_ips': wireguard_assigned_ips,
+        }
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+"""Ansible module: ensure a persisted WireGuard keypair and return it, in one invocation."""
+
+DOCUMENTATION = r'''
+---
+module: wireguard_keypair
+short_description: Ensure a persisted WireGuard keypair exists and return both keys
+description:
+  - Does in one remote invocation what used to take stat, slurp, copy, two
+    shell calls and a looped slurp per host.
+  - Keeps the private key in C(<directory>/<interface>.key) (mode 0600) and the
+    public key in C(<directory>/<interface>.pub).
+  - Without a persisted key, adopts the C(PrivateKey) of a live
+    C(<interface>.conf) (one-time migration, so an already-deployed host keeps
+    its key), or generates a new one with C(wg genkey).
+  - A missing C(.pub) is derived with C(wg pubkey). An existing one is returned
+    as is; the controller can check it with the wireguard_pubkey filter.
+  - Supports check mode; nothing is written and a key that would be generated
+    is left empty.
+options:
+  interface:
+    description: WireGuard interface name.
+    type: str
+    default: wg0
+  directory:
+    description: Directory holding the key files and the interface config.
+    type: path
+    default: /etc/wireguard
+  regenerate:
+    description: Discard the persisted pair and generate a new one (no migration).
+    type: bool
+    default: false
+requirements:
+  - wireguard-tools (C(wg)) on the host, only when a key has to be generated or derived
+'''
+
+EXAMPLES = r'''
+- name: Ensure the persisted WireGuard keypair
+  wireguard_keypair:
+    interface: wg0
+    regenerate: "{{ wireguard_regenerate_keys | default(false) | bool }}"
+  register: wireguard_keypair
+  no_log: true
+'''
+
+RETURN = r'''
+private_key:
+  description: Base64 private key (empty in check mode when it would be generated).
+  type: str
+  returned: always
+public_key:
+  description: Base64 public key (empty in check mode when it would be derived).
+  type: str
+  returned: always
+actions:
+  description: What was done, in order; any of removed, migrated, generated, derived.
+  type: list
+  elements: str
+  returned: always
+'''
+
+import os  # noqa: E402
+
+from ansible.module_utils.basic import AnsibleModule  # noqa: E402
+
+
+def live_private_key(conf_path):
+    """The [Interface] PrivateKey of a wg-quick config, or None if the file or key is missing."""
+    try:
+        with open(conf_path) as conf:
+            lines = conf.read().splitlines()
+    except FileNotFoundError:
+        return None
+    section = None
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if line.startswith('['):
+            section = line.lower()
+            continue
+        key, sep, value = line.partition('=')
+        if sep and section == '[interface]' and key.strip().lower() == 'privatekey' and value.strip():
+            return value.strip()
+    return None
+
+
+def _read(path):
+    try:
+        with open(path) as handle:
+            return handle.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write(path, content):
+    """Write content with a trailing newline, readable by root only (as `umask 077` did)."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as handle:
+        os.fchmod(handle.fileno(), 0o600)
+        handle.write(content + '\n')
+
+
+def ensure_keypair(directory, interface, regenerate, genkey, pubkey, check_mode=False):
+    """
+    Bring <interface>.key and <interface>.pub into place and return them.
+
+    Args:
+        directory: Directory of the key files and <interface>.conf
+        interface: WireGuard interface name
+        regenerate: Discard the persisted pair first
+        genkey: Callable returning a new base64 private key
+        pubkey: Callable deriving the base64 public key of a private key
+        check_mode: Report what would change without writing anything
+
+    Returns:
+        {'changed': bool, 'private_key': str, 'public_key': str, 'actions': [...]}
+    """
+    key_path = os.path.join(directory, f'{interface}.key')
+    pub_path = os.path.join(directory, f'{interface}.pub')
+    actions = []
+
+    if regenerate:
+        for path in (key_path, pub_path):
+            if os.path.exists(path):
+                if not check_mode:
+                    os.unlink(path)
+                actions.append('removed')
+        private_key = public_key = None
+    else:
+        private_key = _read(key_path)
+        public_key = _read(pub_path) if private_key else None
+
+    if not private_key:
+        if not regenerate:
+            private_key = live_private_key(os.path.join(directory, f'{interface}.conf'))
+        if private_key:
+            actions.append('migrated')
+        else:
+            private_key = None if check_mode else genkey()
+            actions.append('generated')
+        if private_key and not check_mode:
+            _write(key_path, private_key)
+        public_key = None
+
+    if not public_key:
+        public_key = pubkey(private_key) if private_key and not check_mode else None
+        actions.append('derived')
+        if public_key:
+            _write(pub_path, public_key)
+
+    return {
+        'changed': bool(actions),
+        'private_key': private_key or '',
+        'public_key': public_key or '',
+        'actions': list(dict.fromkeys(actions)),
+    }
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec={
+            'interface': {'type': 'str', 'default': 'wg0'},
+            'directory': {'type': 'path', 'default': '/etc/wireguard'},
+            'regenerate': {'type': 'bool', 'default': False},
+        },
+        supports_check_mode=True,
+    )
+
+    def wg(*args, data=None):
+        wg_bin = module.get_bin_path('wg', required=True)
+        rc, out, err = module.run_command([wg_bin, *args], data=data, binary_data=True)
+        if rc != 0:
+            module.fail_json(msg=f"wg {args[0]} failed: {err.strip()}")
+        return out.strip()
+
+    result = ensure_keypair(
+        module.params['directory'],
+        module.params['interface'],
+        module.params['regenerate'],
+        genkey=lambda: wg('genkey'),
+        pubkey=lambda private_key: wg('pubkey', data=private_key + '\n'),
+        check_mode=module.check_mode,
+    )
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
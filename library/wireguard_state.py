@@ -0,0 +1,301 @@
+#!/usr/bin/python
+"""Ansible module: collect a host's WireGuard state in one invocation."""
+
+DOCUMENTATION = r'''
+---
+module: wireguard_state
+short_description: Collect WireGuard link, config, live peer, key and reachability state
+description:
+  - Gathers in one remote invocation what used to take a stat, a slurp,
+    C(ip addr show), C(wg show all dump) and C(ping) tasks, each its own round trip.
+  - The config and the dump are parsed on the host into the structures the
+    parse_wireguard_config and parse_wg_dump filters return, so the result can
+    be fed to the other filters (index_wireguard_peers, ...) as is.
+  - Key material other than public keys is never returned, so the result is
+    safe to log.
+  - Read-only; supports check mode.
+options:
+  interface:
+    description: WireGuard interface name.
+    type: str
+    default: wg0
+  directory:
+    description: Directory holding the interface config and key files.
+    type: path
+    default: /etc/wireguard
+  config_checksum:
+    description:
+      - SHA-256 of a config the controller already holds parsed (e.g. from the
+        controller-side peer cache). When the deployed config still has it,
+        its parsed interface and peers are left out of the result.
+    type: str
+    default: ''
+  ping:
+    description:
+      - Overlay addresses to ping from the host. All targets are probed at the
+        same time, so the probe takes one I(ping_count) x I(ping_interval)
+        window however many targets there are.
+    type: list
+    elements: str
+    default: []
+  ping_count:
+    description: Echo requests sent to each ping target.
+    type: int
+    default: 3
+  ping_interval:
+    description: Seconds between echo requests (0.2 is the least ping allows without root).
+    type: float
+    default: 0.2
+requirements:
+  - wireguard-tools (C(wg)) and iproute2 (C(ip)) on the host
+'''
+
+EXAMPLES = r'''
+- name: Collect WireGuard state
+  wireguard_state:
+    interface: wg0
+    ping: "{{ [hostvars[groups['control_plane'][0]]['wireguard_ip']] }}"
+  register: wireguard_state
+
+- name: Probe the hub and every same-site direct peer at once
+  wireguard_state:
+    ping: [10.130.5.1, 10.130.5.65, 10.130.5.66, 10.130.5.67]
+    ping_count: 5
+  register: wireguard_probe
+'''
+
+RETURN = r'''
+link:
+  description: Interface link state from C(ip -j addr show).
+  type: dict
+  returned: always
+  sample: {exists: true, up: true, operstate: UNKNOWN, mtu: 1420, addresses: [10.130.5.1/24]}
+config:
+  description:
+    - The deployed config file. C(interface) and C(peers) are shaped as in
+      parse_wireguard_config, without PrivateKey, and are left out when
+      C(unchanged) is true.
+  type: dict
+  returned: always
+  sample: {exists: true, checksum: 3784b7a8..., mtime: 1760000000.5, unchanged: false, interface: {}, peers: {}}
+dump:
+  description:
+    - Live state of the interface from C(wg show all dump), shaped as parse_wg_dump
+      returns it for one interface, peers named as in the config. Empty when the
+      interface is down.
+  type: dict
+  returned: always
+keys:
+  description: The persisted key files; the private key itself is not returned.
+  type: dict
+  returned: always
+  sample: {private_key: {exists: true, mode: '0600'}, public_key: base64..., matches_live: true}
+handshake_ages:
+  description: Seconds since each live peer's latest handshake, by peer name (null if never).
+  type: dict
+  returned: always
+ping:
+  description: Result per ping target.
+  type: dict
+  returned: always
+  sample: {10.130.5.1: {rc: 0, transmitted: 3, received: 3, rtt_avg_ms: 12.3}}
+'''
+
+import hashlib  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import re  # noqa: E402
+import time  # noqa: E402
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
+
+from ansible.module_utils.basic import AnsibleModule  # noqa: E402
+
+try:
+    from ansible.module_utils.wireguard_parse import parse_wg_dump, scan_config_lines  # noqa: E402
+except ImportError:  # allows the unit tests to import this module from library/
+    from wireguard_parse import parse_wg_dump, scan_config_lines  # noqa: E402
+
+# Never returned: the interface's PrivateKey and the peers' PresharedKey
+_SECRET_KEYS = frozenset({'privatekey', 'presharedkey'})
+
+# Upper bound on concurrent ping processes
+_MAX_PROBES = 32
+
+_PING_COUNTS = re.compile(r'(\d+) packets transmitted, (\d+) (?:packets )?received')
+_PING_RTT = re.compile(r'= [\d.]+/([\d.]+)/')
+
+
+def parse_config(text):
+    """
+    {'interface': dict, 'peers': dict} of a wg-quick config, as parse_wireguard_config parses it.
+
+    Peers are named by the comment above their keys (or their key prefix);
+    secret keys are dropped.
+    """
+    interface = {}
+    peers = {}
+    for name, data in scan_config_lines(text.split('\n'), interface):
+        peer = {'public_key': data['publickey'], 'allowed_ips': data.get('allowedips', '')}
+        if 'endpoint' in data:
+            peer['endpoint'] = data['endpoint']
+        if 'persistentkeepalive' in data:
+            peer['persistent_keepalive'] = data['persistentkeepalive']
+        peers[name] = peer
+
+    for key in _SECRET_KEYS:
+        interface.pop(key, None)
+    return {'interface': interface, 'peers': peers}
+
+
+def parse_link(ip_json):
+    """Link state of the interface from `ip -j addr show dev <if>` output ('' if it does not exist)."""
+    try:
+        links = json.loads(ip_json) if ip_json else []
+    except ValueError:
+        links = []
+    if not links:
+        return {'exists': False, 'up': False, 'operstate': None, 'mtu': None, 'addresses': []}
+    link = links[0]
+    return {
+        'exists': True,
+        'up': 'UP' in link.get('flags', []),
+        'operstate': link.get('operstate'),
+        'mtu': link.get('mtu'),
+        'addresses': [f"{addr['local']}/{addr['prefixlen']}" for addr in link.get('addr_info', []) if 'local' in addr],
+    }
+
+
+def parse_ping(rc, output):
+    """{'rc', 'transmitted', 'received', 'rtt_avg_ms'} from `ping -q` output."""
+    counts = _PING_COUNTS.search(output or '')
+    rtt = _PING_RTT.search(output or '')
+    return {
+        'rc': rc,
+        'transmitted': int(counts.group(1)) if counts else 0,
+        'received': int(counts.group(2)) if counts else 0,
+        'rtt_avg_ms': float(rtt.group(1)) if rtt else None,
+    }
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as handle:
+            return handle.read()
+    except FileNotFoundError:
+        return None
+
+
+def collect_state(interface, directory, run, config_checksum='', ping=(), ping_count=3, ping_interval=0.2,
+                  now=None):
+    """
+    Everything the playbooks read about a host's WireGuard, gathered in one pass.
+
+    Args:
+        interface: WireGuard interface name
+        directory: Directory of <interface>.conf, .key and .pub
+        run: Callable taking an argv list and returning (rc, stdout, stderr)
+        config_checksum: SHA-256 of a config the caller already holds parsed
+        ping: Addresses to ping, all at the same time
+        ping_count: Echo requests per address
+        ping_interval: Seconds between echo requests
+        now: Current time in seconds (for handshake ages); defaults to time.time()
+
+    Returns:
+        Dictionary with 'link', 'config', 'dump', 'keys', 'handshake_ages' and 'ping'
+    """
+    now = time.time() if now is None else now
+    conf_path = os.path.join(directory, f'{interface}.conf')
+
+    raw = _read(conf_path)
+    parsed = parse_config(raw.decode('utf-8', 'surrogateescape')) if raw is not None else {'interface': {}, 'peers': {}}
+    config = {'exists': raw is not None, 'checksum': None, 'mtime': None, 'unchanged': False}
+    if raw is not None:
+        config['checksum'] = hashlib.sha256(raw).hexdigest()
+        config['mtime'] = os.stat(conf_path).st_mtime
+        config['unchanged'] = config['checksum'] == config_checksum
+    if not config['unchanged']:
+        config.update(parsed)
+
+    rc, out, _err = run(['ip', '-j', 'addr', 'show', 'dev', interface])
+    link = parse_link(out if rc == 0 else '')
+
+    rc, out, _err = run(['wg', 'show', 'all', 'dump'])
+    names = {peer['public_key']: name for name, peer in parsed['peers'].items()}
+    dump = parse_wg_dump(out if rc == 0 else '', interface, names)
+
+    key_stat = None
+    try:
+        key_stat = os.stat(os.path.join(directory, f'{interface}.key'))
+    except FileNotFoundError:
+        pass
+    public_key = (_read(os.path.join(directory, f'{interface}.pub')) or b'').decode('ascii', 'replace').strip()
+    live_key = dump['interface'].get('public_key')
+    keys = {
+        'private_key': {
+            'exists': key_stat is not None,
+            'mode': format(key_stat.st_mode & 0o7777, '04o') if key_stat else None,
+        },
+        'public_key': public_key,
+        'matches_live': public_key == live_key if public_key and live_key else None,
+    }
+
+    handshake_ages = {
+        name: int(now - peer['latest_handshake']) if peer['latest_handshake'] else None
+        for name, peer in dump['peers'].items()
+    }
+
+    # One thread per target: each mostly waits on its ping process, so N
+    # targets finish in one probe window instead of N.
+    targets = list(dict.fromkeys(ping))
+    pings = {}
+    if targets:
+        argv = ['ping', '-q', '-n', '-c', str(ping_count), '-i', str(ping_interval), '-W', '2']
+        with ThreadPoolExecutor(max_workers=min(len(targets), _MAX_PROBES)) as pool:
+            outputs = pool.map(lambda target: run(argv + [target]), targets)
+            for target, (rc, out, _err) in zip(targets, outputs):
+                pings[target] = parse_ping(rc, out)
+
+    return {
+        'interface': interface,
+        'link': link,
+        'config': config,
+        'dump': dump,
+        'keys': keys,
+        'handshake_ages': handshake_ages,
+        'ping': pings,
+    }
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec={
+            'interface': {'type': 'str', 'default': 'wg0'},
+            'directory': {'type': 'path', 'default': '/etc/wireguard'},
+            'config_checksum': {'type': 'str', 'default': ''},
+            'ping': {'type': 'list', 'elements': 'str', 'default': []},
+            'ping_count': {'type': 'int', 'default': 3},
+            'ping_interval': {'type': 'float', 'default': 0.2},
+        },
+        supports_check_mode=True,
+    )
+
+    def run(argv):
+        binary = module.get_bin_path(argv[0])
+        if binary is None:
+            return 127, '', f'{argv[0]} not found'
+        return module.run_command([binary, *argv[1:]])
+
+    result = collect_state(
+        module.params['interface'],
+        module.params['directory'],
+        run,
+        config_checksum=module.params['config_checksum'],
+        ping=module.params['ping'],
+        ping_count=module.params['ping_count'],
+        ping_interval=module.params['ping_interval'],
+    )
+    module.exit_json(changed=False, **result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""WireGuard config and dump parsing shared by the filter plugins and the wireguard_state module."""
+
+from io import StringIO
+
+# Keys that may appear on several lines of one section, each adding to the list
+REPEATABLE_KEYS = frozenset({'allowedips', 'address', 'dns'})
+
+
+def scan_config_lines(lines, interface):
+    """
+    Yield (name, keys) for each [Peer] section of an iterable of lines.
+
+    keys maps the lowercased config keys of the section to their values;
+    the peer is named by the comment above its keys (or its key prefix) and
+    sections without a PublicKey are skipped. [Interface] keys are collected
+    into the interface dict as a side effect. Only the section being read is
+    held in memory; each line is stripped exactly once.
+    """
+    current_section = None
+    current_comment = None
+    current_data = None
+
+    for line in lines:
+        stripped = line.strip()
+        if not stripped:
+            continue
+        first = stripped[0]
+
+        if first == '#':
+            comment_text = stripped[1:].strip()
+            # "# PublicKey = base64key..." records the interface's own key
+            if current_section == 'interface' and 'publickey' in comment_text.lower():
+                key, sep, value = comment_text.partition('=')
+                if sep and key.strip().lower() == 'publickey':
+                    interface['public_key'] = value.strip()
+            else:
+                # Regular comment (peer name, etc.)
+                current_comment = comment_text
+            continue
+
+        if first == '[':
+            # Any section header closes the peer being collected
+            if current_section == 'peer' and current_data.get('publickey'):
+                yield current_comment or current_data['publickey'][:12], current_data
+
+            current_comment = None
+            if '[Peer]' in stripped:
+                current_section = 'peer'
+                current_data = {}
+            elif '[Interface]' in stripped:
+                current_section = 'interface'
+                current_data = interface
+            else:
+                current_section = None
+                current_data = None
+            continue
+
+        if current_data is not None:
+            key, sep, value = stripped.partition('=')
+            if sep:
+                key = key.strip().lower()
+                value = value.strip()
+                if key in REPEATABLE_KEYS and current_data.get(key):
+                    # wg(8)/wg-quick(8) accumulate these across repeated lines
+                    value = current_data[key] + ', ' + value
+                current_data[key] = value
+
+    # Don't forget the last peer
+    if current_section == 'peer' and current_data.get('publickey'):
+        yield current_comment or current_data['publickey'][:12], current_data
+
+
+def parse_wg_dump(dump_text, interface=None, names=None):
+    """
+    Parse `wg show all dump` output into live interface and peer state.
+
+    The dump is tab-separated, one line per interface followed by its peers:
+        <iface> <private-key> <public-key> <listen-port> <fwmark>
+        <iface> <public-key> <preshared-key> <endpoint> <allowed-ips>
+                <latest-handshake> <transfer-rx> <transfer-tx> <persistent-keepalive>
+    Each interface is returned in the same structure as parse_wireguard_config,
+    with the live counters added to every peer. Key material other than public
+    keys (private and preshared keys) is dropped.
+
+    Args:
+        dump_text: Output of `wg show all dump`
+        interface: Return only this interface (an empty structure if it is down)
+        names: Optional mapping of public key to peer name; unnamed peers are
+            named after their key prefix, as in parse_wireguard_config
+
+    Returns:
+        {'wg0': {'interface': {'public_key': ..., 'listenport': '51820'},
+                 'peers': {'peer_name': {'public_key', 'allowed_ips',
+                                         'endpoint' (optional),
+                                         'persistent_keepalive' (optional),
+                                         'latest_handshake', 'transfer_rx',
+                                         'transfer_tx'}}}}
+        or just the inner structure when interface is given.
+    """
+    names = names or {}
+    interfaces = {}
+    for line in StringIO(dump_text or ''):
+        fields = line.rstrip('\r\n').split('\t')
+        if len(fields) == 5:
+            iface, _private_key, public_key, listen_port, fwmark = fields
+            state = interfaces.setdefault(iface, {'interface': {}, 'peers': {}})
+            state['interface']['public_key'] = public_key
+            if listen_port not in ('0', '(none)'):
+                state['interface']['listenport'] = listen_port
+            if fwmark not in ('off', '(none)'):
+                state['interface']['fwmark'] = fwmark
+        elif len(fields) == 9:
+            iface, public_key, _psk, endpoint, allowed_ips, handshake, rx, tx, keepalive = fields
+            peer = {
+                'public_key': public_key,
+                'allowed_ips': '' if allowed_ips == '(none)' else ', '.join(allowed_ips.split(',')),
+                'latest_handshake': int(handshake),
+                'transfer_rx': int(rx),
+                'transfer_tx': int(tx),
+            }
+            if endpoint != '(none)':
+                peer['endpoint'] = endpoint
+            if keepalive not in ('off', '(none)'):
+                peer['persistent_keepalive'] = keepalive
+            state = interfaces.setdefault(iface, {'interface': {}, 'peers': {}})
+            state['peers'][names.get(public_key) or public_key[:12]] = peer
+
+    if interface is not None:
+        return interfaces.get(interface, {'interface': {}, 'peers': {}})
+    return interfaces
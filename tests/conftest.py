@@ -0,0 +1,11 @@
+"""Shared pytest fixtures."""
+
+import pytest
+
+from inventory_model import load_inventory
+
+
+@pytest.fixture(scope="session")
+def inventory_model():
+    """inventory.yml parsed once for the whole test session."""
+    return load_inventory()
@@ -0,0 +1,131 @@
+"""Parsed, precompiled view of inventory.yml's WireGuard addressing plan.
+
+test_inventory_zones.py used to re-read and re-parse inventory.yml, and rebuild
+every zone network, for each lookup. InventoryModel parses the YAML once,
+compiles the zones into the ZoneResolver the wireguard_zone_of filter uses
+(filter_plugins/wireguard_zones.py) and precomputes the (name, ip, zone)
+entries and the zone each IP falls in, so validating thousands of hosts costs
+one pass. load_inventory() caches one model per path for the whole session;
+tests/conftest.py exposes it as the `inventory_model` fixture.
+
+Also usable on generated inventories (tests/synthetic_inventory.py):
+    InventoryModel(generate_inventory(hosts=5000)).violations()
+"""
+
+import ipaddress
+import sys
+from collections import namedtuple
+from functools import cache
+from pathlib import Path
+
+import yaml
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'filter_plugins'))
+
+from wireguard_zones import ZoneResolver  # noqa: E402
+
+INVENTORY = Path(__file__).parent.parent / "inventory.yml"
+
+Entry = namedtuple('Entry', 'name ip zone')
+
+
+def _address(ip):
+    """ip as an IPv4Address/IPv6Address, or None if missing or malformed."""
+    try:
+        return ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+
+
+class InventoryModel:
+    """The hosts, static peers and zones of one inventory, parsed once."""
+
+    def __init__(self, data):
+        self.data = data
+        self.vars = data["all"].get("vars") or {}
+        network = self.vars.get("wireguard_network")
+        self.overlay = ipaddress.ip_network(network) if network else None
+        # not strict: overlapping zones are reported by violations(), not raised
+        self.resolver = ZoneResolver(self.vars.get("wireguard_zones"), strict=False)
+        self.zones = self.resolver.zones
+        self.entries = tuple(self._entries())
+        self.derived_zones = {entry.name: self.zone_of(entry.ip) for entry in self.entries}
+
+    @classmethod
+    def from_file(cls, path=INVENTORY):
+        return cls(yaml.safe_load(Path(path).read_text()))
+
+    def _entries(self):
+        """Yield an Entry for every host and static peer."""
+        for group in self.data["all"]["children"].values():
+            for host, hv in (group.get("hosts") or {}).items():
+                yield Entry(host, hv.get("wireguard_ip"), hv.get("wireguard_zone"))
+        for peer, pv in (self.vars.get("wireguard_static_peers") or {}).items():
+            ip = (pv.get("allowed_ips") or "").split("/")[0] or None
+            yield Entry(peer, ip, pv.get("zone"))
+
+    def zone_of(self, ip):
+        """The single zone whose CIDR contains ip, or None (no zone, several, or a bad IP)."""
+        return self.resolver.zone_of(ip)
+
+    def duplicate_ips(self):
+        """[(ip, first_name, second_name)] for every IP assigned more than once.
+
+        Entries without an IP are reported as missing by violations(), not as
+        duplicates of each other.
+        """
+        seen = {}
+        duplicates = []
+        for name, ip, _ in self.entries:
+            if ip is None:
+                continue
+            if ip in seen:
+                duplicates.append((ip, seen[ip], name))
+            else:
+                seen[ip] = name
+        return duplicates
+
+    def overlapping_zones(self):
+        """[(zone_a, zone_b)] for every pair of overlapping zones, found when the resolver was built."""
+        return list(self.resolver.overlaps)
+
+    def violations(self):
+        """Every breach of the addressing plan, one message each ([] when valid).
+
+        The same rules test_inventory_zones.py checks per entry, in one pass,
+        for inventories too large to parametrize.
+        """
+        problems = []
+        for name, ip, zone in self.entries:
+            if not ip or not zone:
+                problems.append(f"{name}: missing WireGuard IP or zone")
+                continue
+            if zone not in self.zones:
+                problems.append(f"{name}: zone '{zone}' is not defined in wireguard_zones")
+            addr = _address(ip)
+            if addr is None:
+                problems.append(f"{name}: '{ip}' is not an IP address")
+                continue
+            if self.overlay is not None and addr not in self.overlay:
+                problems.append(f"{name}: {ip} is outside {self.overlay}")
+            if self.derived_zones[name] != zone:
+                problems.append(f"{name}: IP {ip} is in zone '{self.derived_zones[name]}' but is declared as '{zone}'")
+        problems.extend(f"duplicate IP {ip}: {a} and {b}" for ip, a, b in self.duplicate_ips())
+        problems.extend(f"zones overlap: {a} and {b}" for a, b in self.overlapping_zones())
+        if self.overlay is not None:
+            problems.extend(
+                f"zone {z} ({net}) is not within {self.overlay}"
+                for z, net in self.zones.items()
+                if net.version != self.overlay.version or not net.subnet_of(self.overlay)
+            )
+        return problems
+
+
+def load_inventory(path=INVENTORY):
+    """The InventoryModel of path, parsed once per process."""
+    return _load_inventory(Path(path).resolve())
+
+
+@cache
+def _load_inventory(path):
+    return InventoryModel.from_file(path)
@@ -0,0 +1,227 @@
+"""Generate large synthetic inventories shaped like inventory.yml.
+
+The real inventory has six hosts, which hides anything quadratic in the
+template, the filters or the zone tests. generate_inventory() builds the same
+structure (control_plane/workers groups, `all.vars` with wireguard_network,
+wireguard_zones and wireguard_static_peers) with thousands of hosts:
+
+- zones are carved out of the overlay network, each sized for its members,
+  and every host or static peer gets a unique address inside its own zone
+  (skipping the zone's network and broadcast addresses, as the real plan does)
+- cloud nodes (the control plane and a share of the workers) sit in `oci`
+  with no direct-peer group; home workers sit in `home-static`, spread round
+  robin over the direct-peer groups, each group on its own LAN so
+  `wireguard_lan_endpoint`s are unique
+- static peers are spread over the owned/external mobile and static zones
+
+The output passes tests/test_inventory_zones.py's rules. hostvars_and_groups()
+flattens it into the (hostvars, groups) pair the template and filters take,
+adding the key facts ensure_keys.yml would set.
+
+Write one to disk with:
+    uv run python tests/synthetic_inventory.py --hosts 5000 -o /tmp/inventory.yml
+"""
+
+import argparse
+import base64
+import hashlib
+import ipaddress
+import sys
+from pathlib import Path
+
+import yaml
+
+CONTROL_PLANE = 'control-plane'
+CLOUD_ZONE = 'oci'
+HOME_ZONE = 'home-static'
+STATIC_ZONES = ('owned-mobile', 'external-static', 'external-mobile')
+LAN_NETWORK = '172.16.0.0/12'
+
+
+def _block_for(count):
+    """Smallest prefix length whose block holds count hosts plus network/broadcast."""
+    return 32 - max(2, (count + 1).bit_length())
+
+
+def _carve(parent, sizes):
+    """Allocate an aligned subnet of parent for every {name: host_count}.
+
+    Largest blocks go first, so each next block starts aligned and the layout
+    is as tight as a buddy allocator's.
+    """
+    parent = ipaddress.ip_network(parent)
+    cursor = int(parent.network_address)
+    blocks = {}
+    for name, count in sorted(sizes.items(), key=lambda item: (_block_for(item[1]), item[0])):
+        prefix = _block_for(count)
+        if prefix < parent.prefixlen or cursor + 2 ** (32 - prefix) > int(parent.broadcast_address) + 1:
+            raise ValueError(f"{parent} is too small for {len(sizes)} blocks of {sum(sizes.values())} hosts")
+        block = ipaddress.ip_network((cursor, prefix))
+        blocks[name] = block
+        cursor += block.num_addresses
+    return blocks
+
+
+def _overlay_for(zone_sizes, base='10.130.0.0'):
+    """Smallest network at base that fits all zones (the real plan uses a /24)."""
+    total = sum(2 ** (32 - _block_for(count)) for count in zone_sizes.values())
+    return ipaddress.ip_network((base, min(24, 32 - (total - 1).bit_length())), strict=False)
+
+
+def _hosts_of(network):
+    """Usable addresses of network as strings, in order."""
+    return (str(address) for address in network.hosts())
+
+
+def synthetic_key(name, seed=0):
+    """A deterministic, well-formed WireGuard key (base64 of 32 bytes) for name."""
+    return base64.b64encode(hashlib.sha256(f'{seed}:{name}'.encode()).digest()).decode('ascii')
+
+
+def generate_inventory(hosts=1000, static_peers=100, direct_peer_groups=10, cloud_share=0.1,
+                       network=None):
+    """
+    Build an inventory.yml-shaped dict with the given number of hosts.
+
+    Args:
+        hosts: Total number of hosts, the control plane included
+        static_peers: Number of wireguard_static_peers
+        direct_peer_groups: Number of wireguard_direct_peer_group values the
+            home workers are spread over (0 for a hub-only inventory)
+        cloud_share: Fraction of workers placed in the cloud zone, next to
+            the control plane
+        network: Overlay network (wireguard_network); by default the smallest
+            network at 10.130.0.0 that fits every zone
+
+    Returns:
+        {'all': {'children': {'control_plane': {...}, 'workers': {...}}, 'vars': {...}}}
+
+    Raises:
+        ValueError: If the overlay network cannot hold the zones
+    """
+    if hosts < 1:
+        raise ValueError("an inventory needs at least the control plane host")
+
+    workers = hosts - 1
+    cloud_workers = round(workers * cloud_share) if direct_peer_groups else workers
+    home_workers = workers - cloud_workers
+    static_counts = {zone: len(range(index, static_peers, len(STATIC_ZONES)))
+                     for index, zone in enumerate(STATIC_ZONES)}
+
+    zone_sizes = {CLOUD_ZONE: 1 + cloud_workers, HOME_ZONE: home_workers, **static_counts}
+    zone_sizes = {zone: count for zone, count in zone_sizes.items() if count}
+    overlay = ipaddress.ip_network(network) if network else _overlay_for(zone_sizes)
+    zones = _carve(overlay, zone_sizes)
+    addresses = {zone: _hosts_of(block) for zone, block in zones.items()}
+
+    group_names = [f'site-{index:03d}' for index in range(direct_peer_groups)]
+    group_members = {name: len(range(index, home_workers, len(group_names)))
+                     for index, name in enumerate(group_names)}
+    lans = {name: _hosts_of(block) for name, block in _carve(LAN_NETWORK, group_members).items()}
+
+    control_plane = {
+        CONTROL_PLANE: {
+            'ansible_host': f'{CONTROL_PLANE}.example.com',
+            'ansible_user': 'ubuntu',
+            'wireguard_ip': next(addresses[CLOUD_ZONE]),
+            'wireguard_zone': CLOUD_ZONE,
+            'architecture': 'arm64',
+            'wireguard_interface': 'wg0',
+            'wireguard_port': 51820,
+        },
+    }
+
+    worker_hosts = {}
+    for index in range(workers):
+        name = f'worker-{index:05d}'
+        host = {
+            'ansible_host': name,
+            'ansible_user': 'ubuntu',
+            'architecture': ('arm64', 'amd64')[index % 2],
+            'wireguard_interface': 'wg0',
+            'has_ufw': True,
+        }
+        if index < cloud_workers:
+            host.update(wireguard_ip=next(addresses[CLOUD_ZONE]), wireguard_zone=CLOUD_ZONE)
+        else:
+            group = group_names[(index - cloud_workers) % len(group_names)]
+            host.update(
+                wireguard_ip=next(addresses[HOME_ZONE]),
+                wireguard_zone=HOME_ZONE,
+                wireguard_direct_peer_group=group,
+                wireguard_lan_endpoint=next(lans[group]),
+            )
+        worker_hosts[name] = host
+
+    static = {}
+    for index in range(static_peers):
+        name = f'static-{index:05d}'
+        zone = STATIC_ZONES[index % len(STATIC_ZONES)]
+        static[name] = {
+            'public_key': synthetic_key(name),
+            'allowed_ips': f'{next(addresses[zone])}/32',
+            'zone': zone,
+        }
+
+    return {
+        'all': {
+            'children': {
+                'control_plane': {'hosts': control_plane},
+                'workers': {'hosts': worker_hosts},
+            },
+            'vars': {
+                'wireguard_network': str(overlay),
+                'wireguard_port': 51820,
+                'wireguard_direct_peer_group': '',
+                'wireguard_zones': {zone: str(block) for zone, block in zones.items()},
+                'wireguard_static_peers': static,
+            },
+        },
+    }
+
+
+def hostvars_and_groups(inventory, seed=0):
+    """
+    Flatten an inventory dict into the (hostvars, groups) Ansible would expose.
+
+    Group vars are layered under host vars, and every host gets the
+    wireguard_private_key / wireguard_public_key facts ensure_keys.yml sets.
+    """
+    inventory_vars = inventory['all'].get('vars') or {}
+    hostvars = {}
+    groups = {'all': []}
+    for group, members in inventory['all']['children'].items():
+        groups[group] = []
+        for host, host_vars in (members.get('hosts') or {}).items():
+            hostvars[host] = {
+                **inventory_vars,
+                **host_vars,
+                'inventory_hostname': host,
+                'wireguard_private_key': synthetic_key(f'{host}-private', seed),
+                'wireguard_public_key': synthetic_key(host, seed),
+            }
+            groups[group].append(host)
+            groups['all'].append(host)
+    return hostvars, groups
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--hosts', type=int, default=1000, help='number of hosts (default: 1000)')
+    parser.add_argument('--static-peers', type=int, default=100, help='number of static peers (default: 100)')
+    parser.add_argument('--groups', type=int, default=10, help='number of direct-peer groups (default: 10)')
+    parser.add_argument('--network', help='overlay network (default: smallest that fits)')
+    parser.add_argument('-o', '--output', help='file to write (default: stdout)')
+    args = parser.parse_args(argv)
+
+    inventory = generate_inventory(args.hosts, args.static_peers, args.groups, network=args.network)
+    text = '---\n' + yaml.safe_dump(inventory, sort_keys=False, default_flow_style=False)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Tests for the InventoryModel behind test_inventory_zones.py."""
+
+import copy
+
+import pytest
+
+from inventory_model import INVENTORY, InventoryModel, load_inventory
+from synthetic_inventory import generate_inventory
+
+BASE = generate_inventory(hosts=40, static_peers=9, direct_peer_groups=3)
+
+
+def _worker(inventory, name='worker-00010'):
+    return inventory['all']['children']['workers']['hosts'][name]
+
+
+def _static(inventory, name='static-00000'):
+    return inventory['all']['vars']['wireguard_static_peers'][name]
+
+
+def _set_zone(inventory, zone, cidr):
+    inventory['all']['vars']['wireguard_zones'][zone] = cidr
+
+
+class TestViolations:
+    """Every rule of the addressing plan is reported once, by name."""
+
+    # Test cases: (description, mutation, expected message fragments)
+    test_cases = [
+        ("valid inventory", lambda inv: None, []),
+        (
+            "missing zone",
+            lambda inv: _worker(inv).pop('wireguard_zone'),
+            ["worker-00010: missing WireGuard IP or zone"],
+        ),
+        (
+            "unknown zone",
+            lambda inv: _static(inv).update(zone='nowhere'),
+            ["static-00000: zone 'nowhere' is not defined", "declared as 'nowhere'"],
+        ),
+        (
+            "zone mismatch",
+            lambda inv: _worker(inv).update(wireguard_zone='oci'),
+            ["worker-00010: IP 10.130.0.", "but is declared as 'oci'"],
+        ),
+        (
+            "duplicate IP",
+            lambda inv: _worker(inv, 'worker-00011').update(wireguard_ip=_worker(inv)['wireguard_ip']),
+            ["duplicate IP 10.130.0.", "worker-00010 and worker-00011"],
+        ),
+        (
+            "malformed IP",
+            lambda inv: _worker(inv).update(wireguard_ip='10.130.0.999'),
+            ["worker-00010: '10.130.0.999' is not an IP address"],
+        ),
+        (
+            "IP outside the overlay",
+            lambda inv: (_worker(inv).update(wireguard_ip='10.131.0.1'),
+                         _set_zone(inv, 'home-static', '10.131.0.0/26')),
+            ["worker-00010: 10.131.0.1 is outside 10.130.0.0/24",
+             "zone home-static (10.131.0.0/26) is not within 10.130.0.0/24"],
+        ),
+        (
+            "overlapping zones",
+            lambda inv: _set_zone(inv, 'spare', '10.130.0.0/25'),
+            ["zones overlap: spare and home-static"],
+        ),
+    ]
+
+    @pytest.mark.parametrize("description,mutate,expected", test_cases)
+    def test_violations(self, description, mutate, expected):
+        inventory = copy.deepcopy(BASE)
+        mutate(inventory)
+        problems = InventoryModel(inventory).violations()
+        for fragment in expected:
+            assert any(fragment in problem for problem in problems), f"Failed: {description}: {problems}"
+        if not expected:
+            assert problems == [], f"Failed: {description}"
+
+
+def test_hosts_without_ip_are_not_duplicates():
+    """Two hosts missing their IP are each reported missing, never as a duplicate pair."""
+    inventory = copy.deepcopy(BASE)
+    _worker(inventory).pop('wireguard_ip')
+    _worker(inventory, 'worker-00011').pop('wireguard_ip')
+    model = InventoryModel(inventory)
+    assert model.duplicate_ips() == []
+    problems = model.violations()
+    assert not any(problem.startswith('duplicate IP') for problem in problems), problems
+    for name in ('worker-00010', 'worker-00011'):
+        assert f"{name}: missing WireGuard IP or zone" in problems, problems
+
+
+class TestZoneOf:
+    """zone_of resolves an address to the one zone containing it."""
+
+    model = InventoryModel(BASE)
+
+    # Test cases: (description, ip, expected zone)
+    test_cases = [
+        ("first host of the largest zone", "10.130.0.1", "home-static"),
+        ("static peer", _static(BASE)['allowed_ips'].split('/')[0], "owned-mobile"),
+        ("outside every zone", "10.130.0.250", None),
+        ("missing", None, None),
+        ("malformed", "not-an-ip", None),
+        ("other address family", "fd00::1", None),
+    ]
+
+    @pytest.mark.parametrize("description,ip,expected", test_cases)
+    def test_zone_of(self, description, ip, expected):
+        assert self.model.zone_of(ip) == expected, f"Failed: {description}"
+
+    def test_nested_zones_are_ambiguous(self):
+        inventory = copy.deepcopy(BASE)
+        _set_zone(inventory, 'spare', '10.130.0.0/30')
+        assert InventoryModel(inventory).zone_of('10.130.0.1') is None
+
+
+def test_real_inventory_is_parsed_once(inventory_model):
+    assert load_inventory() is inventory_model
+    assert load_inventory(INVENTORY) is inventory_model
+    assert inventory_model.violations() == []
+
+
+def test_validation_at_scale():
+    """Thousands of hosts validate in one pass; a single bad entry is still found."""
+    inventory = generate_inventory(hosts=5000, static_peers=1000, direct_peer_groups=50)
+    assert InventoryModel(inventory).violations() == []
+
+    _worker(inventory, 'worker-04321').update(wireguard_ip=_worker(inventory, 'worker-01234')['wireguard_ip'])
+    assert len(InventoryModel(inventory).violations()) == 1
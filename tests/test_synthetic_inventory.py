@@ -0,0 +1,118 @@
+"""Tests for the synthetic inventory generator used for scale testing."""
+
+import ipaddress
+import sys
+from collections import Counter
+from pathlib import Path
+
+import pytest
+import yaml
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'filter_plugins'))
+
+from synthetic_inventory import generate_inventory, hostvars_and_groups, main
+from test_wireguard_template import wireguard_jinja_env
+from wireguard_filters import render_wireguard_config, wireguard_direct_peer_index, wireguard_topology
+
+
+def _entries(inventory):
+    """(name, ip, zone) for every host and static peer, as test_inventory_zones reads them."""
+    entries = []
+    for group in inventory['all']['children'].values():
+        for host, host_vars in group['hosts'].items():
+            entries.append((host, host_vars['wireguard_ip'], host_vars['wireguard_zone']))
+    for peer, peer_vars in inventory['all']['vars']['wireguard_static_peers'].items():
+        entries.append((peer, peer_vars['allowed_ips'].split('/')[0], peer_vars['zone']))
+    return entries
+
+
+class TestGenerateInventory:
+    """The generated inventory must satisfy the addressing plan's rules at any size."""
+
+    # Test cases: (description, generator kwargs)
+    test_cases = [
+        ("defaults", {}),
+        ("single host", {'hosts': 1, 'static_peers': 0}),
+        ("hub only, no direct-peer groups", {'hosts': 200, 'direct_peer_groups': 0}),
+        ("thousands of hosts", {'hosts': 5000, 'static_peers': 500, 'direct_peer_groups': 40}),
+        ("explicit overlay network", {'hosts': 300, 'static_peers': 30, 'network': '10.130.0.0/16'}),
+    ]
+
+    @pytest.mark.parametrize("description,kwargs", test_cases)
+    def test_counts(self, description, kwargs):
+        inventory = generate_inventory(**kwargs)
+        children = inventory['all']['children']
+        static = inventory['all']['vars']['wireguard_static_peers']
+        assert len(children['control_plane']['hosts']) == 1, f"Failed: {description}"
+        assert len(children['workers']['hosts']) == kwargs.get('hosts', 1000) - 1, f"Failed: {description}"
+        assert len(static) == kwargs.get('static_peers', 100), f"Failed: {description}"
+
+    @pytest.mark.parametrize("description,kwargs", test_cases)
+    def test_addresses_follow_zone_plan(self, description, kwargs):
+        """Unique IPs, each inside its declared zone, zones disjoint inside the overlay."""
+        inventory = generate_inventory(**kwargs)
+        overlay = ipaddress.ip_network(inventory['all']['vars']['wireguard_network'])
+        zones = {zone: ipaddress.ip_network(cidr)
+                 for zone, cidr in inventory['all']['vars']['wireguard_zones'].items()}
+        entries = _entries(inventory)
+
+        for name, ip, zone in entries:
+            address = ipaddress.ip_address(ip)
+            assert address in zones[zone], f"Failed: {description}: {name} {ip} not in {zone}"
+            assert address not in (zones[zone].network_address, zones[zone].broadcast_address), \
+                f"Failed: {description}: {name} got {ip}"
+        assert len({ip for _, ip, _ in entries}) == len(entries), f"Failed: {description}"
+
+        ordered = sorted(zones.values())
+        assert all(net.subnet_of(overlay) for net in ordered), f"Failed: {description}"
+        assert not any(a.overlaps(b) for a, b in zip(ordered, ordered[1:])), f"Failed: {description}"
+
+    @pytest.mark.parametrize("description,kwargs", test_cases)
+    def test_direct_peer_groups(self, description, kwargs):
+        """Home workers are spread evenly over the groups, each with unique LAN endpoints."""
+        inventory = generate_inventory(**kwargs)
+        workers = inventory['all']['children']['workers']['hosts'].values()
+        grouped = [host for host in workers if host.get('wireguard_direct_peer_group')]
+        sizes = Counter(host['wireguard_direct_peer_group'] for host in grouped)
+
+        assert len(sizes) <= kwargs.get('direct_peer_groups', 10), f"Failed: {description}"
+        assert not sizes or max(sizes.values()) - min(sizes.values()) <= 1, f"Failed: {description}"
+        endpoints = [host['wireguard_lan_endpoint'] for host in grouped]
+        assert len(set(endpoints)) == len(endpoints), f"Failed: {description}"
+
+    def test_network_too_small(self):
+        with pytest.raises(ValueError, match="too small"):
+            generate_inventory(hosts=500, network='10.130.5.0/24')
+
+    def test_deterministic(self):
+        assert generate_inventory(hosts=300) == generate_inventory(hosts=300)
+
+
+class TestHostvarsAndGroups:
+    """The flattened inventory drives the template and the filters."""
+
+    def test_groups_and_layering(self):
+        hostvars, groups = hostvars_and_groups(generate_inventory(hosts=50))
+        assert groups['control_plane'] == ['control-plane']
+        assert len(groups['workers']) == 49
+        assert groups['all'] == groups['control_plane'] + groups['workers']
+        # group vars are visible, host vars win over them
+        assert hostvars['worker-00000']['wireguard_direct_peer_group'] == ''
+        assert hostvars['worker-00010']['wireguard_direct_peer_group'].startswith('site-')
+        assert len({host['wireguard_public_key'] for host in hostvars.values()}) == 50
+
+    def test_template_renders_at_scale(self):
+        """wg0.conf.j2 and the native renderer agree on a 2000-host inventory."""
+        hostvars, groups = hostvars_and_groups(generate_inventory(hosts=2000, direct_peer_groups=20))
+        index = wireguard_direct_peer_index(hostvars, groups['all'])
+        template = wireguard_jinja_env().get_template('wg0.conf.j2')
+        for host in ('worker-00000', 'worker-00500', 'worker-01998'):
+            context = dict(hostvars[host], groups=groups, hostvars=hostvars)
+            native = render_wireguard_config(wireguard_topology(context, hostvars, groups, index))
+            assert native == template.render(context), host
+
+
+def test_cli_writes_inventory(tmp_path):
+    output = tmp_path / 'inventory.yml'
+    assert main(['--hosts', '120', '--static-peers', '12', '--groups', '3', '-o', str(output)]) == 0
+    assert yaml.safe_load(output.read_text()) == generate_inventory(120, 12, 3)
@@ -1,5 +1,10 @@
 """Table-driven tests for WireGuard filter plugins."""
 
+import base64
+import gc
+import hashlib
+import io
+import json
 import sys
 from pathlib import Path
 
@@ -9,12 +14,33 @@ import pytest
 sys.path.insert(0, str(Path(__file__).parent.parent / 'filter_plugins'))
 
 from wireguard_filters import (
+    AnsibleFilterError,
+    _PeerRecord,
     parse_wireguard_config,
     parse_wireguard_peers,
+    iter_wireguard_peers,
+    parse_wg_dump,
+    parse_wireguard_ast,
+    serialize_wireguard_ast,
+    patch_wireguard_peers,
     merge_wireguard_peers,
+    build_worker_peers,
     filter_peers_by_inventory,
+    wireguard_parse_cache_info,
+    load_wireguard_peer_cache,
+    wireguard_peer_cache_record,
+    wireguard_peer_cache_digest,
+    index_wireguard_peers,
+    collapse_allowed_ips,
+    aggregate_wireguard_peers,
+    wireguard_peer_delta,
+    diff_wireguard_configs,
+    wireguard_direct_peer_index,
+    wireguard_latency_matrix,
 )
 
+PEER_DELTA_FIXTURES = sorted((Path(__file__).parent / 'fixtures' / 'peer_delta').iterdir())
+
 
 class TestParseWireguardConfig:
     """Table-driven tests for parse_wireguard_config filter."""
@@ -80,6 +106,46 @@ AllowedIPs = 10.130.5.4/32
                 'peers': {}
             },
         ),
+        (
+            "CRLF line endings and padded keys",
+            "[Interface]\r\n  PrivateKey=server_key  \r\n\r\n[Peer]\r\n#  test-worker-1  \r\n"
+            "PublicKey=jDUMMYcrlfKEY555555555abcdefGHIJKLMNOPQRST=\r\nAllowedIPs=10.130.5.3/32\r\n",
+            {
+                'interface': {
+                    'privatekey': 'server_key',
+                },
+                'peers': {
+                    'test-worker-1': {
+                        'public_key': 'jDUMMYcrlfKEY555555555abcdefGHIJKLMNOPQRST=',
+                        'allowed_ips': '10.130.5.3/32',
+                    }
+                }
+            },
+        ),
+        (
+            "last comment in a peer section names the peer",
+            """[Interface]
+PrivateKey = server_key
+# Worker nodes
+
+[Peer]
+# first-comment
+# test-worker-1
+PublicKey = kDUMMYcommentKEY666666abcdefGHIJKLMNOPQRST=
+AllowedIPs = 10.130.5.3/32
+""",
+            {
+                'interface': {
+                    'privatekey': 'server_key',
+                },
+                'peers': {
+                    'test-worker-1': {
+                        'public_key': 'kDUMMYcommentKEY666666abcdefGHIJKLMNOPQRST=',
+                        'allowed_ips': '10.130.5.3/32',
+                    }
+                }
+            },
+        ),
     ]
 
     @pytest.mark.parametrize("description,config,expected", test_cases)
@@ -89,6 +155,89 @@ AllowedIPs = 10.130.5.4/32
         assert result == expected, f"Failed: {description}"
 
 
+class TestParseCache:
+    """Tests for the digest-keyed parse cache behind parse_wireguard_config."""
+
+    config = """[Interface]
+PrivateKey = cache_server_key
+
+[Peer]
+# cache-worker
+PublicKey = lDUMMYcacheKEY77777777abcdefGHIJKLMNOPQRST=
+AllowedIPs = 10.130.5.9/32
+"""
+
+    def test_repeated_parse_hits_cache(self):
+        """Re-parsing identical text is served from the cache, not rescanned."""
+        parse_wireguard_config(self.config)
+        before = wireguard_parse_cache_info()
+        parse_wireguard_config(self.config)
+        parse_wireguard_peers(self.config)
+        after = wireguard_parse_cache_info()
+        assert after['hits'] == before['hits'] + 2
+        assert after['misses'] == before['misses']
+
+    def test_bytes_share_cache_entry_with_text(self):
+        """The same config as bytes or as a slurp result is a cache hit."""
+        parse_wireguard_config(self.config)
+        before = wireguard_parse_cache_info()
+        parse_wireguard_config(self.config.encode('utf-8'))
+        parse_wireguard_peers({'content': base64.b64encode(self.config.encode('utf-8')).decode('ascii'),
+                               'encoding': 'base64'})
+        after = wireguard_parse_cache_info()
+        assert after['hits'] == before['hits'] + 2
+        assert after['misses'] == before['misses']
+
+    def test_results_are_defensive_copies(self):
+        """Mutating a returned result must not leak into later cache hits."""
+        first = parse_wireguard_config(self.config)
+        first['interface']['privatekey'] = 'tampered'
+        first['peers']['cache-worker']['allowed_ips'] = 'tampered'
+        first['peers']['intruder'] = {}
+
+        second = parse_wireguard_config(self.config)
+        assert second['interface']['privatekey'] == 'cache_server_key'
+        assert second['peers'] == {
+            'cache-worker': {
+                'public_key': 'lDUMMYcacheKEY77777777abcdefGHIJKLMNOPQRST=',
+                'allowed_ips': '10.130.5.9/32',
+            }
+        }
+
+    def test_cache_size_is_bounded(self):
+        """Distinct texts evict the least recently used entry past maxsize."""
+        maxsize = wireguard_parse_cache_info()['maxsize']
+        for i in range(maxsize + 5):
+            parse_wireguard_config(f"[Interface]\nAddress = 10.130.5.{i}/24\n")
+        assert wireguard_parse_cache_info()['size'] == maxsize
+
+
+class TestPeerRecord:
+    """The internal peer record parses its fields once, when it is built."""
+
+    # Test cases: (description, peer, expected (networks, endpoint_host, endpoint_port, keepalive))
+    test_cases = [
+        ("all fields", {'public_key': 'k', 'allowed_ips': '10.130.5.3, fd00::/64', 'endpoint': 'h.example:51820',
+                        'persistent_keepalive': '25'},
+         (('10.130.5.3/32', 'fd00::/64'), 'h.example', 51820, 25)),
+        ("bare key", {'public_key': 'k'}, ((), None, None, None)),
+        ("IPv6 endpoint, keepalive off",
+         {'public_key': 'k', 'endpoint': '[fd00::1]:51820', 'persistent_keepalive': 'off'},
+         ((), 'fd00::1', 51820, None)),
+        ("invalid entry skipped", {'public_key': 'k', 'allowed_ips': 'bogus, 10.0.0.0/8'},
+         (('10.0.0.0/8',), None, None, None)),
+    ]
+
+    @pytest.mark.parametrize("description,peer,expected", test_cases)
+    def test_parsed_fields(self, description, peer, expected):
+        record = _PeerRecord.from_dict('peer', peer)
+        networks, host, port, keepalive = expected
+        parsed = (tuple(str(network) for network in record.networks), record.endpoint_host, record.endpoint_port,
+                  record.keepalive)
+        assert parsed == (networks, host, port, keepalive), f"Failed: {description}"
+        assert record.as_dict() == {'allowed_ips': '', **peer}, f"Failed: {description}"
+
+
 class TestParseWireguardPeers:
     """Table-driven tests for parse_wireguard_peers filter."""
 
@@ -260,6 +409,105 @@ PersistentKeepalive = 25
         assert parse_wireguard_peers(None) == {}
 
 
+class TestParseWgDump:
+    """Table-driven tests for parse_wg_dump filter."""
+
+    hub_dump = (
+        "wg0\tHUBPRIVATE=\tHUBPUBLIC=\t51820\toff\n"
+        "wg0\tWORKER1KEY=\t(none)\t192.168.1.10:51820\t10.130.5.3/32\t1700000000\t1024\t2048\t25\n"
+        "wg0\tSTATICKEY=\tPSK=\t(none)\t10.130.5.201/32,fd00::1/128\t0\t0\t0\toff\n"
+    )
+
+    test_cases = [
+        (
+            "empty output",
+            "",
+            None,
+            {},
+        ),
+        (
+            "hub with a connected worker and an idle static peer",
+            hub_dump,
+            None,
+            {
+                'wg0': {
+                    'interface': {'public_key': 'HUBPUBLIC=', 'listenport': '51820'},
+                    'peers': {
+                        'WORKER1KEY=': {
+                            'public_key': 'WORKER1KEY=',
+                            'allowed_ips': '10.130.5.3/32',
+                            'endpoint': '192.168.1.10:51820',
+                            'persistent_keepalive': '25',
+                            'latest_handshake': 1700000000,
+                            'transfer_rx': 1024,
+                            'transfer_tx': 2048,
+                        },
+                        'STATICKEY=': {
+                            'public_key': 'STATICKEY=',
+                            'allowed_ips': '10.130.5.201/32, fd00::1/128',
+                            'latest_handshake': 0,
+                            'transfer_rx': 0,
+                            'transfer_tx': 0,
+                        },
+                    },
+                },
+            },
+        ),
+        (
+            "interface selected, spoke without listen port or peers",
+            "wg0\tPRIV=\tSPOKEPUBLIC=\t0\t0x1234\n",
+            'wg0',
+            {'interface': {'public_key': 'SPOKEPUBLIC=', 'fwmark': '0x1234'}, 'peers': {}},
+        ),
+        (
+            "selected interface is not up",
+            hub_dump,
+            'wg1',
+            {'interface': {}, 'peers': {}},
+        ),
+        (
+            "several interfaces",
+            "wg0\tP0=\tPUB0=\t51820\toff\nwg1\tP1=\tPUB1=\t51821\toff\n",
+            None,
+            {
+                'wg0': {'interface': {'public_key': 'PUB0=', 'listenport': '51820'}, 'peers': {}},
+                'wg1': {'interface': {'public_key': 'PUB1=', 'listenport': '51821'}, 'peers': {}},
+            },
+        ),
+    ]
+
+    @pytest.mark.parametrize("description,dump_text,interface,expected", test_cases)
+    def test_parse_wg_dump(self, description, dump_text, interface, expected):
+        """Test parse_wg_dump with various scenarios."""
+        result = parse_wg_dump(dump_text, interface)
+        assert result == expected, f"Failed: {description}"
+
+    def test_names_from_config(self):
+        """Peers take the names of a parsed config when a key mapping is given."""
+        names = index_wireguard_peers(
+            parse_wireguard_config("[Peer]\n# test-worker-1\nPublicKey = WORKER1KEY=\nAllowedIPs = 10.130.5.3/32\n")
+        )['by_public_key']
+        result = parse_wg_dump(self.hub_dump, 'wg0', names)
+        assert list(result['peers']) == ['test-worker-1', 'STATICKEY=']
+
+    def test_matches_config_structure(self):
+        """Apart from the live counters, peers look like parse_wireguard_config peers."""
+        config = parse_wireguard_config(
+            "[Peer]\nPublicKey = WORKER1KEY=\nAllowedIPs = 10.130.5.3/32\n"
+            "Endpoint = 192.168.1.10:51820\nPersistentKeepalive = 25\n"
+        )
+        live = parse_wg_dump(self.hub_dump, 'wg0')
+        peer = live['peers']['WORKER1KEY=']
+        for counter in ('latest_handshake', 'transfer_rx', 'transfer_tx'):
+            del peer[counter]
+        assert peer == config['peers']['WORKER1KEY=']
+
+    def test_private_keys_dropped(self):
+        """Neither private nor preshared keys survive parsing."""
+        assert 'PRIVATE' not in repr(parse_wg_dump(self.hub_dump))
+        assert 'PSK' not in repr(parse_wg_dump(self.hub_dump))
+
+
 class TestMergeWireguardPeers:
     """Table-driven tests for merge_wireguard_peers filter."""
 
@@ -333,6 +581,191 @@ class TestMergeWireguardPeers:
         result = merge_wireguard_peers(existing, new)
         assert result == expected, f"Failed: {description}"
 
+    layered_cases = [
+        (
+            "three layers, later layer overrides by name",
+            [
+                {'w1': {'public_key': 'k1', 'allowed_ips': '10.130.5.3/32'}},
+                {'w1': {'public_key': 'k1', 'allowed_ips': '10.130.5.3/32', 'endpoint': 'a:1'}},
+                {'s1': {'public_key': 'k9', 'allowed_ips': '10.130.5.201/32'}},
+            ],
+            ['w1', 's1'],
+        ),
+        (
+            "renamed host - same public key, newest name kept",
+            [
+                {'old-name': {'public_key': 'k1', 'allowed_ips': '10.130.5.3/32'}},
+                {'new-name': {'public_key': 'k1', 'allowed_ips': '10.130.5.3/32'}},
+            ],
+            ['new-name'],
+        ),
+        (
+            "reused address - newest peer owns it",
+            [
+                {'gone': {'public_key': 'k1', 'allowed_ips': '10.130.5.3/32'}},
+                {'keep': {'public_key': 'k2', 'allowed_ips': '10.130.5.4/32'}},
+                {'new': {'public_key': 'k3', 'allowed_ips': '10.130.5.3/32'}},
+            ],
+            ['keep', 'new'],
+        ),
+        (
+            "newer supernet displaces older host routes",
+            [
+                {
+                    'a': {'public_key': 'k1', 'allowed_ips': '10.130.6.1/32'},
+                    'b': {'public_key': 'k2', 'allowed_ips': '10.130.6.2/32'},
+                    'c': {'public_key': 'k3', 'allowed_ips': '10.130.5.3/32'},
+                },
+                {'site': {'public_key': 'k4', 'allowed_ips': '10.130.6.0/24'}},
+            ],
+            ['c', 'site'],
+        ),
+        (
+            "newer host route displaces older supernet",
+            [
+                {'site': {'public_key': 'k4', 'allowed_ips': '10.130.6.0/24, fd00::/64'}},
+                {'a': {'public_key': 'k1', 'allowed_ips': 'fd00::1/128'}},
+            ],
+            ['a'],
+        ),
+        (
+            "IPv4 and IPv6 never overlap",
+            [
+                {'v4': {'public_key': 'k1', 'allowed_ips': '0.0.0.0/0'}},
+                {'v6': {'public_key': 'k2', 'allowed_ips': '::/0'}},
+            ],
+            ['v4', 'v6'],
+        ),
+        (
+            "conflict within one layer - later entry wins",
+            [
+                {
+                    'first': {'public_key': 'k1', 'allowed_ips': '10.130.5.3/32'},
+                    'second': {'public_key': 'k1', 'allowed_ips': '10.130.5.4/32'},
+                },
+            ],
+            ['second'],
+        ),
+        (
+            "unparseable AllowedIPs are not treated as overlaps",
+            [
+                {'a': {'public_key': 'k1', 'allowed_ips': 'garbage'}},
+                {'b': {'public_key': 'k2', 'allowed_ips': 'garbage'}},
+            ],
+            ['a', 'b'],
+        ),
+    ]
+
+    @pytest.mark.parametrize("description,layers,expected_names", layered_cases)
+    def test_merge_layers_newest_wins(self, description, layers, expected_names):
+        """Conflicting peers from older layers are dropped in favour of newer ones."""
+        result = merge_wireguard_peers(*layers)
+        assert list(result) == expected_names, f"Failed: {description}"
+        for name in expected_names:
+            newest = next(layer[name] for layer in reversed(layers) if name in layer)
+            assert result[name] == newest, f"Failed: {description}"
+
+    @pytest.mark.parametrize("description,layers,expected_names", layered_cases)
+    def test_merge_layers_error_policy(self, description, layers, expected_names):
+        """The strict policy raises exactly when the newest-wins policy would drop a peer."""
+        names = {name for layer in layers for name in layer}
+        if len(names) == len(expected_names):
+            result = merge_wireguard_peers(*layers, on_conflict='error')
+            assert list(result) == expected_names, f"Failed: {description}"
+        else:
+            with pytest.raises(AnsibleFilterError, match='conflicting peers'):
+                merge_wireguard_peers(*layers, on_conflict='error')
+
+    @pytest.mark.parametrize("description,layers,expected_names", layered_cases)
+    def test_merge_layers_report(self, description, layers, expected_names):
+        """report=True lists every peer the newest-wins policy dropped, with the conflicts behind it."""
+        result = merge_wireguard_peers(*layers, report=True)
+        assert result['merged'] == merge_wireguard_peers(*layers), f"Failed: {description}"
+        names = list(dict.fromkeys(name for layer in layers for name in layer))
+        dropped = [name for name in names if name not in expected_names]
+        assert sorted(result['dropped']) == sorted(dropped), f"Failed: {description}"
+        for name in dropped:
+            newest = next(layer[name] for layer in reversed(layers) if name in layer)
+            assert result['dropped'][name] == newest, f"Failed: {description}"
+            assert any(name in conflict for conflict in result['conflicts']), f"Failed: {description}"
+        assert bool(result['conflicts']) == bool(dropped), f"Failed: {description}"
+
+    def test_merge_report_without_conflicts(self):
+        """Shortcut paths report the same shape."""
+        peers = {'a': {'public_key': 'k1', 'allowed_ips': '10.130.5.3/32'}}
+        assert merge_wireguard_peers(peers, report=True) == {'merged': peers, 'dropped': {}, 'conflicts': []}
+        assert merge_wireguard_peers(peers, peers, on_conflict='ignore', report=True)['dropped'] == {}
+
+    def test_merge_layers_ignore_policy(self):
+        """The ignore policy is a plain name-keyed merge."""
+        result = merge_wireguard_peers(
+            {'old-name': {'public_key': 'k1', 'allowed_ips': '10.130.5.3/32'}},
+            {'new-name': {'public_key': 'k1', 'allowed_ips': '10.130.5.3/32'}},
+            on_conflict='ignore',
+        )
+        assert list(result) == ['old-name', 'new-name']
+
+    def test_merge_unknown_policy(self):
+        """An unknown policy is rejected up front."""
+        with pytest.raises(AnsibleFilterError, match='unknown on_conflict'):
+            merge_wireguard_peers({}, on_conflict='oldest')
+
+    def test_merge_does_not_modify_inputs(self):
+        """Dropping a conflicting peer never mutates the caller's dictionaries."""
+        existing = {'old-name': {'public_key': 'k1', 'allowed_ips': '10.130.5.3/32'}}
+        merge_wireguard_peers(existing, {'new-name': {'public_key': 'k1', 'allowed_ips': '10.130.5.3/32'}})
+        assert list(existing) == ['old-name']
+
+
+class TestBuildWorkerPeers:
+    """Table-driven tests for build_worker_peers filter."""
+
+    hostvars = {
+        'test-control': {'wireguard_ip': '10.130.5.1', 'wireguard_public_key': 'cp_key'},
+        'test-worker-1': {'wireguard_ip': '10.130.5.3', 'wireguard_public_key': 'key1'},
+        'test-worker-2': {'wireguard_ip': '10.130.5.4', 'wireguard_public_key': 'key2'},
+        'test-worker-3': {'wireguard_ip': '10.130.5.5'},
+    }
+
+    test_cases = [
+        (
+            "empty play",
+            [],
+            ['test-worker-1'],
+            {},
+        ),
+        (
+            "only workers with loaded keys, in play order",
+            ['test-control', 'test-worker-2', 'test-worker-3', 'test-worker-1'],
+            ['test-worker-1', 'test-worker-2', 'test-worker-3'],
+            {
+                'test-worker-2': {'public_key': 'key2', 'allowed_ips': '10.130.5.4/32'},
+                'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'},
+            },
+        ),
+        (
+            "partial play (--limit) only yields the limited workers",
+            ['test-control', 'test-worker-1'],
+            ['test-worker-1', 'test-worker-2'],
+            {
+                'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'},
+            },
+        ),
+        (
+            "None workers group",
+            ['test-worker-1'],
+            None,
+            {},
+        ),
+    ]
+
+    @pytest.mark.parametrize("description,play_hosts,workers,expected", test_cases)
+    def test_build_worker_peers(self, description, play_hosts, workers, expected):
+        """Test build_worker_peers with various plays."""
+        result = build_worker_peers(self.hostvars, play_hosts, workers)
+        assert result == expected, f"Failed: {description}"
+        assert list(result) == list(expected), f"Order differs: {description}"
+
 
 class TestFilterPeersByInventory:
     """Table-driven tests for filter_peers_by_inventory filter."""
@@ -391,6 +824,1071 @@ class TestFilterPeersByInventory:
         result = filter_peers_by_inventory(peers, inventory)
         assert result == expected, f"Failed: {description}"
 
+    # Test cases: (description, peers, allow_lists, expected_report)
+    report_cases = [
+        (
+            "inventory hosts plus static peer keys",
+            {
+                'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'},
+                'test-laptop': {'public_key': 'key2', 'allowed_ips': '10.130.5.97/32'},
+                'test-retired': {'public_key': 'key3', 'allowed_ips': '10.130.5.4/32'},
+            },
+            [
+                ['test-worker-1', 'test-worker-2'],
+                {'test-laptop': {'public_key': 'key2', 'allowed_ips': '10.130.5.97/32'}},
+            ],
+            {
+                'kept': {
+                    'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'},
+                    'test-laptop': {'public_key': 'key2', 'allowed_ips': '10.130.5.97/32'},
+                },
+                'pruned': {
+                    'test-retired': {'public_key': 'key3', 'allowed_ips': '10.130.5.4/32'},
+                },
+            },
+        ),
+        (
+            "empty inventory but static peers given - static list still prunes",
+            {
+                'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'},
+                'test-laptop': {'public_key': 'key2', 'allowed_ips': '10.130.5.97/32'},
+            },
+            [[], {'test-laptop': {}}],
+            {
+                'kept': {'test-laptop': {'public_key': 'key2', 'allowed_ips': '10.130.5.97/32'}},
+                'pruned': {'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'}},
+            },
+        ),
+        (
+            "all allow-lists empty - nothing pruned",
+            {
+                'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'},
+            },
+            [[], None, {}],
+            {
+                'kept': {'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'}},
+                'pruned': {},
+            },
+        ),
+        (
+            "None peers input",
+            None,
+            [['test-worker-1']],
+            {'kept': {}, 'pruned': {}},
+        ),
+    ]
+
+    @pytest.mark.parametrize("description,peers,allow_lists,expected", report_cases)
+    def test_filter_peers_by_inventory_report(self, description, peers, allow_lists, expected):
+        """Test multiple allow-lists and the kept/pruned report."""
+        result = filter_peers_by_inventory(peers, *allow_lists, report=True)
+        assert result == expected, f"Failed: {description}"
+        assert filter_peers_by_inventory(peers, *allow_lists) == expected['kept'], f"Failed: {description}"
+
+
+class TestIndexWireguardPeers:
+    """Table-driven tests for index_wireguard_peers filter."""
+
+    test_cases = [
+        (
+            "empty peers",
+            {},
+            {'by_public_key': {}, 'by_network': {}, 'by_endpoint_host': {}},
+        ),
+        (
+            "None input",
+            None,
+            {'by_public_key': {}, 'by_network': {}, 'by_endpoint_host': {}},
+        ),
+        (
+            "peers indexed by key, network and endpoint host",
+            {
+                'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'},
+                'control-plane': {
+                    'public_key': 'key2',
+                    'allowed_ips': '10.130.5.0/24',
+                    'endpoint': 'test-control-plane.example.com:51820',
+                },
+            },
+            {
+                'by_public_key': {'key1': 'test-worker-1', 'key2': 'control-plane'},
+                'by_network': {'10.130.5.3/32': 'test-worker-1', '10.130.5.0/24': 'control-plane'},
+                'by_endpoint_host': {'test-control-plane.example.com': ['control-plane']},
+            },
+        ),
+        (
+            "multiple AllowedIPs are normalized and each indexed",
+            {
+                'test-peer': {'public_key': 'key1', 'allowed_ips': '10.130.5.5, 10.130.6.7/24,bogus'},
+            },
+            {
+                'by_public_key': {'key1': 'test-peer'},
+                'by_network': {
+                    '10.130.5.5/32': 'test-peer',
+                    '10.130.6.0/24': 'test-peer',
+                    'bogus': 'test-peer',
+                },
+                'by_endpoint_host': {},
+            },
+        ),
+        (
+            "peers sharing an endpoint host (NAT) and an IPv6 endpoint",
+            {
+                'test-a': {'public_key': 'key1', 'allowed_ips': '', 'endpoint': '192.0.2.1:51820'},
+                'test-b': {'public_key': 'key2', 'allowed_ips': '', 'endpoint': '192.0.2.1:51821'},
+                'test-c': {'public_key': 'key3', 'allowed_ips': '', 'endpoint': '[2001:db8::1]:51820'},
+            },
+            {
+                'by_public_key': {'key1': 'test-a', 'key2': 'test-b', 'key3': 'test-c'},
+                'by_network': {},
+                'by_endpoint_host': {'192.0.2.1': ['test-a', 'test-b'], '2001:db8::1': ['test-c']},
+            },
+        ),
+        (
+            "parse_wireguard_config result is indexed by its peers",
+            {
+                'interface': {'privatekey': 'server_key'},
+                'peers': {'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'}},
+            },
+            {
+                'by_public_key': {'key1': 'test-worker-1'},
+                'by_network': {'10.130.5.3/32': 'test-worker-1'},
+                'by_endpoint_host': {},
+            },
+        ),
+        (
+            "list of public keys (wg show peers output)",
+            ['eDUMMYworker1KEY11111111abcdefGHIJKLMNOPQRST='],
+            {
+                'by_public_key': {'eDUMMYworker1KEY11111111abcdefGHIJKLMNOPQRST=': 'eDUMMYworker'},
+                'by_network': {},
+                'by_endpoint_host': {},
+            },
+        ),
+    ]
+
+    @pytest.mark.parametrize("description,peers,expected", test_cases)
+    def test_index_wireguard_peers(self, description, peers, expected):
+        """Test index_wireguard_peers with various peer inputs."""
+        result = index_wireguard_peers(peers)
+        assert result == expected, f"Failed: {description}"
+
+
+class TestCollapseAllowedIps:
+    """Table-driven tests for collapse_allowed_ips filter."""
+
+    test_cases = [
+        ("empty value", '', ''),
+        ("None", None, ''),
+        ("single host unchanged", '10.130.5.3/32', '10.130.5.3/32'),
+        ("bare address gains its prefix", '10.130.5.3', '10.130.5.3/32'),
+        ("four adjacent hosts become a /30", '10.130.5.68/32,10.130.5.69/32,10.130.5.70/32,10.130.5.71/32',
+         '10.130.5.68/30'),
+        ("unaligned run splits into aligned blocks", '10.130.5.67/32, 10.130.5.68/30, 10.130.5.72/32',
+         '10.130.5.67/32, 10.130.5.68/30, 10.130.5.72/32'),
+        ("nested and duplicate entries dropped", '10.130.5.64/27, 10.130.5.70/32, 10.130.5.64/27',
+         '10.130.5.64/27'),
+        ("gap keeps prefixes apart", '10.130.5.3/32, 10.130.5.5/32', '10.130.5.3/32, 10.130.5.5/32'),
+        ("sorted by address, host bits cleared", '10.130.5.9/24, 10.130.4.0/24', '10.130.4.0/23'),
+        ("IPv4 before IPv6, invalid entries last", 'fd00::1/128, bogus, fd00::/128, 10.130.5.3/32',
+         '10.130.5.3/32, fd00::/127, bogus'),
+        ("default route swallows everything", ['10.0.0.0/8', '0.0.0.0/0', '192.168.1.1'], '0.0.0.0/0'),
+    ]
+
+    @pytest.mark.parametrize("description,allowed_ips,expected", test_cases)
+    def test_collapse_allowed_ips(self, description, allowed_ips, expected):
+        """Test collapse_allowed_ips with various AllowedIPs values."""
+        assert collapse_allowed_ips(allowed_ips) == expected, f"Failed: {description}"
+
+    def test_large_contiguous_block(self):
+        """A /18 handed out as 16384 /32s collapses back to one prefix."""
+        hosts = [f"10.130.{index >> 8}.{index & 255}/32" for index in range(1 << 14)]
+        assert collapse_allowed_ips(', '.join(reversed(hosts))) == '10.130.0.0/18'
+
+
+class TestAggregateWireguardPeers:
+    """Table-driven tests for aggregate_wireguard_peers filter."""
+
+    test_cases = [
+        ("empty peers", {}, {}),
+        ("None input", None, {}),
+        (
+            "minimal peers pass through",
+            {
+                'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'},
+                'test-worker-2': {'public_key': 'key2', 'allowed_ips': '10.130.5.4/32'},
+            },
+            {
+                'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'},
+                'test-worker-2': {'public_key': 'key2', 'allowed_ips': '10.130.5.4/32'},
+            },
+        ),
+        (
+            "adjacent prefixes of one peer are collapsed, other keys kept",
+            {
+                'test-router': {
+                    'public_key': 'key1',
+                    'allowed_ips': '10.130.5.100/32, 10.130.5.101/32, 10.130.5.102/31',
+                    'endpoint': '192.0.2.1:51820',
+                },
+            },
+            {
+                'test-router': {
+                    'public_key': 'key1', 'allowed_ips': '10.130.5.100/30', 'endpoint': '192.0.2.1:51820',
+                },
+            },
+        ),
+        (
+            "adjacent prefixes of different peers stay apart",
+            {
+                'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.4/32'},
+                'test-worker-2': {'public_key': 'key2', 'allowed_ips': '10.130.5.5/32'},
+            },
+            {
+                'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.4/32'},
+                'test-worker-2': {'public_key': 'key2', 'allowed_ips': '10.130.5.5/32'},
+            },
+        ),
+        (
+            "parse_wireguard_config result is aggregated by its peers",
+            {
+                'interface': {'privatekey': 'server_key'},
+                'peers': {'test-peer': {'public_key': 'key1', 'allowed_ips': '10.130.5.8, 10.130.5.9'}},
+            },
+            {'test-peer': {'public_key': 'key1', 'allowed_ips': '10.130.5.8/31'}},
+        ),
+    ]
+
+    @pytest.mark.parametrize("description,peers,expected", test_cases)
+    def test_aggregate_wireguard_peers(self, description, peers, expected):
+        """Test aggregate_wireguard_peers with various peer maps."""
+        assert aggregate_wireguard_peers(peers) == expected, f"Failed: {description}"
+
+    def test_does_not_modify_input(self):
+        peers = {'test-peer': {'public_key': 'key1', 'allowed_ips': '10.130.5.8/32, 10.130.5.9/32'}}
+        result = aggregate_wireguard_peers(peers)
+        assert peers['test-peer']['allowed_ips'] == '10.130.5.8/32, 10.130.5.9/32'
+        assert result['test-peer'] is not peers['test-peer']
+
+    overlap_cases = [
+        (
+            "same address on two peers",
+            {
+                'test-worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'},
+                'test-worker-2': {'public_key': 'key2', 'allowed_ips': '10.130.5.3/32'},
+            },
+            ["test-worker-1 and test-worker-2 have overlapping AllowedIPs (10.130.5.3/32)"],
+        ),
+        (
+            "host inside another peer's block, found after collapsing",
+            {
+                'test-router': {'public_key': 'key1', 'allowed_ips': '10.130.5.96/31, 10.130.5.98/31'},
+                'test-phone': {'public_key': 'key2', 'allowed_ips': '10.130.5.97/32'},
+            },
+            ["test-router and test-phone have overlapping AllowedIPs (10.130.5.97/32)"],
+        ),
+        (
+            "one wide peer overlapping several",
+            {
+                'test-site': {'public_key': 'key1', 'allowed_ips': '10.130.5.0/24'},
+                'test-worker-1': {'public_key': 'key2', 'allowed_ips': '10.130.5.3/32'},
+                'test-worker-2': {'public_key': 'key3', 'allowed_ips': '10.130.5.200/32, 10.130.6.1/32'},
+            },
+            [
+                "test-site and test-worker-1 have overlapping AllowedIPs (10.130.5.3/32)",
+                "test-site and test-worker-2 have overlapping AllowedIPs (10.130.5.200/32)",
+            ],
+        ),
+    ]
+
+    @pytest.mark.parametrize("description,peers,conflicts", overlap_cases)
+    def test_overlaps_are_reported(self, description, peers, conflicts):
+        """Every overlapping peer is named; validate=False collapses regardless."""
+        with pytest.raises(AnsibleFilterError) as excinfo:
+            aggregate_wireguard_peers(peers)
+        for conflict in conflicts:
+            assert conflict in str(excinfo.value), f"Failed: {description}"
+        assert aggregate_wireguard_peers(peers, validate=False).keys() == peers.keys(), f"Failed: {description}"
+
+    def test_ipv6_does_not_overlap_ipv4(self):
+        peers = {
+            'test-a': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'},
+            'test-b': {'public_key': 'key2', 'allowed_ips': '::/0'},
+        }
+        assert aggregate_wireguard_peers(peers) == peers
+
+    def test_ten_thousand_peers(self):
+        """10k hosts, each device owning an aligned /30 handed out as four /32s."""
+        peers = {
+            f'device-{index}': {
+                'public_key': f'key{index}',
+                'allowed_ips': ','.join(f"10.130.{address >> 8}.{address & 255}/32"
+                                        for address in range(index * 4, index * 4 + 4)),
+            }
+            for index in range(10_000)
+        }
+        result = aggregate_wireguard_peers(peers)
+        assert result['device-0']['allowed_ips'] == '10.130.0.0/30'
+        assert result['device-9999']['allowed_ips'] == '10.130.156.60/30'
+        assert all(peer['allowed_ips'].endswith('/30') for peer in result.values())
+
+
+class TestWireguardDirectPeerIndex:
+    """Table-driven tests for wireguard_direct_peer_index filter."""
+
+    test_cases = [
+        (
+            "no hosts",
+            {},
+            [],
+            {},
+        ),
+        (
+            "hub-only hosts (empty or undefined group) are not indexed",
+            {
+                'test-control': {'wireguard_ip': '10.130.5.1', 'wireguard_direct_peer_group': ''},
+                'test-worker-1': {'wireguard_ip': '10.130.5.3'},
+            },
+            ['test-control', 'test-worker-1'],
+            {},
+        ),
+        (
+            "members grouped, sorted, with endpoint fallbacks",
+            {
+                'test-worker-2': {
+                    'wireguard_ip': '10.130.5.4',
+                    'wireguard_direct_peer_group': 'home',
+                    'wireguard_public_key': 'key2',
+                    'ansible_default_ipv4': {'address': '192.168.1.4'},
+                    'wireguard_port': 51821,
+                },
+                'test-worker-1': {
+                    'wireguard_ip': '10.130.5.3',
+                    'wireguard_direct_peer_group': 'home',
+                    'wireguard_public_key': 'key1',
+                    'wireguard_lan_endpoint': '192.168.1.3',
+                    'ansible_default_ipv4': {'address': '192.168.9.9'},
+                },
+                'test-worker-3': {
+                    'wireguard_ip': '10.130.5.5',
+                    'wireguard_direct_peer_group': 'office',
+                },
+                'test-worker-4': {
+                    'wireguard_direct_peer_group': 'home',
+                },
+            },
+            ['test-worker-2', 'test-worker-1', 'test-worker-3', 'test-worker-4'],
+            {
+                'home': [
+                    {
+                        'name': 'test-worker-1',
+                        'ip': '10.130.5.3',
+                        'public_key': 'key1',
+                        'lan_endpoint': '192.168.1.3',
+                        'port': None,
+                    },
+                    {
+                        'name': 'test-worker-2',
+                        'ip': '10.130.5.4',
+                        'public_key': 'key2',
+                        'lan_endpoint': '192.168.1.4',
+                        'port': 51821,
+                    },
+                ],
+                'office': [
+                    {
+                        'name': 'test-worker-3',
+                        'ip': '10.130.5.5',
+                        'public_key': None,
+                        'lan_endpoint': '',
+                        'port': None,
+                    },
+                ],
+            },
+        ),
+    ]
+
+    @pytest.mark.parametrize("description,hostvars,hosts,expected", test_cases)
+    def test_wireguard_direct_peer_index(self, description, hostvars, hosts, expected):
+        """Test wireguard_direct_peer_index with various inventories."""
+        result = wireguard_direct_peer_index(hostvars, hosts)
+        assert result == expected, f"Failed: {description}"
+
+
+
+def _ping(rtt_ms, received=3, transmitted=3):
+    """A wireguard_state ping result."""
+    return {'rc': 0 if received else 1, 'transmitted': transmitted, 'received': received,
+            'rtt_avg_ms': rtt_ms if received else None}
+
+
+def _probe_hostvars(**pings):
+    """Hostvars of a hub and three same-site workers, each with the pings registered as wg_probe."""
+    hostvars = {
+        'k8s': {'wireguard_ip': '10.130.5.1', 'wireguard_direct_peer_group': ''},
+        'cm4': {'wireguard_ip': '10.130.5.65', 'wireguard_direct_peer_group': 'home'},
+        'rpi': {'wireguard_ip': '10.130.5.66', 'wireguard_direct_peer_group': 'home'},
+        'oci': {'wireguard_ip': '10.130.5.130', 'wireguard_direct_peer_group': 'cloud'},
+    }
+    for host, host_pings in pings.items():
+        hostvars[host]['wg_probe'] = {'ping': host_pings}
+    return hostvars
+
+
+class TestWireguardLatencyMatrix:
+    """Table-driven tests for wireguard_latency_matrix filter."""
+
+    # Test cases: (description, hostvars, expected matrix, expected relayed, expected unreachable)
+    test_cases = [
+        (
+            "direct LAN path",
+            _probe_hostvars(cm4={'10.130.5.1': _ping(15.8), '10.130.5.66': _ping(0.4)}),
+            {'cm4': {'k8s': {'rtt_ms': 15.8, 'loss_pct': 0.0, 'relayed': False},
+                     'rpi': {'rtt_ms': 0.4, 'loss_pct': 0.0, 'relayed': False}}},
+            [],
+            [],
+        ),
+        (
+            "same-site pair relaying through the hub",
+            _probe_hostvars(cm4={'10.130.5.66': _ping(16.3)}, rpi={'10.130.5.65': _ping(0.5)}),
+            {'cm4': {'rpi': {'rtt_ms': 16.3, 'loss_pct': 0.0, 'relayed': True}},
+             'rpi': {'cm4': {'rtt_ms': 0.5, 'loss_pct': 0.0, 'relayed': False}}},
+            [{'from': 'cm4', 'to': 'rpi', 'rtt_ms': 16.3}],
+            [],
+        ),
+        (
+            "slow hub and other-site pairs are never relayed",
+            _probe_hostvars(cm4={'10.130.5.1': _ping(40.0), '10.130.5.130': _ping(30.0)}),
+            {'cm4': {'k8s': {'rtt_ms': 40.0, 'loss_pct': 0.0, 'relayed': False},
+                     'oci': {'rtt_ms': 30.0, 'loss_pct': 0.0, 'relayed': False}}},
+            [],
+            [],
+        ),
+        (
+            "no reply and partial loss",
+            _probe_hostvars(cm4={'10.130.5.66': _ping(None, received=0)},
+                            rpi={'10.130.5.65': _ping(0.6, received=4, transmitted=5)}),
+            {'cm4': {'rpi': {'rtt_ms': None, 'loss_pct': 100.0, 'relayed': False}},
+             'rpi': {'cm4': {'rtt_ms': 0.6, 'loss_pct': 20.0, 'relayed': False}}},
+            [],
+            [{'from': 'cm4', 'to': 'rpi'}],
+        ),
+        (
+            "probe skipped or missing",
+            dict(_probe_hostvars(), rpi={'wireguard_ip': '10.130.5.66', 'wg_probe': {'skipped': True}}),
+            {},
+            [],
+            [],
+        ),
+    ]
+
+    @pytest.mark.parametrize("description,hostvars,matrix,relayed,unreachable", test_cases)
+    def test_wireguard_latency_matrix(self, description, hostvars, matrix, relayed, unreachable):
+        result = wireguard_latency_matrix(hostvars, ['cm4', 'rpi', 'oci', 'k8s'], 'k8s', 'wg_probe')
+        assert result['hosts'] == ['k8s', 'cm4', 'oci', 'rpi'], f"Failed: {description}"
+        assert result['matrix'] == matrix, f"Failed: {description}"
+        assert result['relayed'] == relayed, f"Failed: {description}"
+        assert result['unreachable'] == unreachable, f"Failed: {description}"
+
+    def test_table(self):
+        hostvars = _probe_hostvars(cm4={'10.130.5.1': _ping(15.8), '10.130.5.66': _ping(16.3)},
+                                   rpi={'10.130.5.1': _ping(None, received=0), '10.130.5.65': _ping(0.4)})
+        table = wireguard_latency_matrix(hostvars, ['cm4', 'rpi', 'k8s'], 'k8s', 'wg_probe')['table']
+        assert table.split('\n') == [
+            '      k8s  cm4    rpi',
+            'k8s     -    -      -',
+            'cm4  15.8    -  16.3*',
+            'rpi     x  0.4      -',
+            'RTT in ms from row to column; * relayed through the hub, x no reply, - not probed',
+        ]
+
+    def test_threshold_and_unknown_targets(self):
+        """relay_ms moves the cut-off; a target outside the play gets its own column, named by address."""
+        hostvars = _probe_hostvars(cm4={'10.130.5.66': _ping(3.0), '10.130.5.200': _ping(1.0)})
+        result = wireguard_latency_matrix(hostvars, ['cm4', 'rpi'], 'k8s', 'wg_probe', relay_ms=2.0)
+        assert result['hosts'] == ['k8s', 'cm4', 'rpi', '10.130.5.200']
+        assert result['relayed'] == [{'from': 'cm4', 'to': 'rpi', 'rtt_ms': 3.0}]
+        assert result['matrix']['cm4']['10.130.5.200']['relayed'] is False
+
+    def test_unknown_targets_are_not_rows(self):
+        """An unknown target is never read as a source, even if hostvars has an entry under its address."""
+        hostvars = dict(_probe_hostvars(cm4={'10.130.5.200': _ping(1.0)}),
+                        **{'10.130.5.200': {'wg_probe': {'ping': {'10.130.5.1': _ping(9.0)}}}})
+        result = wireguard_latency_matrix(hostvars, ['cm4'], 'k8s', 'wg_probe')
+        assert result['hosts'] == ['k8s', 'cm4', '10.130.5.200']
+        assert list(result['matrix']) == ['cm4']
+
 
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
+
+
+def _live_peers(config_text):
+    """Kernel view of a config's peers: public key -> (AllowedIPs, endpoint, keepalive)."""
+    return {
+        peer['public_key']: (
+            frozenset(ip.strip() for ip in peer['allowed_ips'].split(',') if ip.strip()),
+            peer.get('endpoint'),
+            peer.get('persistent_keepalive'),
+        )
+        for peer in parse_wireguard_config(config_text)['peers'].values()
+    }
+
+
+def _apply_wg_set(live, command):
+    """Apply a `wg set` argument list to a kernel view the way wg(8) does."""
+    live = dict(live)
+    args = iter(command[3:])
+    key = None
+    for arg in args:
+        if arg == 'peer':
+            key = next(args)
+            live.setdefault(key, (frozenset(), None, None))
+        elif arg == 'remove':
+            del live[key]
+        elif arg == 'endpoint':
+            allowed, _, keepalive = live[key]
+            live[key] = (allowed, next(args), keepalive)
+        elif arg == 'persistent-keepalive':
+            allowed, endpoint, _ = live[key]
+            value = next(args)
+            live[key] = (allowed, endpoint, None if value == 'off' else value)
+        elif arg == 'allowed-ips':
+            _, endpoint, keepalive = live[key]
+            live[key] = (frozenset(filter(None, next(args).split(','))), endpoint, keepalive)
+        else:
+            raise AssertionError(f"unexpected wg set argument {arg!r}")
+    return live
+
+
+class TestWireguardPeerDelta:
+    """Fixture-driven tests for wireguard_peer_delta.
+
+    Each directory under tests/fixtures/peer_delta holds a deployed config
+    (current.conf), the config to deploy (desired.conf) and the expected delta
+    (expected.json).
+    """
+
+    @pytest.mark.parametrize("case", PEER_DELTA_FIXTURES, ids=lambda case: case.name)
+    def test_delta_matches_fixture(self, case):
+        """The computed delta matches the recorded expectation."""
+        current = (case / 'current.conf').read_text()
+        desired = (case / 'desired.conf').read_text()
+        expected = json.loads((case / 'expected.json').read_text())
+        assert wireguard_peer_delta(current, desired) == expected
+
+    @pytest.mark.parametrize("case", PEER_DELTA_FIXTURES, ids=lambda case: case.name)
+    def test_command_reaches_desired_peers(self, case):
+        """Applying the command to the current peers yields exactly the desired peers."""
+        current = (case / 'current.conf').read_text()
+        desired = (case / 'desired.conf').read_text()
+        delta = wireguard_peer_delta(current, desired)
+        live = _live_peers(current)
+        if delta['command']:
+            live = _apply_wg_set(live, delta['command'])
+        assert live == _live_peers(desired)
+
+    def test_no_change_is_empty(self):
+        """Identical configs need neither a restart nor a command."""
+        config = (PEER_DELTA_FIXTURES[0] / 'desired.conf').read_text()
+        delta = wireguard_peer_delta(config, config)
+        assert delta == {'restart': False, 'reasons': [], 'added': [], 'removed': [], 'updated': [], 'command': []}
+
+    def test_accepts_parsed_configs(self):
+        """Parsed configs give the same delta as config text."""
+        case = PEER_DELTA_FIXTURES[0]
+        current = (case / 'current.conf').read_text()
+        desired = (case / 'desired.conf').read_text()
+        assert wireguard_peer_delta(
+            parse_wireguard_config(current), parse_wireguard_config(desired), 'wg1'
+        ) == wireguard_peer_delta(current, desired, 'wg1')
+
+
+class TestDiffWireguardConfigs:
+    """Table-driven tests for diff_wireguard_configs filter."""
+
+    base = """[Interface]
+Address = 10.130.5.1/24
+ListenPort = 51820
+PrivateKey = SECRETPRIVATEKEY=
+
+[Peer]
+# worker-1
+PublicKey = key1
+AllowedIPs = 10.130.5.3/32
+
+[Peer]
+# worker-2
+PublicKey = key2
+AllowedIPs = 10.130.5.4/32
+"""
+
+    test_cases = [
+        (
+            "identical configs",
+            base,
+            base,
+            {'interface': {}, 'peers': {'added': [], 'removed': [], 'changed': {}}, 'counts': {'current': 2, 'desired': 2}},
+        ),
+        (
+            "peer added and removed",
+            base,
+            base.replace('# worker-2\nPublicKey = key2', '# worker-3\nPublicKey = key3'),
+            {
+                'interface': {},
+                'peers': {'added': ['worker-3'], 'removed': ['worker-2'], 'changed': {}},
+                'counts': {'current': 2, 'desired': 2},
+            },
+        ),
+        (
+            "peer renamed and re-addressed",
+            base,
+            base.replace('# worker-2\nPublicKey = key2\nAllowedIPs = 10.130.5.4/32', '# gpu-1\nPublicKey = key2\nAllowedIPs = 10.130.5.9/32'),
+            {
+                'interface': {},
+                'peers': {
+                    'added': [],
+                    'removed': [],
+                    'changed': {
+                        'gpu-1': {
+                            'name': {'current': 'worker-2', 'desired': 'gpu-1'},
+                            'allowed_ips': {'current': '10.130.5.4/32', 'desired': '10.130.5.9/32'},
+                        },
+                    },
+                },
+                'counts': {'current': 2, 'desired': 2},
+            },
+        ),
+        (
+            "interface change with private key hidden",
+            base,
+            base.replace('51820', '51821').replace('SECRETPRIVATEKEY=', 'OTHERPRIVATEKEY='),
+            {
+                'interface': {
+                    'listenport': {'current': '51820', 'desired': '51821'},
+                    'privatekey': {'current': '(hidden)', 'desired': '(hidden)'},
+                },
+                'peers': {'added': [], 'removed': [], 'changed': {}},
+                'counts': {'current': 2, 'desired': 2},
+            },
+        ),
+        (
+            "new deployment",
+            '',
+            base,
+            {
+                'interface': {
+                    'address': {'current': None, 'desired': '10.130.5.1/24'},
+                    'listenport': {'current': None, 'desired': '51820'},
+                    'privatekey': {'current': None, 'desired': '(hidden)'},
+                },
+                'peers': {'added': ['worker-1', 'worker-2'], 'removed': [], 'changed': {}},
+                'counts': {'current': 0, 'desired': 2},
+            },
+        ),
+    ]
+
+    @pytest.mark.parametrize("description,current,desired,expected", test_cases)
+    def test_diff_wireguard_configs(self, description, current, desired, expected):
+        """Test the semantic part of diff_wireguard_configs."""
+        result = diff_wireguard_configs(current, desired)
+        unified = result.pop('unified')
+        assert result.pop('changed') == (current != desired), f"Failed: {description}"
+        assert result == expected, f"Failed: {description}"
+        assert bool(unified) == (current != desired), f"Failed: {description}"
+        assert not any('SECRETPRIVATEKEY' in line or 'OTHERPRIVATEKEY' in line for line in unified)
+
+    def test_unified_diff_matches_diff_u(self):
+        """The text diff has diff -u's labels, hunk headers and line markers."""
+        desired = self.base.replace('10.130.5.4/32', '10.130.5.9/32')
+        unified = diff_wireguard_configs(self.base, desired)['unified']
+        assert unified[:3] == ['--- Current Config', '+++ Preview Config', '@@ -11,4 +11,4 @@']
+        assert '-AllowedIPs = 10.130.5.4/32' in unified
+        assert '+AllowedIPs = 10.130.5.9/32' in unified
+
+    def test_parsed_configs_have_no_text_diff(self):
+        """Parsed configs are compared semantically only."""
+        result = diff_wireguard_configs(parse_wireguard_config(''), parse_wireguard_config(self.base))
+        assert result['unified'] == []
+        assert result['peers']['added'] == ['worker-1', 'worker-2']
+
+
+HAND_EDITED_HUB = """# Managed by Ansible; manual additions below are kept
+[Interface]
+Address = 10.130.5.1/24
+ListenPort = 51820
+PrivateKey = HUBPRIVATE=
+# PublicKey = HUBPUBLIC=
+MTU = 1380
+PostUp = iptables -A FORWARD -i %i -j ACCEPT
+
+# Worker nodes
+[Peer]
+# worker-1
+PublicKey = key1
+AllowedIPs = 10.130.5.3/32
+
+[Peer]
+# laptop
+PublicKey = key2
+PresharedKey = PSK=
+AllowedIPs = 10.130.5.201/32
+AllowedIPs = fd00::201/128
+PersistentKeepalive = 25
+
+[Peer]
+# worker-2
+PublicKey = key3
+AllowedIPs   =   10.130.5.4/32
+
+"""
+
+
+class TestWireguardAst:
+    """Tests for parse_wireguard_ast, serialize_wireguard_ast and patch_wireguard_peers."""
+
+    roundtrip_cases = [
+        ("empty", ""),
+        ("rendered hub", HAND_EDITED_HUB),
+        ("CRLF line endings", HAND_EDITED_HUB.replace('\n', '\r\n')),
+        ("no trailing newline", HAND_EDITED_HUB.rstrip('\n')),
+        ("unknown section and invalid line", "[Interface]\nAddress = 10.0.0.1/24\n[Custom]\nnot a key\n\t\n"),
+        ("preamble only", "# nothing configured yet\n\n"),
+    ]
+
+    @pytest.mark.parametrize("description,config_text", roundtrip_cases)
+    def test_roundtrip_is_byte_identical(self, description, config_text):
+        """Serializing a parsed tree reproduces the input exactly."""
+        assert serialize_wireguard_ast(parse_wireguard_ast(config_text)) == config_text, f"Failed: {description}"
+
+    def test_sections_and_spans(self):
+        """Sections carry their type, line range, peer key and name."""
+        sections = parse_wireguard_ast(HAND_EDITED_HUB)['sections']
+        assert [(s['type'], s['start'], s['end']) for s in sections] == [
+            ('preamble', 1, 1),
+            ('interface', 2, 10),
+            ('peer', 11, 15),
+            ('peer', 16, 23),
+            ('peer', 24, 28),
+        ]
+        assert [(s['name'], s['public_key']) for s in sections[2:]] == [
+            ('worker-1', 'key1'), ('laptop', 'key2'), ('worker-2', 'key3'),
+        ]
+
+    def test_nothing_is_dropped(self):
+        """Repeated keys and keys unknown to parse_wireguard_config stay as entries."""
+        entries = [
+            (line['key'], line['value'])
+            for section in parse_wireguard_ast(HAND_EDITED_HUB)['sections']
+            for line in section['lines'] if line['kind'] == 'entry'
+        ]
+        assert ('MTU', '1380') in entries
+        assert ('PostUp', 'iptables -A FORWARD -i %i -j ACCEPT') in entries
+        assert ('PresharedKey', 'PSK=') in entries
+        assert ('AllowedIPs', '10.130.5.201/32') in entries
+        assert ('AllowedIPs', 'fd00::201/128') in entries
+
+    def test_repeated_allowed_ips_accumulate(self):
+        """parse_wireguard_config joins repeated AllowedIPs lines as wg(8) does."""
+        peers = parse_wireguard_config(HAND_EDITED_HUB)['peers']
+        assert peers['laptop']['allowed_ips'] == '10.130.5.201/32, fd00::201/128'
+
+    def test_patch_without_changes_is_identity(self):
+        """Upserting peers exactly as configured leaves the text untouched."""
+        peers = parse_wireguard_config(HAND_EDITED_HUB)['peers']
+        assert patch_wireguard_peers(HAND_EDITED_HUB, peers) == HAND_EDITED_HUB
+
+    def test_patch_updates_only_the_affected_block(self):
+        """An update rewrites only the changed line and keeps its spacing."""
+        patched = patch_wireguard_peers(
+            HAND_EDITED_HUB, {'worker-2': {'public_key': 'key3', 'allowed_ips': '10.130.5.40/32'}}
+        )
+        assert patched == HAND_EDITED_HUB.replace('AllowedIPs   =   10.130.5.4/32', 'AllowedIPs   =   10.130.5.40/32')
+
+    def test_patch_collapses_and_removes_fields(self):
+        """Repeated lines collapse into the first one; dropped fields lose their lines."""
+        patched = patch_wireguard_peers(
+            HAND_EDITED_HUB, {'laptop': {'public_key': 'key2', 'allowed_ips': '10.130.5.202/32'}}
+        )
+        assert patched == HAND_EDITED_HUB.replace(
+            'AllowedIPs = 10.130.5.201/32\nAllowedIPs = fd00::201/128\nPersistentKeepalive = 25\n',
+            'AllowedIPs = 10.130.5.202/32\n',
+        )
+        assert 'PresharedKey = PSK=' in patched
+
+    def test_patch_adds_missing_field_after_last_entry(self):
+        """A field the block lacks is added after its last key."""
+        patched = patch_wireguard_peers(
+            HAND_EDITED_HUB,
+            {'worker-1': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32', 'persistent_keepalive': '25'}},
+        )
+        assert patched == HAND_EDITED_HUB.replace(
+            'AllowedIPs = 10.130.5.3/32\n', 'AllowedIPs = 10.130.5.3/32\nPersistentKeepalive = 25\n'
+        )
+
+    def test_patch_replaces_block_of_rotated_key(self):
+        """A peer whose key changed replaces the block of the same name instead of adding a second one."""
+        patched = patch_wireguard_peers(
+            HAND_EDITED_HUB, {'laptop': {'public_key': 'key2-rotated', 'allowed_ips': '10.130.5.201/32, fd00::201/128',
+                                         'persistent_keepalive': '25'}}
+        )
+        assert patched == HAND_EDITED_HUB.replace('PublicKey = key2\n', 'PublicKey = key2-rotated\n')
+        assert list(parse_wireguard_config(patched)['peers']) == ['worker-1', 'laptop', 'worker-2']
+
+    def test_patch_name_fallback_skips_blocks_claimed_by_key(self):
+        """A name only falls back to a block whose key no upserted peer has."""
+        patched = patch_wireguard_peers(HAND_EDITED_HUB, {
+            'worker-1': {'public_key': 'key3', 'allowed_ips': '10.130.5.4/32'},
+            'worker-2': {'public_key': 'key1', 'allowed_ips': '10.130.5.3/32'},
+        })
+        assert patched == HAND_EDITED_HUB
+
+    def test_patch_rejects_peer_without_key(self):
+        with pytest.raises(AnsibleFilterError, match="peer 'worker-9' has no public_key"):
+            patch_wireguard_peers(HAND_EDITED_HUB, {'worker-9': {'allowed_ips': '10.130.5.9/32'}})
+
+    @pytest.mark.parametrize("remove", [['key1'], ['worker-1']])
+    def test_patch_removes_block(self, remove):
+        """Removed peers lose their whole block, matched by key or name."""
+        patched = patch_wireguard_peers(HAND_EDITED_HUB, remove=remove)
+        assert patched == HAND_EDITED_HUB.replace(
+            '[Peer]\n# worker-1\nPublicKey = key1\nAllowedIPs = 10.130.5.3/32\n\n', ''
+        )
+
+    @pytest.mark.parametrize("description,config_text", roundtrip_cases)
+    def test_patch_appends_new_peers(self, description, config_text):
+        """New peers are appended in rendered layout without touching existing lines."""
+        new_peer = {'public_key': 'key9', 'allowed_ips': '10.130.5.9/32'}
+        patched = patch_wireguard_peers(config_text, {'worker-9': new_peer})
+        newline = '\r\n' if '\r\n' in config_text else '\n'
+        assert patched.startswith(config_text), f"Failed: {description}"
+        assert patched.endswith(
+            newline.join(['[Peer]', '# worker-9', 'PublicKey = key9', 'AllowedIPs = 10.130.5.9/32', '', ''])
+        ), f"Failed: {description}"
+        assert parse_wireguard_config(patched)['peers']['worker-9'] == new_peer, f"Failed: {description}"
+
+
+class TestIterWireguardPeers:
+    """Tests for the streaming iter_wireguard_peers API."""
+
+    source_cases = [
+        ("str", lambda text: text),
+        ("bytes", lambda text: text.encode('utf-8')),
+        ("text file", io.StringIO),
+        ("binary file", lambda text: io.BytesIO(text.encode('utf-8'))),
+    ]
+
+    @pytest.mark.parametrize("description,make_source", source_cases)
+    def test_sources_match_parse(self, description, make_source):
+        """Every source type yields the peers parse_wireguard_peers finds in the text."""
+        expected = parse_wireguard_peers(HAND_EDITED_HUB)
+        assert dict(iter_wireguard_peers(make_source(HAND_EDITED_HUB))) == expected, f"Failed: {description}"
+
+    @pytest.mark.parametrize("description,make_source", source_cases)
+    def test_parse_wireguard_peers_accepts_source(self, description, make_source):
+        """parse_wireguard_peers accepts bytes and file objects too."""
+        expected = parse_wireguard_peers(HAND_EDITED_HUB)
+        assert parse_wireguard_peers(make_source(HAND_EDITED_HUB)) == expected, f"Failed: {description}"
+
+    file_cases = [case for case in source_cases if 'file' in case[0]]
+
+    @pytest.mark.parametrize("description,make_source", file_cases)
+    def test_file_is_left_open(self, description, make_source):
+        """The parsers never close a file they were handed; it belongs to the caller."""
+        for parse in (parse_wireguard_peers, lambda source: dict(iter_wireguard_peers(source))):
+            source = make_source(HAND_EDITED_HUB)
+            parse(source)
+            gc.collect()
+            assert not source.closed, f"Failed: {description}"
+            source.seek(0)
+            assert parse(source) == parse_wireguard_peers(HAND_EDITED_HUB), f"Failed: {description}"
+
+    def test_yields_before_reading_everything(self):
+        """Peers are produced while the source is still being read."""
+        lines_read = []
+
+        def lines():
+            for index in range(1000):
+                lines_read.append(index)
+                yield f"[Peer]\n# peer-{index}\nPublicKey = key{index}\nAllowedIPs = 10.0.{index // 256}.{index % 256}/32\n"
+
+        class LazyFile(io.TextIOBase):
+            def __iter__(self):
+                return (line for chunk in lines() for line in chunk.splitlines(keepends=True))
+
+        peers = iter_wireguard_peers(LazyFile())
+        assert next(peers) == ('peer-0', {'public_key': 'key0', 'allowed_ips': '10.0.0.0/32'})
+        assert len(lines_read) == 2
+        assert len(list(peers)) == 999
+
+    def test_empty_sources(self):
+        """Empty or missing input yields nothing."""
+        assert list(iter_wireguard_peers(None)) == []
+        assert list(iter_wireguard_peers(b'')) == []
+        assert list(iter_wireguard_peers(io.StringIO(''))) == []
+
+
+class TestSlurpSources:
+    """Tests for passing slurp results and base64 straight to the filters."""
+
+    @staticmethod
+    def slurp(text):
+        return {'content': base64.b64encode(text.encode('utf-8')).decode('ascii'),
+                'encoding': 'base64', 'source': '/etc/wireguard/wg0.conf', 'changed': False}
+
+    # A failed slurp (missing file, failed_when: false) and a skipped one carry no content
+    missing_cases = [
+        ("failed slurp", {'failed': True, 'msg': 'file not found: /etc/wireguard/wg0.conf', 'changed': False}),
+        ("skipped slurp", {'skipped': True, 'changed': False}),
+        ("empty content", {'content': '', 'encoding': 'base64'}),
+    ]
+
+    def test_slurp_result_matches_text(self):
+        """A slurp result parses like the text it carries."""
+        assert parse_wireguard_config(self.slurp(HAND_EDITED_HUB)) == parse_wireguard_config(HAND_EDITED_HUB)
+        assert parse_wireguard_peers(self.slurp(HAND_EDITED_HUB)) == parse_wireguard_peers(HAND_EDITED_HUB)
+
+    def test_base64_text_with_encoding(self):
+        """Bare base64 text is decoded when encoding='base64' is given."""
+        encoded = self.slurp(HAND_EDITED_HUB)['content']
+        assert parse_wireguard_peers(encoded, encoding='base64') == parse_wireguard_peers(HAND_EDITED_HUB)
+        assert parse_wireguard_config(encoded, 'base64') == parse_wireguard_config(HAND_EDITED_HUB)
+
+    @pytest.mark.parametrize("description,result", missing_cases)
+    def test_missing_config_is_empty(self, description, result):
+        """A slurp without content reads as an empty config."""
+        assert parse_wireguard_config(result) == {'interface': {}, 'peers': {}}, f"Failed: {description}"
+        assert parse_wireguard_peers(result) == {}, f"Failed: {description}"
+
+    def test_invalid_input_raises(self):
+        """Corrupt base64 and unknown encodings are reported, not parsed as text."""
+        with pytest.raises(AnsibleFilterError):
+            parse_wireguard_config({'content': 'not*base64', 'encoding': 'base64'})
+        with pytest.raises(AnsibleFilterError):
+            parse_wireguard_peers('W0ludGVyZmFjZV0K', encoding='rot13')
+
+    def test_non_utf8_bytes_are_kept(self):
+        """Undecodable bytes survive in the values instead of failing the parse."""
+        config = b"[Peer]\n# caf\xe9\nPublicKey = key\nAllowedIPs = 10.0.0.1/32\n"
+        assert list(parse_wireguard_peers(config)) == ['caf\udce9']
+
+    def test_delta_and_diff_accept_slurp(self):
+        """wireguard_peer_delta and diff_wireguard_configs take the slurp result directly."""
+        desired = HAND_EDITED_HUB.replace('10.130.5.3/32', '10.130.5.4/32')
+        delta = wireguard_peer_delta(self.slurp(HAND_EDITED_HUB), desired)
+        assert delta == wireguard_peer_delta(HAND_EDITED_HUB, desired)
+        assert delta['updated']
+
+        diff = diff_wireguard_configs(self.slurp(HAND_EDITED_HUB), desired)
+        assert diff == diff_wireguard_configs(HAND_EDITED_HUB, desired)
+        assert diff['unified']
+
+    @pytest.mark.parametrize("description,result", missing_cases)
+    def test_diff_against_missing_config(self, description, result):
+        """A missing deployed config diffs like the empty string (new deployment)."""
+        assert diff_wireguard_configs(result, HAND_EDITED_HUB) == diff_wireguard_configs('', HAND_EDITED_HUB), \
+            f"Failed: {description}"
+
+
+def _stat_result(text, **overrides):
+    """A registered stat result of a file holding text, taken with checksum_algorithm: sha256."""
+    stat = {'exists': True, 'checksum': hashlib.sha256(text.encode('utf-8')).hexdigest(), 'mtime': 1760000000.5}
+    return {'changed': False, 'stat': dict(stat, **overrides)}
+
+
+class TestPeerCache:
+    """Tests for the controller-side peer cache (wireguard_peer_cache_record / load_wireguard_peer_cache)."""
+
+    def saved(self, tmp_path, text=HAND_EDITED_HUB, public_key='hub-key'):
+        """Path of a cache file recorded from a slurp of text."""
+        record = wireguard_peer_cache_record(TestSlurpSources.slurp(text), _stat_result(text), public_key)
+        path = tmp_path / 'k8s.json'
+        path.write_text(json.dumps(record))
+        return path
+
+    def test_record(self):
+        """The record's digest is the stat checksum of the same bytes, whatever form the config came in."""
+        record = wireguard_peer_cache_record(TestSlurpSources.slurp(HAND_EDITED_HUB), _stat_result(HAND_EDITED_HUB),
+                                             'hub-key')
+        assert record == {
+            'version': 1,
+            'digest': _stat_result(HAND_EDITED_HUB)['stat']['checksum'],
+            'mtime': 1760000000.5,
+            'public_key': 'hub-key',
+            'peers': parse_wireguard_peers(HAND_EDITED_HUB),
+        }
+        assert wireguard_peer_cache_record(HAND_EDITED_HUB, _stat_result(HAND_EDITED_HUB), 'hub-key') == record
+        assert wireguard_peer_cache_record(HAND_EDITED_HUB.encode(), _stat_result(HAND_EDITED_HUB), 'hub-key') == record
+
+    def test_hit(self, tmp_path):
+        """An unchanged config loads the peers parsing it would give."""
+        path = self.saved(tmp_path)
+        cached = load_wireguard_peer_cache(str(path), _stat_result(HAND_EDITED_HUB), 'hub-key')
+        assert cached['peers'] == parse_wireguard_peers(HAND_EDITED_HUB)
+        # the bare stat dictionary works too, and the key check is optional
+        assert load_wireguard_peer_cache(str(path), _stat_result(HAND_EDITED_HUB)['stat']) == cached
+
+    # Test cases: (description, stat result, public key)
+    miss_cases = [
+        ("config edited", _stat_result(HAND_EDITED_HUB + '# edited\n'), 'hub-key'),
+        ("config removed", {'changed': False, 'stat': {'exists': False}}, 'hub-key'),
+        ("stat skipped", {'skipped': True, 'changed': False}, 'hub-key'),
+        ("no stat", None, 'hub-key'),
+        ("stat without checksum", _stat_result(HAND_EDITED_HUB, checksum=None), 'hub-key'),
+        ("keys rotated", _stat_result(HAND_EDITED_HUB), 'new-hub-key'),
+    ]
+
+    @pytest.mark.parametrize("description,config_stat,public_key", miss_cases)
+    def test_miss(self, tmp_path, description, config_stat, public_key):
+        path = self.saved(tmp_path)
+        assert load_wireguard_peer_cache(str(path), config_stat, public_key) == {}, f"Failed: {description}"
+
+    # Test cases: (description, cache file content, or None for no file)
+    bad_file_cases = [
+        ("no cache file", None),
+        ("truncated JSON", '{"version": 1, "digest": '),
+        ("not a record", '["peers"]'),
+        ("older record version", json.dumps({'version': 0, 'digest': _stat_result(HAND_EDITED_HUB)['stat']['checksum'],
+                                             'peers': {}})),
+        ("peers missing", json.dumps({'version': 1, 'digest': _stat_result(HAND_EDITED_HUB)['stat']['checksum']})),
+    ]
+
+    @pytest.mark.parametrize("description,content", bad_file_cases)
+    def test_unusable_cache_file(self, tmp_path, description, content):
+        path = tmp_path / 'k8s.json'
+        if content is not None:
+            path.write_text(content)
+        assert load_wireguard_peer_cache(str(path), _stat_result(HAND_EDITED_HUB)) == {}, f"Failed: {description}"
+
+    def test_wireguard_state_config(self, tmp_path):
+        """The wireguard_state module's config (parsed on the host) records and validates like a stat."""
+        stat = _stat_result(HAND_EDITED_HUB)['stat']
+        state_config = {'exists': True, 'checksum': stat['checksum'], 'mtime': stat['mtime'], 'unchanged': False,
+                        'interface': {}, 'peers': parse_wireguard_peers(HAND_EDITED_HUB)}
+        record = wireguard_peer_cache_record(state_config, state_config, 'hub-key')
+        assert record == wireguard_peer_cache_record(HAND_EDITED_HUB, stat, 'hub-key')
+
+        path = tmp_path / 'k8s.json'
+        path.write_text(json.dumps(record))
+        # an unchanged config comes back without its peers
+        unchanged = {'exists': True, 'checksum': stat['checksum'], 'mtime': stat['mtime'], 'unchanged': True}
+        assert load_wireguard_peer_cache(str(path), unchanged, 'hub-key') == record
+
+    # Test cases: (description, public key, expected digest)
+    digest_cases = [
+        ("usable record", 'hub-key', _stat_result(HAND_EDITED_HUB)['stat']['checksum']),
+        ("key check is optional", None, _stat_result(HAND_EDITED_HUB)['stat']['checksum']),
+        ("keys rotated", 'new-hub-key', ''),
+    ]
+
+    @pytest.mark.parametrize("description,public_key,expected", digest_cases)
+    def test_digest(self, tmp_path, description, public_key, expected):
+        path = self.saved(tmp_path)
+        assert wireguard_peer_cache_digest(str(path), public_key) == expected, f"Failed: {description}"
+
+    @pytest.mark.parametrize("description,content", bad_file_cases)
+    def test_digest_of_unusable_cache_file(self, tmp_path, description, content):
+        path = tmp_path / 'k8s.json'
+        if content is not None:
+            path.write_text(content)
+        assert wireguard_peer_cache_digest(str(path)) == '', f"Failed: {description}"
@@ -0,0 +1,159 @@
+"""Tests for the wireguard_keys filter plugin and the wireguard_keypair module."""
+
+import base64
+import os
+import stat
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add filter_plugins and library to path so we can import the plugin and the module
+sys.path.insert(0, str(Path(__file__).parent.parent / 'filter_plugins'))
+sys.path.insert(0, str(Path(__file__).parent.parent / 'library'))
+
+from wireguard_keypair import ensure_keypair, live_private_key
+from wireguard_keys import AnsibleFilterError, wireguard_pubkey
+
+
+def _b64(hex_bytes):
+    return base64.b64encode(bytes.fromhex(hex_bytes)).decode('ascii')
+
+
+# RFC 7748 section 6.1 (Alice and Bob)
+ALICE_PRIVATE = _b64('77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a')
+ALICE_PUBLIC = _b64('8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a')
+BOB_PRIVATE = _b64('5dab087e624a8a4b79e17f8b83800ee66f3bb1292618b6fd1c2f8b27ff88e0eb')
+BOB_PUBLIC = _b64('de9edb7d7b7dc1b4d35b61c2ece435373f8343c85b78674dadfc7e146f882b4f')
+
+
+class TestWireguardPubkey:
+    """Table-driven tests for wireguard_pubkey filter."""
+
+    test_cases = [
+        ("RFC 7748 Alice", ALICE_PRIVATE, ALICE_PUBLIC),
+        ("RFC 7748 Bob", BOB_PRIVATE, BOB_PUBLIC),
+        ("trailing newline from a key file", ALICE_PRIVATE + '\n', ALICE_PUBLIC),
+        # clamping ignores the low three and the top bit of the scalar
+        ("unclamped bits are ignored", _b64('ff' * 32), wireguard_pubkey(_b64('f8' + 'ff' * 30 + '7f'))),
+    ]
+
+    @pytest.mark.parametrize("description,private_key,expected", test_cases)
+    def test_wireguard_pubkey(self, description, private_key, expected):
+        """Test wireguard_pubkey against known keypairs."""
+        assert wireguard_pubkey(private_key) == expected, f"Failed: {description}"
+
+    invalid_cases = [
+        ("not base64", 'not a key!', "not valid base64"),
+        ("too short", base64.b64encode(b'\x01' * 16).decode(), "must be 32 bytes, got 16"),
+        ("empty", '', "must be 32 bytes, got 0"),
+        ("not a string", None, "expected a base64 key string, got NoneType"),
+    ]
+
+    @pytest.mark.parametrize("description,private_key,message", invalid_cases)
+    def test_invalid_keys(self, description, private_key, message):
+        with pytest.raises(AnsibleFilterError, match=message):
+            wireguard_pubkey(private_key)
+
+    def test_matches_reference_implementation(self):
+        """Random keys give the same public key as the cryptography package's X25519."""
+        x25519 = pytest.importorskip('cryptography.hazmat.primitives.asymmetric.x25519')
+        for _ in range(20):
+            raw = os.urandom(32)
+            expected = x25519.X25519PrivateKey.from_private_bytes(raw).public_key().public_bytes_raw()
+            assert wireguard_pubkey(base64.b64encode(raw).decode()) == base64.b64encode(expected).decode()
+
+
+def _genkey():
+    return base64.b64encode(os.urandom(32)).decode('ascii')
+
+
+LIVE_CONF = f"""[Interface]
+Address = 10.130.5.65/24
+ListenPort = 51820
+PrivateKey = {ALICE_PRIVATE}
+
+[Peer]
+# k8s
+PublicKey = {BOB_PUBLIC}
+AllowedIPs = 10.130.5.0/24
+"""
+
+
+class TestEnsureKeypair:
+    """The module's stat/migrate/generate/derive/load sequence against a scratch directory."""
+
+    # Test cases: (description, files present before, regenerate, expected actions, expected private key)
+    test_cases = [
+        ("persisted pair is loaded", {'key': BOB_PRIVATE, 'pub': BOB_PUBLIC}, False, [], BOB_PRIVATE),
+        ("persisted key wins over the live config", {'key': BOB_PRIVATE, 'pub': BOB_PUBLIC, 'conf': LIVE_CONF},
+         False, [], BOB_PRIVATE),
+        ("missing public key is derived", {'key': BOB_PRIVATE}, False, ['derived'], BOB_PRIVATE),
+        ("live config key is migrated", {'conf': LIVE_CONF}, False, ['migrated', 'derived'], ALICE_PRIVATE),
+        ("stale public key is replaced on migration", {'conf': LIVE_CONF, 'pub': BOB_PUBLIC}, False,
+         ['migrated', 'derived'], ALICE_PRIVATE),
+        ("new host generates a key", {}, False, ['generated', 'derived'], None),
+        ("config without a private key generates one", {'conf': '[Interface]\nAddress = 10.130.5.65/24\n'},
+         False, ['generated', 'derived'], None),
+        ("regenerate discards the pair and skips migration",
+         {'key': BOB_PRIVATE, 'pub': BOB_PUBLIC, 'conf': LIVE_CONF}, True, ['removed', 'generated', 'derived'], None),
+        ("regenerate on a new host", {}, True, ['generated', 'derived'], None),
+    ]
+
+    @pytest.mark.parametrize("description,files,regenerate,actions,private_key", test_cases)
+    def test_ensure_keypair(self, tmp_path, description, files, regenerate, actions, private_key):
+        for suffix, content in files.items():
+            (tmp_path / f'wg0.{suffix}').write_text(content + '\n')
+
+        result = ensure_keypair(str(tmp_path), 'wg0', regenerate, _genkey, wireguard_pubkey)
+
+        assert result['actions'] == actions, f"Failed: {description}"
+        assert result['changed'] == bool(actions), f"Failed: {description}"
+        if private_key is not None:
+            assert result['private_key'] == private_key, f"Failed: {description}"
+        else:
+            assert result['private_key'] not in (BOB_PRIVATE, ALICE_PRIVATE), f"Failed: {description}"
+        assert result['public_key'] == wireguard_pubkey(result['private_key']), f"Failed: {description}"
+        assert (tmp_path / 'wg0.key').read_text() == result['private_key'] + '\n', f"Failed: {description}"
+        assert (tmp_path / 'wg0.pub').read_text() == result['public_key'] + '\n', f"Failed: {description}"
+
+    def test_second_run_is_unchanged(self, tmp_path):
+        first = ensure_keypair(str(tmp_path), 'wg1', False, _genkey, wireguard_pubkey)
+        second = ensure_keypair(str(tmp_path), 'wg1', False, _genkey, wireguard_pubkey)
+        assert second == dict(first, changed=False, actions=[])
+
+    def test_written_keys_are_private(self, tmp_path):
+        ensure_keypair(str(tmp_path), 'wg0', False, _genkey, wireguard_pubkey)
+        for suffix in ('key', 'pub'):
+            assert stat.S_IMODE((tmp_path / f'wg0.{suffix}').stat().st_mode) == 0o600
+
+    def test_check_mode_writes_nothing(self, tmp_path):
+        (tmp_path / 'wg0.conf').write_text(LIVE_CONF)
+        result = ensure_keypair(str(tmp_path), 'wg0', False, _genkey, wireguard_pubkey, check_mode=True)
+        assert result == {'changed': True, 'private_key': ALICE_PRIVATE, 'public_key': '',
+                          'actions': ['migrated', 'derived']}
+        assert sorted(path.name for path in tmp_path.iterdir()) == ['wg0.conf']
+
+        result = ensure_keypair(str(tmp_path), 'wg0', True, _genkey, wireguard_pubkey, check_mode=True)
+        assert result == {'changed': True, 'private_key': '', 'public_key': '', 'actions': ['generated', 'derived']}
+
+
+class TestLivePrivateKey:
+    """Table-driven tests for reading the PrivateKey of a live wg-quick config."""
+
+    test_cases = [
+        ("interface key", LIVE_CONF, ALICE_PRIVATE),
+        ("case and spacing", f"[interface]\n  privatekey={ALICE_PRIVATE}  # managed\n", ALICE_PRIVATE),
+        ("peer section is not the interface", f"[Peer]\nPrivateKey = {BOB_PRIVATE}\n", None),
+        ("commented out", f"[Interface]\n# PrivateKey = {ALICE_PRIVATE}\n", None),
+        ("empty value", "[Interface]\nPrivateKey =\n", None),
+    ]
+
+    @pytest.mark.parametrize("description,conf,expected", test_cases)
+    def test_live_private_key(self, tmp_path, description, conf, expected):
+        path = tmp_path / 'wg0.conf'
+        path.write_text(conf)
+        assert live_private_key(str(path)) == expected, f"Failed: {description}"
+
+    def test_missing_config(self, tmp_path):
+        assert live_private_key(str(tmp_path / 'wg0.conf')) is None
@@ -0,0 +1,194 @@
+"""Tests for the wireguard_state module."""
+
+import hashlib
+import json
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+# Add filter_plugins, library and module_utils to path so we can import the filters and the module
+sys.path.insert(0, str(Path(__file__).parent.parent / 'filter_plugins'))
+sys.path.insert(0, str(Path(__file__).parent.parent / 'library'))
+sys.path.insert(0, str(Path(__file__).parent.parent / 'module_utils'))
+
+from wireguard_filters import parse_wireguard_config
+from wireguard_state import collect_state, parse_config, parse_link, parse_ping
+
+HUB_DUMP = (
+    "wg0\tHUBPRIVATE=\tHUBPUBLIC=\t51820\toff\n"
+    "wg0\tWORKER1KEY=\t(none)\t192.168.1.10:51820\t10.130.5.3/32\t1700000000\t1024\t2048\t25\n"
+    "wg0\tSTATICKEY=\tPSK=\t(none)\t10.130.5.201/32,fd00::1/128\t0\t0\t0\toff\n"
+    "wg1\tOTHERPRIVATE=\tOTHERPUBLIC=\t0\t0x1\n"
+)
+
+HUB_CONF = """[Interface]
+Address = 10.130.5.1/24
+ListenPort = 51820
+PrivateKey = HUBPRIVATE=
+# PublicKey = HUBPUBLIC=
+
+[Peer]
+# cm4
+PublicKey = WORKER1KEY=
+AllowedIPs = 10.130.5.3/32
+
+[Peer]
+# iphone
+PublicKey = STATICKEY=
+PresharedKey = PSK=
+AllowedIPs = 10.130.5.201/32
+AllowedIPs = fd00::1/128
+"""
+
+IP_ADDR_JSON = json.dumps([{
+    'ifindex': 5, 'ifname': 'wg0', 'flags': ['POINTOPOINT', 'NOARP', 'UP', 'LOWER_UP'], 'mtu': 1420,
+    'operstate': 'UNKNOWN',
+    'addr_info': [{'family': 'inet', 'local': '10.130.5.1', 'prefixlen': 24, 'scope': 'global', 'label': 'wg0'}],
+}])
+
+PING_OUTPUT = """PING 10.130.5.1 (10.130.5.1) 56(84) bytes of data.
+
+--- 10.130.5.1 ping statistics ---
+3 packets transmitted, 2 received, 33.3333% packet loss, time 2003ms
+rtt min/avg/max/mdev = 11.204/12.310/13.416/1.106 ms
+"""
+
+
+class TestParseConfig:
+    """parse_config shares its scanner with the filters; only the secrets differ."""
+
+    def test_matches_filters_without_secrets(self):
+        expected = parse_wireguard_config(HUB_CONF)
+        expected['interface'].pop('privatekey')
+        parsed = parse_config(HUB_CONF)
+        assert parsed == expected
+        assert 'PRIVATE' not in json.dumps(parsed) and 'PSK' not in json.dumps(parsed)
+
+
+class TestParseLink:
+    """Table-driven tests for parse_link."""
+
+    test_cases = [
+        ("interface up", IP_ADDR_JSON,
+         {'exists': True, 'up': True, 'operstate': 'UNKNOWN', 'mtu': 1420, 'addresses': ['10.130.5.1/24']}),
+        ("interface missing", '', {'exists': False, 'up': False, 'operstate': None, 'mtu': None, 'addresses': []}),
+        ("administratively down, no address",
+         json.dumps([{'ifname': 'wg0', 'flags': ['POINTOPOINT', 'NOARP'], 'mtu': 1420, 'operstate': 'DOWN',
+                      'addr_info': []}]),
+         {'exists': True, 'up': False, 'operstate': 'DOWN', 'mtu': 1420, 'addresses': []}),
+        ("unparseable output", 'Device "wg0" does not exist.',
+         {'exists': False, 'up': False, 'operstate': None, 'mtu': None, 'addresses': []}),
+    ]
+
+    @pytest.mark.parametrize("description,output,expected", test_cases)
+    def test_parse_link(self, description, output, expected):
+        assert parse_link(output) == expected, f"Failed: {description}"
+
+
+class TestParsePing:
+    """Table-driven tests for parse_ping."""
+
+    test_cases = [
+        ("partial loss", 0, PING_OUTPUT, {'rc': 0, 'transmitted': 3, 'received': 2, 'rtt_avg_ms': 12.31}),
+        ("unreachable", 1, "3 packets transmitted, 0 received, 100% packet loss, time 2040ms\n",
+         {'rc': 1, 'transmitted': 3, 'received': 0, 'rtt_avg_ms': None}),
+        ("busybox wording", 0,
+         "3 packets transmitted, 3 packets received, 0% packet loss\nround-trip min/avg/max = 1.0/2.5/4.0 ms\n",
+         {'rc': 0, 'transmitted': 3, 'received': 3, 'rtt_avg_ms': 2.5}),
+        ("ping missing", 127, "", {'rc': 127, 'transmitted': 0, 'received': 0, 'rtt_avg_ms': None}),
+    ]
+
+    @pytest.mark.parametrize("description,rc,output,expected", test_cases)
+    def test_parse_ping(self, description, rc, output, expected):
+        assert parse_ping(rc, output) == expected, f"Failed: {description}"
+
+
+class FakeHost:
+    """Records the commands collect_state runs and answers them like a live hub."""
+
+    def __init__(self, up=True):
+        self.up = up
+        self.commands = []
+
+    def __call__(self, argv):
+        self.commands.append(argv)
+        if argv[0] == 'ip':
+            return (0, IP_ADDR_JSON, '') if self.up else (1, '', 'Device "wg0" does not exist.')
+        if argv[0] == 'wg':
+            return 0, HUB_DUMP if self.up else '', ''
+        if argv[0] == 'ping':
+            return 0, PING_OUTPUT, ''
+        raise AssertionError(f"unexpected command {argv}")
+
+
+class TestCollectState:
+    """collect_state against a scratch /etc/wireguard and a fake host."""
+
+    @pytest.fixture
+    def directory(self, tmp_path):
+        (tmp_path / 'wg0.conf').write_text(HUB_CONF)
+        (tmp_path / 'wg0.key').write_text('HUBPRIVATE=\n')
+        (tmp_path / 'wg0.key').chmod(0o600)
+        (tmp_path / 'wg0.pub').write_text('HUBPUBLIC=\n')
+        return tmp_path
+
+    def test_live_hub(self, directory):
+        host = FakeHost()
+        state = collect_state('wg0', str(directory), host, ping=['10.130.5.2'], now=1700000090)
+
+        assert state['link']['up'] is True
+        config = state['config']
+        assert config['exists'] and not config['unchanged']
+        assert config['checksum'] == hashlib.sha256(HUB_CONF.encode()).hexdigest()
+        assert config['peers'] == parse_config(HUB_CONF)['peers']
+        # live peers are named after the config's comments
+        assert list(state['dump']['peers']) == ['cm4', 'iphone']
+        assert state['handshake_ages'] == {'cm4': 90, 'iphone': None}
+        assert state['keys'] == {'private_key': {'exists': True, 'mode': '0600'}, 'public_key': 'HUBPUBLIC=',
+                                 'matches_live': True}
+        assert state['ping'] == {'10.130.5.2': {'rc': 0, 'transmitted': 3, 'received': 2, 'rtt_avg_ms': 12.31}}
+        assert [argv[0] for argv in host.commands] == ['ip', 'wg', 'ping']
+        assert 'PRIVATE' not in json.dumps(state) and 'PSK' not in json.dumps(state)
+
+    def test_known_checksum_leaves_config_out(self, directory):
+        checksum = hashlib.sha256(HUB_CONF.encode()).hexdigest()
+        state = collect_state('wg0', str(directory), FakeHost(), config_checksum=checksum)
+        assert state['config']['unchanged'] is True
+        assert 'peers' not in state['config'] and 'interface' not in state['config']
+        # the dump is still named from the config
+        assert list(state['dump']['peers']) == ['cm4', 'iphone']
+
+    def test_new_host(self, tmp_path):
+        state = collect_state('wg0', str(tmp_path), FakeHost(up=False))
+        assert state['link']['exists'] is False
+        assert state['config'] == {'exists': False, 'checksum': None, 'mtime': None, 'unchanged': False,
+                                   'interface': {}, 'peers': {}}
+        assert state['dump'] == {'interface': {}, 'peers': {}}
+        assert state['keys'] == {'private_key': {'exists': False, 'mode': None}, 'public_key': '',
+                                 'matches_live': None}
+        assert state['handshake_ages'] == {} and state['ping'] == {}
+
+    def test_rotated_key_not_live_yet(self, directory):
+        (directory / 'wg0.pub').write_text('NEWPUBLIC=\n')
+        state = collect_state('wg0', str(directory), FakeHost())
+        assert state['keys']['matches_live'] is False
+
+    def test_pings_run_concurrently(self, tmp_path):
+        """Every target is probed at once: each fake ping waits until all of them have started."""
+        targets = ['10.130.5.1', '10.130.5.65', '10.130.5.66', '10.130.5.67']
+        started = threading.Barrier(len(targets), timeout=5)
+        commands = []
+
+        def run(argv):
+            if argv[0] != 'ping':
+                return 1, '', ''
+            commands.append(argv)
+            started.wait()  # raises BrokenBarrierError if the pings ran one after another
+            return 0, PING_OUTPUT, ''
+
+        state = collect_state('wg0', str(tmp_path), run, ping=targets + targets[:1], ping_count=5, ping_interval=0.2)
+        assert list(state['ping']) == targets
+        assert sorted(argv[-1] for argv in commands) == targets
+        assert commands[0][:-1] == ['ping', '-q', '-n', '-c', '5', '-i', '0.2', '-W', '2']
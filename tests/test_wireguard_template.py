@@ -9,6 +9,27 @@ from jinja2 import Environment, FileSystemLoader, StrictUndefined
 # Add filter_plugins to path for custom filters
 sys.path.insert(0, str(Path(__file__).parent.parent / 'filter_plugins'))
 
+from wireguard_filters import render_wireguard_config, wireguard_direct_peer_index, wireguard_topology
+
+
+def wireguard_jinja_env():
+    """Jinja2 environment for the role's templates, with the Ansible filters they use.
+
+    Shared with the benchmark suite so it times the same rendering these tests check.
+    """
+    template_dir = Path(__file__).parent.parent / 'roles' / 'wireguard' / 'templates'
+    env = Environment(
+        loader=FileSystemLoader(str(template_dir)),
+        undefined=StrictUndefined,
+        trim_blocks=True,
+        lstrip_blocks=True,
+        keep_trailing_newline=True,
+    )
+    # Register Ansible built-in filters used by the template
+    env.filters['dict2items'] = lambda d: [{'key': k, 'value': v} for k, v in sorted(d.items())]
+    env.filters['extract'] = lambda key, container: container[key]
+    return env
+
 
 class TestWireguardTemplate:
     """Table-driven tests for wg0.conf.j2 template rendering."""
@@ -16,18 +37,7 @@ class TestWireguardTemplate:
     @pytest.fixture
     def jinja_env(self):
         """Set up Jinja2 environment with template directory and custom filters."""
-        template_dir = Path(__file__).parent.parent / 'roles' / 'wireguard' / 'templates'
-        env = Environment(
-            loader=FileSystemLoader(str(template_dir)),
-            undefined=StrictUndefined,
-            trim_blocks=True,
-            lstrip_blocks=True,
-            keep_trailing_newline=True,
-        )
-        # Register Ansible built-in filters used by the template
-        env.filters['dict2items'] = lambda d: [{'key': k, 'value': v} for k, v in sorted(d.items())]
-        env.filters['extract'] = lambda key, container: container[key]
-        return env
+        return wireguard_jinja_env()
 
     # Test cases: (description, context, expected_output)
     test_cases = [
@@ -882,6 +892,19 @@ PrivateKey = aDUMMYprivateKEY1234567890abcdefGHIJKLMNOP=
         # Also do strict equality check
         assert actual == expected, f"Failed: {description}"
 
+    @pytest.mark.parametrize("description,context,expected", test_cases)
+    def test_native_rendering(self, description, context, expected):
+        """The render_wireguard_config filter must match the template byte-for-byte."""
+        hostvars = context.get('hostvars', {})
+        topology = wireguard_topology(context, hostvars, context['groups'])
+        actual = render_wireguard_config(topology)
+        assert actual == expected, f"Failed: {description}"
+
+        # Same output when the direct-peer index is precomputed once per play
+        index = wireguard_direct_peer_index(hostvars, context['groups'].get('all', []))
+        topology = wireguard_topology(context, hostvars, context['groups'], index)
+        assert render_wireguard_config(topology) == expected, f"Failed with index: {description}"
+
 
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
@@ -0,0 +1,294 @@
+"""Table-driven tests for the wireguard_zones filter plugin."""
+
+import ipaddress
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add filter_plugins to path so we can import the module
+sys.path.insert(0, str(Path(__file__).parent.parent / 'filter_plugins'))
+
+from wireguard_zones import (
+    AddressPool,
+    AnsibleFilterError,
+    ZoneResolver,
+    main,
+    wireguard_allocate_ip,
+    wireguard_allocate_zone,
+    wireguard_assigned_ips,
+    wireguard_free_blocks,
+    wireguard_zone_of,
+    zone_resolver,
+)
+
+# The plan in inventory.yml, plus an IPv6 zone
+ZONES = {
+    'oci': '10.130.5.0/29',
+    'home-static': '10.130.5.64/27',
+    'owned-mobile': '10.130.5.96/28',
+    'external-static': '10.130.5.128/28',
+    'external-mobile': '10.130.5.144/28',
+    'v6-lab': 'fd00:130::/64',
+}
+
+
+class TestWireguardZoneOf:
+    """Tests for the wireguard_zone_of filter."""
+
+    # Test cases: (description, address, expected zone)
+    test_cases = [
+        ("control plane", "10.130.5.1", "oci"),
+        ("zone network address", "10.130.5.0", "oci"),
+        ("zone broadcast address", "10.130.5.7", "oci"),
+        ("first address of a zone", "10.130.5.64", "home-static"),
+        ("last address of a zone", "10.130.5.95", "home-static"),
+        ("adjacent zone", "10.130.5.96", "owned-mobile"),
+        ("unassigned block between zones", "10.130.5.8", None),
+        ("after the last zone", "10.130.5.200", None),
+        ("before the first zone", "10.130.4.255", None),
+        ("static peer allowed_ips", "10.130.5.97/32", "owned-mobile"),
+        ("sub-block inside a zone", "10.130.5.68/30", "home-static"),
+        ("block spanning two zones", "10.130.5.64/26", None),
+        ("IPv6 address", "fd00:130::5", "v6-lab"),
+        ("IPv6 outside every zone", "fd00:131::5", None),
+        ("missing address", None, None),
+        ("empty address", "", None),
+        ("malformed address", "10.130.5.300", None),
+    ]
+
+    @pytest.mark.parametrize("description,address,expected", test_cases)
+    def test_wireguard_zone_of(self, description, address, expected):
+        assert wireguard_zone_of(address, ZONES) == expected, f"Failed: {description}"
+
+    def test_matches_linear_scan(self):
+        """Every address of the overlay resolves like a scan over all zones would."""
+        networks = {name: ipaddress.ip_network(cidr) for name, cidr in ZONES.items()}
+        for address in ipaddress.ip_network('10.130.4.0/23'):
+            hits = [name for name, net in networks.items() if address in net]
+            expected = hits[0] if len(hits) == 1 else None
+            assert wireguard_zone_of(str(address), ZONES) == expected, str(address)
+
+    def test_resolver_is_reused(self):
+        assert zone_resolver(ZONES) is zone_resolver(dict(ZONES))
+
+    def test_no_zones(self):
+        assert wireguard_zone_of('10.130.5.1', {}) is None
+        assert wireguard_zone_of('10.130.5.1', None) is None
+
+
+class TestZoneResolver:
+    """Tests for overlap detection when a resolver is built."""
+
+    # Test cases: (description, zones, expected overlapping pairs)
+    overlap_cases = [
+        ("disjoint", ZONES, []),
+        ("adjacent blocks", {'a': '10.0.0.0/25', 'b': '10.0.0.128/25'}, []),
+        ("nested", {'inner': '10.0.0.64/26', 'outer': '10.0.0.0/24'}, [('outer', 'inner')]),
+        ("identical", {'a': '10.0.0.0/24', 'b': '10.0.0.0/24'}, [('a', 'b')]),
+        (
+            "two nested in one",
+            {'outer': '10.0.0.0/24', 'x': '10.0.0.0/26', 'y': '10.0.0.128/26'},
+            [('outer', 'x'), ('outer', 'y')],
+        ),
+        ("same range in both families", {'v4': '10.0.0.0/8', 'v6': '::a00:0/104'}, []),
+    ]
+
+    @pytest.mark.parametrize("description,zones,expected", overlap_cases)
+    def test_overlaps(self, description, zones, expected):
+        assert ZoneResolver(zones, strict=False).overlaps == expected, f"Failed: {description}"
+
+    def test_strict_rejects_overlap(self):
+        with pytest.raises(AnsibleFilterError, match=r"outer \(10.0.0.0/24\) and inner \(10.0.0.64/26\)"):
+            ZoneResolver({'outer': '10.0.0.0/24', 'inner': '10.0.0.64/26'})
+
+    def test_filter_rejects_overlap(self):
+        with pytest.raises(AnsibleFilterError, match="overlap"):
+            wireguard_zone_of('10.0.0.1', {'a': '10.0.0.0/24', 'b': '10.0.0.0/25'})
+
+    def test_invalid_cidr(self):
+        with pytest.raises(AnsibleFilterError, match="zone 'bad' has an invalid CIDR") as excinfo:
+            ZoneResolver({'bad': '10.0.0.1/24'})
+        assert isinstance(excinfo.value.__cause__, ValueError)
+
+    def test_shared_addresses_are_ambiguous(self):
+        """With strict=False, only addresses covered by one zone resolve."""
+        resolver = ZoneResolver({'outer': '10.0.0.0/24', 'inner': '10.0.0.64/26'}, strict=False)
+        assert resolver.zone_of('10.0.0.1') == 'outer'
+        assert resolver.zone_of('10.0.0.65') is None
+        assert resolver.zone_of('10.0.0.200') == 'outer'
+
+    def test_many_zones(self):
+        """Thousands of zones resolve correctly (each lookup is one bisect)."""
+        zones = {f'z{i}': f'10.{i >> 6}.{(i & 63) << 2}.0/30' for i in range(4096)}
+        resolver = ZoneResolver(zones)
+        assert resolver.zone_of('10.63.252.1') == 'z4095'
+        assert resolver.zone_of('10.0.0.3') == 'z0'
+        assert resolver.zone_of('10.0.0.4') is None
+
+
+# Addresses assigned in inventory.yml (hosts and static peers)
+ASSIGNED = [
+    '10.130.5.1', '10.130.5.65', '10.130.5.66', '10.130.5.67', '10.130.5.68', '10.130.5.2',
+    '10.130.5.97/32', '10.130.5.98/32', '10.130.5.145/32', '10.130.5.147/32',
+]
+PLAN = {name: cidr for name, cidr in ZONES.items() if name != 'v6-lab'}
+
+
+class TestWireguardAllocateIp:
+    """Tests for the wireguard_allocate_ip filter."""
+
+    # Test cases: (description, zone, used, count, expected)
+    test_cases = [
+        ("next free host address", "home-static", ASSIGNED, None, "10.130.5.69"),
+        ("fills a gap first", "external-mobile", ASSIGNED, None, "10.130.5.146"),
+        ("empty zone skips the network address", "external-static", ASSIGNED, None, "10.130.5.129"),
+        ("batch", "owned-mobile", ASSIGNED, 3, ["10.130.5.99", "10.130.5.100", "10.130.5.101"]),
+        ("zone given as CIDR", "10.130.5.96/28", ASSIGNED, None, "10.130.5.99"),
+        ("a used block is skipped whole", "home-static", ["10.130.5.64/29"], None, "10.130.5.72"),
+        ("addresses outside the zone are ignored", "oci", ["10.130.5.65", "fd00::1"], None, "10.130.5.1"),
+        ("last free address", "oci", [f"10.130.5.{i}" for i in range(1, 6)], None, "10.130.5.6"),
+        ("no used addresses", "oci", None, 2, ["10.130.5.1", "10.130.5.2"]),
+    ]
+
+    @pytest.mark.parametrize("description,zone,used,count,expected", test_cases)
+    def test_wireguard_allocate_ip(self, description, zone, used, count, expected):
+        assert wireguard_allocate_ip(zone, used, PLAN, count) == expected, f"Failed: {description}"
+
+    # Test cases: (description, zone, used, count, error pattern)
+    error_cases = [
+        ("zone full", "oci", [f"10.130.5.{i}" for i in range(1, 7)], None, "fewer than 1 free"),
+        ("not enough for the batch", "oci", ASSIGNED, 5, "fewer than 5 free"),
+        ("unknown zone", "nowhere", ASSIGNED, None, "unknown WireGuard zone 'nowhere'"),
+        ("malformed used address", "oci", ["10.130.5.x"], None, "not an IP address"),
+        ("IPv6 zone", "fd00::/64", [], None, "not an IPv4 network"),
+        ("zone larger than a /16", "10.0.0.0/8", [], None, "larger than a /16"),
+    ]
+
+    @pytest.mark.parametrize("description,zone,used,count,pattern", error_cases)
+    def test_errors(self, description, zone, used, count, pattern):
+        with pytest.raises(AnsibleFilterError, match=pattern):
+            wireguard_allocate_ip(zone, used, PLAN, count)
+
+    @pytest.mark.parametrize("zone,used", [("nowhere", ASSIGNED), ("oci", ["10.130.5.x"])])
+    def test_errors_keep_the_ipaddress_cause(self, zone, used):
+        with pytest.raises(AnsibleFilterError) as excinfo:
+            wireguard_allocate_ip(zone, used, PLAN)
+        assert isinstance(excinfo.value.__cause__, ValueError)
+
+    def test_large_zone(self):
+        """A /16 zone with 60k addresses taken still allocates in one pass."""
+        used = [str(ipaddress.ip_address('10.200.0.0') + i) for i in range(60_000)]
+        assert wireguard_allocate_ip('10.200.0.0/16', used, count=2) == ['10.200.234.96', '10.200.234.97']
+
+
+class TestWireguardAllocateZone:
+    """Tests for the wireguard_allocate_zone and wireguard_free_blocks filters."""
+
+    # Test cases: (description, prefixlen, used, expected)
+    test_cases = [
+        ("smallest gap that fits", 29, ASSIGNED, "10.130.5.8/29"),
+        ("/28 skips the /29 gap", 28, ASSIGNED, "10.130.5.16/28"),
+        ("/27", 27, ASSIGNED, "10.130.5.32/27"),
+        ("/26 is only free at the end", 26, ASSIGNED, "10.130.5.192/26"),
+        ("an address outside any zone blocks its gap", 29, ["10.130.5.9"], "10.130.5.16/29"),
+    ]
+
+    @pytest.mark.parametrize("description,prefixlen,used,expected", test_cases)
+    def test_wireguard_allocate_zone(self, description, prefixlen, used, expected):
+        assert wireguard_allocate_zone('10.130.5.0/24', PLAN, prefixlen, used) == expected, f"Failed: {description}"
+
+    def test_no_room(self):
+        with pytest.raises(AnsibleFilterError, match="no free /25"):
+            wireguard_allocate_zone('10.130.5.0/24', PLAN, 25)
+
+    def test_free_blocks(self):
+        """The unassigned blocks listed by hand in inventory.yml."""
+        assert wireguard_free_blocks('10.130.5.0/24', PLAN, ASSIGNED) == [
+            '10.130.5.8/29', '10.130.5.16/28', '10.130.5.32/27',
+            '10.130.5.112/28', '10.130.5.160/27', '10.130.5.192/26',
+        ]
+
+    def test_free_blocks_empty_plan(self):
+        assert wireguard_free_blocks('10.130.5.0/24', {}) == ['10.130.5.0/24']
+
+
+class TestAddressPool:
+    """Tests for the bitmap behind the allocators."""
+
+    def test_matches_naive_allocation(self):
+        """allocate_block agrees with trying every aligned block in order."""
+        network = ipaddress.ip_network('10.0.0.0/24')
+        taken = [ipaddress.ip_network(n) for n in ('10.0.0.3/32', '10.0.0.16/29', '10.0.0.70/31', '10.0.0.128/26')]
+        for prefixlen in range(24, 33):
+            pool = AddressPool(network)
+            pool.take(*taken)
+            expected = next((block for block in network.subnets(new_prefix=prefixlen)
+                             if not any(block.overlaps(net) for net in taken)), None)
+            assert pool.allocate_block(prefixlen) == expected, prefixlen
+
+    # Test cases: (description, network, error pattern)
+    rejected_cases = [
+        ("IPv6", "fd00::/120", "not an IPv4 network"),
+        ("larger than a /16", "10.0.0.0/15", r"larger than a /16"),
+    ]
+
+    @pytest.mark.parametrize("description,network,pattern", rejected_cases)
+    def test_rejects_networks_too_large_for_a_bitmap(self, description, network, pattern):
+        with pytest.raises(AnsibleFilterError, match=pattern):
+            AddressPool(network)
+
+    def test_allocations_are_taken(self):
+        pool = AddressPool('10.0.0.0/29', reserve_edges=True)
+        assert pool.allocate(2) == ['10.0.0.1', '10.0.0.2']
+        assert pool.allocate_block(31) == ipaddress.ip_network('10.0.0.4/31')
+        assert pool.allocate(2) == ['10.0.0.3', '10.0.0.6']
+        assert pool.allocate() is None
+
+
+class TestWireguardAssignedIps:
+    """Tests for the wireguard_assigned_ips filter."""
+
+    def test_hosts_and_static_peers(self):
+        hostvars = {
+            'k8s': {'wireguard_ip': '10.130.5.1'},
+            'cm4': {'wireguard_ip': '10.130.5.65'},
+            'new': {},
+        }
+        static_peers = {
+            'phone': {'allowed_ips': '10.130.5.98/32'},
+            'router': {'allowed_ips': '10.130.5.100/30, 10.130.5.104/32'},
+        }
+        assert wireguard_assigned_ips(hostvars, ['k8s', 'cm4', 'new'], static_peers) == [
+            '10.130.5.1', '10.130.5.65', '10.130.5.98/32', '10.130.5.100/30', '10.130.5.104/32',
+        ]
+
+
+class TestCli:
+    """Tests for the command-line allocator over inventory.yml."""
+
+    # Test cases: (description, arguments, expected output, exit code)
+    test_cases = [
+        ("next home address", ["allocate", "home-static"], "10.130.5.69\n", 0),
+        ("batch", ["allocate", "owned-mobile", "--count", "2"], "10.130.5.99\n10.130.5.100\n", 0),
+        ("new zone", ["new-zone", "27"], "10.130.5.32/27\n", 0),
+        ("free blocks", ["free"],
+         "10.130.5.8/29\n10.130.5.16/28\n10.130.5.32/27\n10.130.5.112/28\n10.130.5.160/27\n10.130.5.192/26\n", 0),
+        ("zone full", ["allocate", "oci", "--count", "9"], "", 1),
+    ]
+
+    @pytest.mark.parametrize("description,arguments,expected,code", test_cases)
+    def test_cli(self, capsys, description, arguments, expected, code):
+        assert main(arguments) == code, f"Failed: {description}"
+        assert capsys.readouterr().out == expected, f"Failed: {description}"
+
+    def test_synthetic_inventory(self, tmp_path, capsys):
+        """Allocation against a generated inventory of thousands of hosts."""
+        from synthetic_inventory import generate_inventory, main as generate
+
+        inventory = tmp_path / 'inventory.yml'
+        generate(['--hosts', '1000', '-o', str(inventory)])
+        assert main(['-i', str(inventory), 'allocate', 'home-static']) == 0
+        address = capsys.readouterr().out.strip()
+        zones = generate_inventory(1000)['all']['vars']['wireguard_zones']
+        assert wireguard_zone_of(address, zones) == 'home-static'